@@ -58,11 +58,26 @@ from backy.utils import BackyJSONEncoder, format_datetime_local, generate_taskid
 # check (job)
 # show-jobs (job def: all)          List status of all known jobs (integrated with log?)
 # show-daemon         Daemon status
+# show-load           Estimated load over the schedule interval
+# show-phases (job def: current)   Where backups spend their time
 # reload
 
 # maybe add a common --repo/--job <regex> flag?
 
 
+def format_seconds(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds:.1f}s"
+
+
+def phase_names(revs: List[Revision]) -> List[str]:
+    """The backup phases recorded in `revs`, longest first."""
+    totals: Dict[str, float] = {}
+    for r in revs:
+        for name, phase in r.stats.get("phases", {}).items():
+            totals[name] = totals.get(name, 0) + phase["duration"]
+    return sorted(totals, key=lambda n: totals[n], reverse=True)
+
+
 class Command(object):
     """Proxy between CLI calls and actual backup code."""
 
@@ -172,11 +187,16 @@ class Command(object):
             else:
                 print(rev.info_filename)
 
-    def log_(self, repo: Repository, json_: bool, revision: str) -> None:
+    def log_(
+        self, repo: Repository, json_: bool, revision: str, phases: bool
+    ) -> None:
         revs = repo.find_revisions(revision)
         if json_:
             print(BackyJSONEncoder().encode([r.to_dict() for r in revs]))
             return
+        if phases:
+            self._log_phases(revs)
+            return
         total_bytes = 0
 
         tz = tzlocal.get_localzone()
@@ -230,6 +250,28 @@ class Command(object):
             )
         )
 
+    def _log_phases(self, revs: List[Revision]) -> None:
+        names = phase_names(revs)
+        tz = tzlocal.get_localzone()
+        t = Table(
+            f"Date ({tz})",
+            "ID",
+            Column("Duration", justify="right"),
+            *(Column(name, justify="right") for name in names),
+        )
+        for r in revs:
+            phases = r.stats.get("phases", {})
+            t.add_row(
+                format_datetime_local(r.timestamp)[0],
+                r.uuid,
+                format_seconds(r.stats.get("duration")),
+                *(
+                    format_seconds(phases.get(name, {}).get("duration"))
+                    for name in names
+                ),
+            )
+        rprint(t)
+
     async def backup(
         self, repos: List[Repository], bg: bool, tags: str, force: bool
     ) -> int:
@@ -367,9 +409,7 @@ class Command(object):
             log.critical(
                 "check-sla-violation",
                 last_time=str(
-                    repo.clean_history[-1].timestamp
-                    if repo.clean_history
-                    else None
+                    repo.last_clean.timestamp if repo.last_clean else None
                 ),
                 sla_overdue=repo.sla_overdue,
             )
@@ -451,6 +491,92 @@ class Command(object):
             t.add_row(state, str(state_summary[state]))
         rprint(t)
 
+    async def show_load(self):
+        """Show the estimated load over the largest schedule interval."""
+        profile = await self.api.get_load()
+        buckets = profile["buckets"]
+        per_row = max(1, 60 * 60 // profile["bucket"])
+        rows = [
+            buckets[i : i + per_row] for i in range(0, len(buckets), per_row)
+        ]
+        # Without any estimates, show the number of backups instead.
+        key = "rate" if profile["peak"] else "backups"
+        peak = max(b[key] for b in buckets) or 1
+
+        t = Table(
+            "Offset (UTC)",
+            Column("Backups", justify="right"),
+            Column("I/O", justify="right"),
+            "Load",
+        )
+        for row in rows:
+            days, seconds = divmod(row[0]["offset"], 24 * 60 * 60)
+            start = f"{seconds // 3600:02}:{seconds % 3600 // 60:02}"
+            if profile["horizon"] > 24 * 60 * 60:
+                start = f"+{days}d {start}"
+            t.add_row(
+                start,
+                str(max(b["backups"] for b in row)),
+                humanize.naturalsize(max(b["rate"] for b in row)) + "/s",
+                "█" * round(20 * max(b[key] for b in row) / peak),
+            )
+        rprint(t)
+        print(
+            "Spread mode: {}, peak I/O: {}/s".format(
+                profile["mode"], humanize.naturalsize(profile["peak"])
+            )
+        )
+
+    def show_phases(self, repos: List[Repository], last: int) -> None:
+        """Show where the last backups of all jobs spent their time."""
+        # phase -> [(duration, job)]
+        durations: Dict[str, List[tuple[float, str]]] = {}
+        moved: Dict[str, int] = {}
+        backups = 0
+        for repo in repos:
+            for r in repo.last_clean_revisions(last, local=True):
+                phases = r.stats.get("phases")
+                if not phases:
+                    continue
+                backups += 1
+                for name, phase in phases.items():
+                    durations.setdefault(name, []).append(
+                        (phase["duration"], repo.name)
+                    )
+                    if "bytes" in phase:
+                        moved[name] = moved.get(name, 0) + phase["bytes"]
+
+        t = Table(
+            "Phase",
+            Column("Backups", justify="right"),
+            Column("Mean", justify="right"),
+            Column("Max", justify="right"),
+            Column("Share", justify="right"),
+            Column("Throughput", justify="right"),
+            "Slowest Job",
+        )
+        totals = {n: sum(d for d, _ in v) for n, v in durations.items()}
+        total = sum(totals.values())
+        for name in sorted(totals, key=lambda n: totals[n], reverse=True):
+            values = durations[name]
+            phase_total = totals[name]
+            slowest, slowest_job = max(values)
+            throughput = "-"
+            if name in moved and phase_total:
+                rate = moved[name] / phase_total
+                throughput = humanize.naturalsize(rate, binary=True) + "/s"
+            t.add_row(
+                name,
+                str(len(values)),
+                format_seconds(phase_total / len(values)),
+                format_seconds(slowest),
+                f"{phase_total / total:.0%}" if total else "-",
+                throughput,
+                slowest_job,
+            )
+        rprint(t)
+        print("{} backups of {} jobs".format(backups, len(repos)))
+
     async def reload_daemon(self):
         """Reload the configuration."""
         await self.api.reload_daemon()
@@ -539,6 +665,11 @@ def main():
         help="Show backup status. Show inventory and summary information",
     )
     p.add_argument("--json", dest="json_", action="store_true")
+    p.add_argument(
+        "--phases",
+        action="store_true",
+        help="Show how long the phases of each backup took",
+    )
     p.add_argument(
         "-r",
         "--revision",
@@ -729,6 +860,28 @@ def main():
     p = subparsers.add_parser("show-daemon", help="Show job status overview")
     p.set_defaults(func="show_daemon")
 
+    # SHOW LOAD
+    p = subparsers.add_parser(
+        "show-load",
+        help="Show the estimated load over the largest schedule interval",
+    )
+    p.set_defaults(func="show_load")
+
+    # SHOW PHASES
+    p = subparsers.add_parser(
+        "show-phases",
+        help="Show where the last backups of the selected jobs spent time",
+    )
+    p.add_argument(
+        "--last",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Consider the last N local backups of each job "
+        "(default: %(default)s)",
+    )
+    p.set_defaults(func="show_phases")
+
     # RELOAD DAEMON
     p = subparsers.add_parser("reload-daemon", help="Reload daemon config")
     p.set_defaults(func="reload_daemon")
@@ -149,10 +149,35 @@ async def test_show_daemon(command, capsys):
     )
 
 
+async def test_show_load(command, capsys):
+    command.jobs = None
+    exitcode = await command("show_load", {})
+    assert exitcode == 0
+    out, err = capsys.readouterr()
+    assert (
+        Ellipsis(
+            """\
+┏━━━━━━━━━━━━━━┳━━━━━━━━━┳━━━━━━━━━━━┳━━━━━━━━━━━━━━━━━━━━━━┓
+┃ Offset (UTC) ┃ Backups ┃       I/O ┃ Load                 ┃
+┡━━━━━━━━━━━━━━╇━━━━━━━━━╇━━━━━━━━━━━╇━━━━━━━━━━━━━━━━━━━━━━┩
+│ 00:00        │       0 │ 0 Bytes/s │                      │
+...
+│ 05:00        │       1 │ 0 Bytes/s │ ████████████████████ │
+...
+│ 20:00        │       1 │ 0 Bytes/s │ ████████████████████ │
+...
+└──────────────┴─────────┴───────────┴──────────────────────┘
+Spread mode: hash, peak I/O: 0 Bytes/s
+"""
+        )
+        == out
+    )
+
+
 async def test_backup_bg(daemon, command, monkeypatch):
     utils.log_data = ""
     run = mock.Mock()
-    monkeypatch.setattr(daemon.jobs["test01"].run_immediately, "set", run)
+    monkeypatch.setattr(daemon.jobs["test01"], "run_now", run)
 
     command.jobs = "test01"
     exitcode = await command(
@@ -196,8 +221,8 @@ async def test_backup_bg_all(daemon, command, monkeypatch):
     utils.log_data = ""
     run1 = mock.Mock()
     run2 = mock.Mock()
-    monkeypatch.setattr(daemon.jobs["test01"].run_immediately, "set", run1)
-    monkeypatch.setattr(daemon.jobs["foo00"].run_immediately, "set", run2)
+    monkeypatch.setattr(daemon.jobs["test01"], "run_now", run1)
+    monkeypatch.setattr(daemon.jobs["foo00"], "run_now", run2)
 
     exitcode = await command(
         "backup", {"bg": True, "tags": "manual:a", "force": False}
@@ -24,7 +24,7 @@ def test_display_usage(capsys, argv):
         """\
 usage: pytest [-h] [-v] [-c CONFIG] [-C WORKDIR] [-n]
               [--jobs <job filter> | -a]
-              {init,rev-parse,log,backup,restore,distrust,verify,rm,tags,gc,reports-list,reports-show,reports-delete,check,show-jobs,show-daemon,reload-daemon}
+              {init,rev-parse,log,backup,restore,distrust,verify,rm,tags,gc,reports-list,reports-show,reports-delete,check,show-jobs,show-daemon,show-load,show-phases,reload-daemon}
               ...
 """
         == out
@@ -43,7 +43,7 @@ def test_display_help(capsys, argv):
             """\
 usage: pytest [-h] [-v] [-c CONFIG] [-C WORKDIR] [-n]
               [--jobs <job filter> | -a]
-              {init,rev-parse,log,backup,restore,distrust,verify,rm,tags,gc,reports-list,reports-show,reports-delete,check,show-jobs,show-daemon,reload-daemon}
+              {init,rev-parse,log,backup,restore,distrust,verify,rm,tags,gc,reports-list,reports-show,reports-delete,check,show-jobs,show-daemon,show-load,show-phases,reload-daemon}
               ...
 
 Backy command line client.
@@ -80,7 +80,12 @@ class Instance:
             ["log"],
             None,
             0,
-            {"repo": Instance(Repository), "json_": False, "revision": "all"},
+            {
+                "repo": Instance(Repository),
+                "json_": False,
+                "revision": "all",
+                "phases": False,
+            },
         ),
         (
             "backup",
@@ -237,6 +242,20 @@ class Instance:
             0,
             {},
         ),
+        (
+            "show_load",
+            ["show-load"],
+            None,
+            0,
+            {},
+        ),
+        (
+            "show_phases",
+            ["show-phases", "--last", "3"],
+            None,
+            0,
+            {"repos": [Instance(Repository)], "last": 3},
+        ),
         (
             "reload_daemon",
             ["reload-daemon"],
@@ -363,7 +382,7 @@ def test_commands_wrapper_status(
     revision3.materialize()
 
     repository.connect()
-    commands.log_(repository, json_=False, revision="all")
+    commands.log_(repository, json_=False, revision="all", phases=False)
     out, err = capsys.readouterr()
 
     assert err == ""
@@ -398,7 +417,7 @@ def test_commands_wrapper_status_json(
     revision.materialize()
 
     repository.connect()
-    commands.log_(repository, json_=True, revision="all")
+    commands.log_(repository, json_=True, revision="all", phases=False)
     out, err = capsys.readouterr()
 
     assert err == ""
@@ -416,3 +435,74 @@ def test_commands_wrapper_status_json(
 }]
 """
     )
+
+
+def create_phased_rev(repository, log, uuid, export, verify):
+    revision = Revision.create(repository, {"daily"}, log, uuid=uuid)
+    revision.stats["duration"] = export + verify + 1
+    revision.stats["phases"] = {
+        "snapshot": {"duration": 1.0},
+        "export": {"duration": export, "bytes": 1024 * 1024 * export},
+        "verify": {"duration": verify, "bytes": 0},
+    }
+    revision.materialize()
+    return revision
+
+
+def test_commands_wrapper_status_phases(
+    repository, tmp_path, capsys, clock, tz_berlin, log
+):
+    commands = backy.cli.Command(
+        tmp_path, tmp_path / "config", False, ".*", log
+    )
+    create_phased_rev(repository, log, "1", 10.0, 2.0)
+    Revision.create(repository, {"daily"}, log, uuid="2").materialize()
+
+    repository.connect()
+    commands.log_(repository, json_=False, revision="all", phases=True)
+    out, err = capsys.readouterr()
+
+    assert err == ""
+    assert (
+        out
+        == """\
+┏━━━━━━━━━━━━━━━━━━━━━━┳━━━━┳━━━━━━━━━━┳━━━━━━━━┳━━━━━━━━┳━━━━━━━━━━┓
+┃ Date (Europe/Berlin) ┃ ID ┃ Duration ┃ export ┃ verify ┃ snapshot ┃
+┡━━━━━━━━━━━━━━━━━━━━━━╇━━━━╇━━━━━━━━━━╇━━━━━━━━╇━━━━━━━━╇━━━━━━━━━━┩
+│ 2015-09-01 09:06:47  │ 1  │    13.0s │  10.0s │   2.0s │     1.0s │
+│ 2015-09-01 09:06:47  │ 2  │        - │      - │      - │        - │
+└──────────────────────┴────┴──────────┴────────┴────────┴──────────┘
+"""
+    )
+
+
+def test_show_phases(tmp_path, schedule, capsys, clock, log):
+    commands = backy.cli.Command(
+        tmp_path, tmp_path / "config", False, ".*", log
+    )
+    repos = []
+    for name, export in [("fast", 10.0), ("slow", 30.0)]:
+        path = tmp_path / name
+        path.mkdir()
+        repository = Repository(path, schedule, log)
+        create_phased_rev(repository, log, name, export, 2.0)
+        repository.connect()
+        repos.append(repository)
+
+    commands.show_phases(repos, last=1)
+    out, err = capsys.readouterr()
+
+    assert err == ""
+    assert (
+        out
+        == """\
+┏━━━━━━━━━━┳━━━━━━━━━┳━━━━━━━┳━━━━━━━┳━━━━━━━┳━━━━━━━━━━━━┳━━━━━━━━━━━━━┓
+┃ Phase    ┃ Backups ┃  Mean ┃   Max ┃ Share ┃ Throughput ┃ Slowest Job ┃
+┡━━━━━━━━━━╇━━━━━━━━━╇━━━━━━━╇━━━━━━━╇━━━━━━━╇━━━━━━━━━━━━╇━━━━━━━━━━━━━┩
+│ export   │       2 │ 20.0s │ 30.0s │   87% │  1.0 MiB/s │ slow        │
+│ verify   │       2 │  2.0s │  2.0s │    9% │  0 Bytes/s │ slow        │
+│ snapshot │       2 │  1.0s │  1.0s │    4% │          - │ slow        │
+└──────────┴─────────┴───────┴───────┴───────┴────────────┴─────────────┘
+2 backups of 2 jobs
+"""
+    )
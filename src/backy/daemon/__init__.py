@@ -9,7 +9,7 @@ import signal
 import sys
 import time
 from pathlib import Path
-from typing import IO, List, Optional, Pattern
+from typing import IO, List, Optional
 
 import aiofiles.os as aos
 import aioshutil
@@ -17,18 +17,20 @@ import structlog
 import yaml
 from structlog.stdlib import BoundLogger
 
+import backy.utils
 from backy import logging
 from backy.repository import Repository, StatusDict
-from backy.revision import filter_manual_tags
 from backy.schedule import Schedule
-from backy.utils import (
-    AdjustableBoundedSemaphore,
-    has_recent_changes,
-    is_dir_no_symlink,
-)
+from backy.utils import has_recent_changes, is_dir_no_symlink
 
-from .api import BackyAPI
-from .scheduler import Job
+from .admission import AdmissionController
+from .api import BackyAPI, PeerConnections
+from .events import EventLog
+from .executor import LagMonitor, RepositoryExecutor
+from .peers import PeerStatusCache
+from .planner import Placement, ProfileDict, SpreadPlanner, load_profile
+from .scheduler import Job, Scheduler
+from .status import StatusTable
 
 daemon: "BackyDaemon"
 
@@ -36,6 +38,21 @@ daemon: "BackyDaemon"
 class BackyDaemon(object):
     # config defaults, will be overriden from config file
     worker_limit: int = 1
+    # MiB/s, 0 is unlimited
+    io_budget: float = 0
+    scheduler_workers: int = 64
+    # "hash" or "planned"
+    spread: str = "hash"
+    # Connections to each peer and timeouts of requests to peers (seconds)
+    peer_connection_limit: int = 8
+    peer_timeout: float = 30
+    peer_connect_timeout: float = 10
+    # Threads for blocking repository I/O
+    io_workers: int = 4
+    # Log when the event loop was blocked for longer (seconds)
+    loop_lag_threshold: float = 0.1
+    # Seconds between rescans of all repositories for the status table
+    status_interval: float = 60
     base_dir: Path
     backup_completed_callback: Optional[Path]
     api_addrs: List[str]
@@ -47,9 +64,19 @@ class BackyDaemon(object):
     config: dict
     schedules: dict[str, Schedule]
     jobs: dict[str, Job]
+    # Prepares and starts the jobs changed by the last reload.
+    starting: Optional[asyncio.Task] = None
+    scheduler: Scheduler
+    planner: Optional[SpreadPlanner] = None
     dead_repositories: dict[str, Repository]
 
-    backup_semaphores: dict[str, AdjustableBoundedSemaphore]
+    admission: AdmissionController
+    executor: RepositoryExecutor
+    lag: LagMonitor
+    connections: PeerConnections
+    peer_status: PeerStatusCache
+    status_table: StatusTable
+    events: EventLog
     log: BoundLogger
     _lock: Optional[IO] = None
     reload_api: asyncio.Event
@@ -61,10 +88,15 @@ class BackyDaemon(object):
         self.log = log.bind(subsystem="daemon")
         self.config = {}
         self.schedules = {}
-        self.backup_semaphores = {
-            n: AdjustableBoundedSemaphore(0) for n in ("slow", "fast")
-        }
+        self.admission = AdmissionController(0)
+        self.executor = RepositoryExecutor(self.log, self.io_workers)
+        self.lag = LagMonitor(self.log, self.loop_lag_threshold)
+        self.connections = PeerConnections(self.log)
+        self.peer_status = PeerStatusCache(self.log, self.connections)
+        self.events = EventLog()
+        self.status_table = StatusTable()
         self.jobs = {}
+        self.scheduler = Scheduler(self.log, self.scheduler_workers)
         self.dead_repositories = {}
         self._lock = None
         self.reload_api = asyncio.Event()
@@ -83,6 +115,30 @@ class BackyDaemon(object):
 
         g = self.config.get("global", {})
         self.worker_limit = int(g.get("worker-limit", type(self).worker_limit))
+        self.io_budget = float(g.get("io-budget", type(self).io_budget))
+        self.scheduler_workers = int(
+            g.get("scheduler-workers", type(self).scheduler_workers)
+        )
+        self.spread = g.get("spread", type(self).spread)
+        if self.spread not in ("hash", "planned"):
+            self.log.error("invalid-spread", spread=self.spread)
+            raise RuntimeError(f"Invalid spread: {self.spread}")
+        self.peer_connection_limit = int(
+            g.get("peer-connection-limit", type(self).peer_connection_limit)
+        )
+        self.peer_timeout = float(
+            g.get("peer-timeout", type(self).peer_timeout)
+        )
+        self.peer_connect_timeout = float(
+            g.get("peer-connect-timeout", type(self).peer_connect_timeout)
+        )
+        self.io_workers = int(g.get("io-workers", type(self).io_workers))
+        self.loop_lag_threshold = float(
+            g.get("loop-lag-threshold", type(self).loop_lag_threshold)
+        )
+        self.status_interval = float(
+            g.get("status-interval", type(self).status_interval)
+        )
         self.base_dir = Path(g.get("base-dir"))
         callback = g.get("backup-completed-callback")
         self.backup_completed_callback = Path(callback) if callback else None
@@ -118,6 +174,9 @@ class BackyDaemon(object):
         self.log.debug(
             "read-config",
             worker_limit=self.worker_limit,
+            io_budget=self.io_budget,
+            scheduler_workers=self.scheduler_workers,
+            spread=self.spread,
             base_dir=self.base_dir,
             schedules=", ".join(self.schedules),
             api_addrs=self.api_addrs,
@@ -126,6 +185,7 @@ class BackyDaemon(object):
 
     def _apply_config(self):
         # Add new jobs and update existing jobs
+        changed = []
         for name, config in self.config["jobs"].items():
             if name not in self.jobs:
                 self.jobs[name] = Job(self, name, self.log)
@@ -135,14 +195,24 @@ class BackyDaemon(object):
                 self.log.info("changed-job", job_name=name)
                 job.stop()
                 job.configure(config)
-                job.start()
+                changed.append(job)
 
         for name, job in list(self.jobs.items()):
             if name not in self.config["jobs"]:
                 job.stop()
                 del self.jobs[name]
+                self.status_table.remove(name)
                 self.log.info("deleted-job", job_name=name)
 
+        if changed:
+            assert self.loop
+            self.starting = self.loop.create_task(
+                self._start_jobs(changed), name="start-jobs"
+            )
+        elif self.starting is None or self.starting.done():
+            # Otherwise spreads are planned once the jobs are prepared.
+            self._plan_spreads()
+
         self.dead_repositories.clear()
         for b in os.scandir(self.base_dir):
             if b.name in self.jobs or not b.is_dir(follow_symlinks=False):
@@ -159,8 +229,70 @@ class BackyDaemon(object):
                     "invalid-backup", job_name=b.name, exc_style="short"
                 )
 
-        for sem in self.backup_semaphores.values():
-            sem.adjust(self.worker_limit)
+        self.admission.configure(self.worker_limit, self.io_budget * 2**20)
+        self.executor.configure(self.io_workers)
+        self.lag.threshold = self.loop_lag_threshold
+        self.connections.configure(
+            self.peers,
+            self.peer_connection_limit,
+            self.peer_timeout,
+            self.peer_connect_timeout,
+        )
+        self.peer_status.configure(self.peers)
+        self.scheduler.workers.adjust(self.scheduler_workers)
+
+    async def _start_jobs(self, jobs: List[Job]):
+        """Prepare the repositories of `jobs` and start them.
+
+        Spreads are planned after preparing, as they depend on the history.
+        """
+        configs = [job.last_config for job in jobs]
+        results = await asyncio.gather(
+            *[job.prepare() for job in jobs], return_exceptions=True
+        )
+        self._plan_spreads()
+        for job, config, result in zip(jobs, configs, results):
+            if isinstance(result, BaseException):
+                job.log.error("prepare-failed", exc_info=result)
+                continue
+            # Removed or changed again while we prepared.
+            if self.jobs.get(job.name) is job and job.last_config is config:
+                job.start()
+
+    def _plan_spreads(self):
+        if self.spread != "planned":
+            self.planner = None
+            for job in self.jobs.values():
+                if job.planned_spread is None:
+                    continue
+                job.planned_spread = None
+                self._reschedule(job)
+            return
+        if self.planner is None:
+            self.planner = SpreadPlanner(
+                self.base_dir / ".spread-plan.json", self.log
+            )
+        offsets = self.planner.plan(
+            [Placement.from_job(job) for job in self.jobs.values()]
+        )
+        for name, job in self.jobs.items():
+            if job.planned_spread == offsets[name]:
+                continue
+            job.planned_spread = offsets[name]
+            self._reschedule(job)
+
+    def _reschedule(self, job: Job):
+        # Running jobs pick up their new spread when they are done.
+        if job.active and job not in self.scheduler.running:
+            job.schedule_next()
+
+    def load_profile(self) -> ProfileDict:
+        """The estimated load of all jobs over the largest interval."""
+        placements = [Placement.from_job(job) for job in self.jobs.values()]
+        offsets = {
+            p.name: self.jobs[p.name].spread % p.period for p in placements
+        }
+        return load_profile(placements, offsets, self.spread)
 
     def lock(self):
         """Ensures that only a single daemon instance is active."""
@@ -182,6 +314,7 @@ class BackyDaemon(object):
         # Ensure single daemon instance.
         self.lock()
 
+        self.scheduler.start(loop)
         self._apply_config()
 
         loop.create_task(self.purge_old_files(), name="purge-old-files")
@@ -189,6 +322,8 @@ class BackyDaemon(object):
             self.purge_pending_backups(), name="purge-pending-backups"
         )
         loop.create_task(self.shutdown_loop(), name="shutdown-cleanup")
+        loop.create_task(self.lag.run_forever(), name="lag-monitor")
+        loop.create_task(self.refresh_status(), name="refresh-status")
 
         def handle_signals(signum):
             self.log.info("signal-received", signum=signum)
@@ -269,6 +404,8 @@ class BackyDaemon(object):
                 await asyncio.sleep(0.25)
             except asyncio.CancelledError:
                 break
+        await self.connections.close()
+        self.executor.shutdown()
         self.log.info("stopping-loop")
         self.loop.stop()
 
@@ -318,57 +455,55 @@ class BackyDaemon(object):
                 self.log.exception("purge-pending")
             await asyncio.sleep(24 * 60 * 60)
 
-    # XXX this is duplicated in the client
-    def status(
-        self, filter_re: Optional[Pattern[str]] = None
-    ) -> List[StatusDict]:
-        """Collects status information for all jobs."""
-        # XXX with a database backend, we can evaluate this in live actually
-        # so this should move to the CLI client
-        result: List[StatusDict] = []
-        for job in list(self.jobs.values()):
-            if filter_re and not filter_re.search(job.name):
-                continue
-            job.repository.connect()
-            manual_tags = set()
-            unsynced_revs = 0
-            history = job.repository.clean_history
-            for rev in history:
-                manual_tags |= filter_manual_tags(rev.tags)
-                if rev.pending_changes:
-                    unsynced_revs += 1
-            result.append(
-                dict(
-                    job=job.name,
-                    sla="OK" if job.repository.sla else "TOO OLD",
-                    sla_overdue=job.repository.sla_overdue,
-                    status=job.status,
-                    last_time=history[-1].timestamp if history else None,
-                    last_tags=(
-                        ",".join(job.schedule.sorted_tags(history[-1].tags))
-                        if history
-                        else None
-                    ),
-                    last_duration=(
-                        history[-1].stats.get("duration", 0)
-                        if history
-                        else None
-                    ),
-                    next_time=job.next_time,
-                    next_tags=(
-                        ",".join(job.schedule.sorted_tags(job.next_tags))
-                        if job.next_tags
-                        else None
-                    ),
-                    manual_tags=", ".join(manual_tags),
-                    problem_reports=len(job.repository.report_ids),
-                    unsynced_revs=unsynced_revs,
-                    local_revs=len(
-                        job.repository.get_history(clean=True, local=True)
-                    ),
-                )
-            )
-        return result
+    async def refresh_status(self):
+        """Rescan all repositories now and then.
+
+        Jobs keep their status up to date themselves. This picks up changes
+        made by others, e.g. tags changed with the CLI or new problem
+        reports. Repositories that did not change are not walked again,
+        see `Job.refresh`.
+        """
+        while True:
+            await asyncio.sleep(self.status_interval)
+            try:
+                self.log.debug("refresh-status-started")
+                for job in list(self.jobs.values()):
+                    if job.state is None:
+                        # Not prepared (yet).
+                        continue
+                    await job.refresh()
+                self.log.debug("refresh-status-finished")
+            except Exception:
+                self.log.exception("refresh-status")
+
+    def status(self, filter: str = "") -> List[StatusDict]:
+        """The status of all jobs whose name matches `filter` (a regex)."""
+        return self.status_table.snapshot(filter)[1]
+
+    def job_status(self, job: Job) -> StatusDict:
+        """The status of a job, as of the last refresh of its state."""
+        state = job.state
+        assert state is not None
+        overdue = state.sla_overdue(backy.utils.now())
+        return dict(
+            job=job.name,
+            sla="OK" if not overdue else "TOO OLD",
+            sla_overdue=overdue,
+            status=job.status,
+            last_time=state.last_time,
+            last_tags=state.last_tags,
+            last_duration=state.last_duration,
+            next_time=job.next_time,
+            next_tags=(
+                ",".join(job.schedule.sorted_tags(job.next_tags))
+                if job.next_tags
+                else None
+            ),
+            manual_tags=state.manual_tags,
+            problem_reports=state.problem_reports,
+            unsynced_revs=state.unsynced_revs,
+            local_revs=state.local_revs,
+        )
 
 
 def main():
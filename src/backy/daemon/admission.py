@@ -0,0 +1,203 @@
+"""Admission control for backups.
+
+Backups compete for the I/O of the storage they are written to. Instead of
+handing out a fixed number of slots, every backup is admitted with its
+estimated cost: how many bytes it will write, for how long, and so how
+much I/O it puts on the storage while it runs.
+
+"""
+
+import asyncio
+import contextlib
+import datetime
+import itertools
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, AsyncIterator, List, Optional, TypedDict
+
+import backy.utils
+from backy.repository import Repository
+
+if TYPE_CHECKING:
+    from .scheduler import Job
+
+# The number of previous backups that a cost estimate is based on.
+ESTIMATE_REVISIONS = 5
+
+
+@dataclass(frozen=True)
+class Cost:
+    """The estimated cost of a backup."""
+
+    bytes: float = 0.0
+    duration: float = 0.0
+    known: bool = False
+
+    @property
+    def rate(self) -> float:
+        """I/O while running, in bytes per second."""
+        return self.bytes / max(self.duration, 1.0)
+
+    @classmethod
+    def estimate(cls, repository: Repository) -> "Cost":
+        revisions = repository.last_clean_revisions(
+            ESTIMATE_REVISIONS, local=True
+        )
+        if not revisions:
+            return cls()
+        return cls(
+            bytes=sum(r.stats.get("bytes_written", 0) for r in revisions)
+            / len(revisions),
+            duration=sum(r.stats["duration"] for r in revisions)
+            / len(revisions),
+            known=True,
+        )
+
+
+class TicketDict(TypedDict):
+    job: str
+    bytes: float
+    duration: float
+    rate: float
+    start_by: datetime.datetime
+    queued: datetime.datetime
+    admitted: Optional[datetime.datetime]
+
+
+@dataclass(eq=False)
+class Ticket:
+    job: str
+    cost: Cost
+    # The latest start that still finishes before the SLA is breached.
+    start_by: datetime.datetime
+    queued: datetime.datetime
+    sequence: int
+    admitted: Optional[datetime.datetime] = None
+    future: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+    @property
+    def priority(self) -> tuple[datetime.datetime, int]:
+        return self.start_by, self.sequence
+
+    def to_dict(self) -> TicketDict:
+        return {
+            "job": self.job,
+            "bytes": self.cost.bytes,
+            "duration": self.cost.duration,
+            "rate": self.cost.rate,
+            "start_by": self.start_by,
+            "queued": self.queued,
+            "admitted": self.admitted,
+        }
+
+
+class AdmissionDict(TypedDict):
+    limit: int
+    budget: float
+    in_flight: float
+    running: List[TicketDict]
+    waiting: List[TicketDict]
+
+
+class AdmissionController(object):
+    """Decides which backups may run.
+
+    Running backups are limited by their number and by the sum of their
+    estimated I/O rates (the budget, in bytes per second, 0 is unlimited).
+    Waiting backups are admitted by urgency: those that have to start
+    first to not breach their SLA come first. A backup that does not fit
+    the budget holds back the less urgent ones, but is always admitted
+    when nothing else is running.
+
+    Backups without previous backups to estimate from are assumed to use
+    an even share of the budget.
+
+    """
+
+    limit: int
+    budget: float
+    waiting: List[Ticket]
+    running: List[Ticket]
+    # Backups admitted so far and how long they waited in total, in seconds.
+    admitted: int
+    wait_total: float
+
+    def __init__(self, limit: int = 1, budget: float = 0):
+        self.limit = limit
+        self.budget = budget
+        self.waiting = []
+        self.running = []
+        self.admitted = 0
+        self.wait_total = 0.0
+        self._sequence = itertools.count()
+
+    def configure(self, limit: int, budget: float) -> None:
+        self.limit = limit
+        self.budget = budget
+        self._admit()
+
+    @property
+    def in_flight(self) -> float:
+        return sum(self.rate(t.cost) for t in self.running)
+
+    def rate(self, cost: Cost) -> float:
+        if cost.known:
+            return cost.rate
+        return self.budget / max(self.limit, 1)
+
+    def ticket(self, job: "Job") -> Ticket:
+        repository = job.repository
+        cost = Cost.estimate(repository)
+        now = backy.utils.now()
+        deadline = repository.sla_deadline
+        if deadline is None:
+            start_by = now
+        else:
+            start_by = deadline - datetime.timedelta(seconds=cost.duration)
+        return Ticket(job.name, cost, start_by, now, next(self._sequence))
+
+    @contextlib.asynccontextmanager
+    async def slot(self, job: "Job") -> AsyncIterator[Ticket]:
+        """Wait until the backup of `job` is admitted."""
+        ticket = self.ticket(job)
+        self.waiting.append(ticket)
+        self.waiting.sort(key=lambda t: t.priority)
+        try:
+            self._admit()
+            await ticket.future
+            yield ticket
+        finally:
+            if ticket in self.waiting:
+                self.waiting.remove(ticket)
+            elif ticket in self.running:
+                self.running.remove(ticket)
+            self._admit()
+
+    def _admit(self) -> None:
+        in_flight = self.in_flight
+        while self.waiting and len(self.running) < self.limit:
+            ticket = self.waiting[0]
+            if ticket.future.cancelled():
+                # Its backup was stopped while waiting.
+                self.waiting.pop(0)
+                continue
+            rate = self.rate(ticket.cost)
+            if self.budget and self.running and in_flight + rate > self.budget:
+                break
+            self.waiting.pop(0)
+            self.running.append(ticket)
+            in_flight += rate
+            admitted = ticket.admitted = backy.utils.now()
+            self.admitted += 1
+            self.wait_total += (admitted - ticket.queued).total_seconds()
+            ticket.future.set_result(None)
+
+    def to_dict(self) -> AdmissionDict:
+        return {
+            "limit": self.limit,
+            "budget": self.budget,
+            "in_flight": self.in_flight,
+            "running": [t.to_dict() for t in self.running],
+            "waiting": [t.to_dict() for t in self.waiting],
+        }
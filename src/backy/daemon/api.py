@@ -1,15 +1,37 @@
+import asyncio
 import datetime
+import email.utils
+import json
 import re
+import time
 from asyncio import get_running_loop
-from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
 import aiohttp
-from aiohttp import ClientTimeout, TCPConnector, hdrs, web
+from aiohttp import (
+    ClientResponseError,
+    ClientTimeout,
+    ETag,
+    TCPConnector,
+    hdrs,
+    web,
+)
 from aiohttp.web_exceptions import (
     HTTPAccepted,
     HTTPBadRequest,
     HTTPForbidden,
+    HTTPNoContent,
     HTTPNotFound,
+    HTTPNotModified,
     HTTPPreconditionFailed,
     HTTPServiceUnavailable,
     HTTPUnauthorized,
@@ -19,33 +41,69 @@ from aiohttp.web_runner import AppRunner, TCPSite
 from structlog.stdlib import BoundLogger
 
 import backy.repository
+import backy.utils
 from backy.repository import Repository, StatusDict
 from backy.revision import Revision
 from backy.utils import BackyJSONEncoder, generate_taskid
 
+from .metrics import CONTENT_TYPE, RequestLatency, render
+
 if TYPE_CHECKING:
     from backy.daemon import BackyDaemon
 
     from .scheduler import Job
 
 
+def parse_status(job: dict) -> StatusDict:
+    for key in ["last_time", "next_time"]:
+        if job[key]:
+            job[key] = datetime.datetime.fromisoformat(job[key])
+    return job  # type: ignore
+
+
 def to_json(response: Any) -> aiohttp.web.StreamResponse:
     if response is None:
         raise web.HTTPNoContent()
     return web.json_response(response, dumps=BackyJSONEncoder().encode)
 
 
+class RevisionChanges(object):
+    """The revisions of a peer's repository that changed since we last
+    looked."""
+
+    # None if the peer does not support versions.
+    version: Optional[str]
+    # Revisions that were added or changed.
+    revs: List[Revision]
+    # All revisions of the peer.
+    uuids: set[str]
+
+    def __init__(
+        self, version: Optional[str], revs: List[Revision], uuids: set[str]
+    ):
+        self.version = version
+        self.revs = revs
+        self.uuids = uuids
+
+
 class BackyAPI:
     daemon: "BackyDaemon"
     sites: dict[Tuple[str, int], TCPSite]
     runner: AppRunner
     tokens: dict
     log: BoundLogger
+    # Set to end all event streams, e.g. because the tokens changed.
+    close_streams: asyncio.Event
+    # Seconds between keepalive messages on idle event streams.
+    keepalive: float = 30
+    latency: RequestLatency
 
     def __init__(self, daemon, log):
         self.log = log.bind(subsystem="api", job_name="~")
         self.daemon = daemon
         self.sites = {}
+        self.close_streams = asyncio.Event()
+        self.latency = RequestLatency()
         self.app = web.Application(
             middlewares=[self.log_conn, self.require_auth]
         )
@@ -55,10 +113,18 @@ class BackyAPI:
                 web.post("/v1/reload", self.reload_daemon),
                 web.get("/v1/jobs", self.get_jobs),
                 web.post("/v1/jobs/{job_name}/run", self.run_job),
+                web.get("/v1/scheduler", self.get_scheduler),
+                web.get("/v1/admission", self.get_admission),
+                web.get("/v1/io", self.get_io),
+                web.get("/v1/load", self.get_load),
+                web.get("/v1/events", self.get_events),
+                web.get("/v1/peers", self.get_peers),
+                web.get("/metrics", self.get_metrics),
                 web.get("/v1/backups", self.list_backups),
                 web.post("/v1/backups/{backup_name}/purge", self.run_purge),
                 web.post("/v1/backups/{backup_name}/touch", self.touch_backup),
                 web.get("/v1/backups/{backup_name}/revs", self.get_revs),
+                web.patch("/v1/backups/{backup_name}/revs", self.patch_revs),
                 web.put(
                     "/v1/backups/{backup_name}/revs/{rev_spec}/tags",
                     self.put_tags,
@@ -79,6 +145,9 @@ class BackyAPI:
     ):
         self.log.debug("reconfigure")
         self.tokens = tokens
+        # Clients have to authenticate again, they can resume their streams.
+        self.close_streams.set()
+        self.close_streams = asyncio.Event()
         bind_addrs = [(addr, port) for addr in addrs if addr and port]
         for bind_addr in bind_addrs:
             if bind_addr in self.sites:
@@ -104,21 +173,38 @@ class BackyAPI:
         request["log"].debug(
             "new-conn", path=request.path, query=request.query_string
         )
+        started = time.perf_counter()
         try:
             resp = await handler(request)
         except Exception as e:
             if not isinstance(e, web.HTTPException):
                 request["log"].exception("error-handling-request")
+                self._observe(request, 500, started)
             else:
                 request["log"].debug(
                     "request-result", status_code=e.status_code
                 )
+                self._observe(request, e.status_code, started)
             raise
         request["log"].debug(
-            "request-result", status_code=resp.status, response=resp.body
+            "request-result",
+            status_code=resp.status,
+            response=getattr(resp, "body", None),
         )
+        # Event streams last as long as the client listens.
+        if isinstance(resp, web.Response):
+            self._observe(request, resp.status, started)
         return resp
 
+    def _observe(self, request: web.Request, status: int, started: float):
+        resource = request.match_info.route.resource
+        self.latency.observe(
+            request.method,
+            resource.canonical if resource else "unmatched",
+            status,
+            time.perf_counter() - started,
+        )
+
     @middleware
     async def require_auth(self, request: web.Request, handler):
         token = request.headers.get(hdrs.AUTHORIZATION, "")
@@ -137,10 +223,20 @@ class BackyAPI:
     async def get_status(
         self, request: web.Request
     ) -> aiohttp.web.StreamResponse:
-        filter = request.query.get("filter", None)
+        filter = request.query.get("filter", "")
         request["log"].info("get-status", filter=filter)
-        filter_re = re.compile(filter) if filter else None
-        return to_json(self.daemon.status(filter_re))
+        try:
+            now, status = self.daemon.status_table.snapshot(filter)
+        except re.error:
+            request["log"].info("get-status-bad-filter")
+            raise HTTPBadRequest()
+        response = to_json(status)
+        # The SLAs are evaluated as of the snapshot.
+        response.headers[hdrs.DATE] = email.utils.format_datetime(
+            now.astimezone(datetime.timezone.utc), usegmt=True
+        )
+        response.last_modified = self.daemon.status_table.updated
+        return response
 
     async def reload_daemon(self, request: web.Request):
         request["log"].info("reload-daemon")
@@ -167,9 +263,65 @@ class BackyAPI:
     async def run_job(self, request: web.Request):
         j = await self.get_job(request)
         request["log"].info("run-job", name=j.name)
-        j.run_immediately.set()
+        j.run_now()
         raise HTTPAccepted()
 
+    async def get_scheduler(self, request: web.Request):
+        request["log"].info("get-scheduler")
+        return to_json(self.daemon.scheduler.metrics())
+
+    async def get_admission(self, request: web.Request):
+        request["log"].info("get-admission")
+        return to_json(self.daemon.admission.to_dict())
+
+    async def get_io(self, request: web.Request):
+        request["log"].info("get-io")
+        return to_json(
+            {
+                "executor": self.daemon.executor.metrics(),
+                "loop": self.daemon.lag.metrics(),
+            }
+        )
+
+    async def get_load(self, request: web.Request):
+        request["log"].info("get-load")
+        return to_json(self.daemon.load_profile())
+
+    async def get_peers(self, request: web.Request):
+        request["log"].info("get-peers")
+        return to_json(self.daemon.connections.health())
+
+    async def get_metrics(self, request: web.Request):
+        request["log"].info("get-metrics")
+        return web.Response(
+            text=render(self.daemon, self.latency),
+            headers={hdrs.CONTENT_TYPE: CONTENT_TYPE},
+        )
+
+    async def get_events(self, request: web.Request):
+        cursor = request.query.get("cursor") or request.headers.get(
+            "Last-Event-ID"
+        )
+        request["log"].info("get-events", cursor=cursor)
+        response = web.StreamResponse(
+            headers={
+                hdrs.CONTENT_TYPE: "text/event-stream",
+                hdrs.CACHE_CONTROL: "no-cache",
+            }
+        )
+        await response.prepare(request)
+        try:
+            async for event in self.daemon.events.subscribe(
+                cursor, self.close_streams, self.keepalive
+            ):
+                if event is None:
+                    await response.write(b":\n\n")
+                else:
+                    await response.write(event.encode())
+        except ConnectionResetError:
+            request["log"].debug("events-disconnected")
+        return response
+
     async def list_backups(self, request: web.Request):
         request["log"].info("list-backups")
         return to_json(list(self.daemon.dead_repositories.keys()))
@@ -192,24 +344,96 @@ class BackyAPI:
     async def run_purge(self, request: web.Request):
         backup = await self.get_backup(request, False)
         request["log"].info("run-purge", name=backup.name)
-        backup.set_purge_pending()
+        await self.daemon.executor.run(backup, backup.set_purge_pending)
         raise HTTPAccepted()
 
     async def touch_backup(self, request: web.Request):
         backup = await self.get_backup(request, True)
         request["log"].info("touch-backup", name=backup.name)
-        backup.touch()
+        await self.daemon.executor.run(backup, backup.touch)
         raise web.HTTPNoContent()
 
     async def get_revs(self, request: web.Request):
         backup = await self.get_backup(request, True)
         request["log"].info("get-revs", name=backup.name)
+        version, revs = await self.daemon.executor.run(
+            backup,
+            self._revs,
+            backup,
+            request.query.get("only_clean", "") == "1",
+            request.query.get("since"),
+            [e.value for e in request.if_none_match or ()],
+        )
+        if revs is None:
+            request["log"].debug("get-revs-not-modified", version=version)
+            raise HTTPNotModified(headers={hdrs.ETAG: f'"{version}"'})
+        response = to_json(revs)
+        response.etag = ETag(value=version)
+        return response
+
+    @staticmethod
+    def _revs(
+        backup: "backy.repository.Repository",
+        only_clean: bool,
+        since: Optional[str],
+        known: List[str],
+    ) -> Tuple[str, Any]:
+        """The metadata version and the revisions of `backup`, as plain
+        data. The revisions are None if the client knows this version.
+
+        Runs in the executor: the revisions must not change while we
+        serialise them.
+        """
         backup.scan()
-        return to_json(
-            backup.get_history(
-                local=True, clean=request.query.get("only_clean", "") == "1"
-            )
+        version = backup.metadata_version
+        if version in known:
+            return version, None
+        revs = backup.get_history(local=True, clean=only_clean)
+        if since is None:
+            return version, [r.to_dict() for r in revs]
+        changed = backup.changed_since(since)
+        return version, {
+            "version": version,
+            "revs": [
+                r.to_dict()
+                for r in revs
+                if changed is None or r.uuid in changed
+            ],
+            "uuids": [r.uuid for r in revs],
+        }
+
+    async def patch_revs(self, request: web.Request):
+        """Set the tags of many revisions with a single request."""
+        json = await request.json()
+        try:
+            changes = {
+                r["uuid"]: (set(r["old_tags"]), set(r["new_tags"]))
+                for r in json["revs"]
+            }
+        except (KeyError, TypeError):
+            request["log"].info("patch-revs-bad-request")
+            raise HTTPBadRequest()
+        autoremove = request.query.get("autoremove", "") == "1"
+        backup = await self.get_backup(request, False)
+        request["log"].info(
+            "patch-revs",
+            name=backup.name,
+            revs=len(changes),
+            autoremove=autoremove,
         )
+        try:
+            result = await self.daemon.executor.run(
+                backup, backup.set_tags, changes, autoremove=autoremove
+            )
+        except BlockingIOError:
+            request["log"].info("patch-revs-locked")
+            raise HTTPServiceUnavailable()
+        status = {
+            True: HTTPNoContent.status_code,
+            False: HTTPPreconditionFailed.status_code,
+            None: HTTPNotFound.status_code,
+        }
+        return to_json({uuid: status[ok] for uuid, ok in result.items()})
 
     async def put_tags(self, request: web.Request):
         json = await request.json()
@@ -230,9 +454,11 @@ class BackyAPI:
             spec=spec,
             autoremove=autoremove,
         )
-        backup.scan()
         try:
-            if not backup.tags(
+            # includes scan()
+            if not await self.daemon.executor.run(
+                backup,
+                backup.tags,
                 "set",
                 spec,
                 new_tags,
@@ -251,14 +477,23 @@ class BackyAPI:
 
 
 class ClientManager:
-    connector: TCPConnector
+    connector: Optional[TCPConnector]
+    connections: Optional["PeerConnections"]
     peers: dict[str, dict]
     clients: dict[str, "Client"]
     taskid: str
     log: BoundLogger
 
-    def __init__(self, peers: Dict[str, dict], taskid: str, log: BoundLogger):
-        self.connector = TCPConnector()
+    def __init__(
+        self,
+        peers: Dict[str, dict],
+        taskid: str,
+        log: BoundLogger,
+        connections: Optional["PeerConnections"] = None,
+    ):
+        # Use the daemon's long-lived connections if we have them.
+        self.connections = connections
+        self.connector = None if connections else TCPConnector()
         self.peers = peers
         self.clients = dict()
         self.taskid = taskid
@@ -266,9 +501,18 @@ class ClientManager:
 
     def __getitem__(self, name: str) -> "Client":
         if name and name not in self.clients:
-            self.clients[name] = Client.from_conf(
-                name, self.peers[name], self.taskid, self.log, self.connector
-            )
+            if self.connections:
+                self.clients[name] = self.connections.client(
+                    name, self.peers[name], self.taskid, self.log
+                )
+            else:
+                self.clients[name] = Client.from_conf(
+                    name,
+                    self.peers[name],
+                    self.taskid,
+                    self.log,
+                    self.connector,
+                )
         return self.clients[name]
 
     def __iter__(self) -> Iterator[str]:
@@ -277,7 +521,8 @@ class ClientManager:
     async def close(self) -> None:
         for c in self.clients.values():
             await c.close()
-        await self.connector.close()
+        if self.connector:
+            await self.connector.close()
 
     async def __aenter__(self) -> "ClientManager":
         return self
@@ -286,6 +531,156 @@ class ClientManager:
         await self.close()
 
 
+class PeerHealth(object):
+    """How our requests to a peer went."""
+
+    requests: int = 0
+    # Consecutive requests that failed to get any response.
+    failures: int = 0
+    last_success: Optional[datetime.datetime] = None
+    last_failure: Optional[datetime.datetime] = None
+    last_error: str = ""
+
+    def succeeded(self) -> None:
+        self.requests += 1
+        self.failures = 0
+        self.last_success = backy.utils.now()
+
+    def failed(self, error: BaseException) -> None:
+        self.requests += 1
+        self.failures += 1
+        self.last_failure = backy.utils.now()
+        self.last_error = repr(error)
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_success": self.last_success,
+            "last_failure": self.last_failure,
+            "last_error": self.last_error,
+        }
+
+
+class PeerPool(object):
+    """The keep-alive connections to a single peer."""
+
+    conf: dict
+    connector: TCPConnector
+    timeout: ClientTimeout
+    health: PeerHealth
+    trace: aiohttp.TraceConfig
+
+    def __init__(
+        self, conf: dict, limit: int, timeout: float, connect_timeout: float
+    ):
+        self.conf = conf
+        self.connector = TCPConnector(
+            limit=limit, keepalive_timeout=PeerConnections.keepalive
+        )
+        self.timeout = ClientTimeout(timeout, connect=connect_timeout)
+        self.health = PeerHealth()
+        self.trace = aiohttp.TraceConfig()
+        self.trace.on_request_end.append(self._request_end)
+        self.trace.on_request_exception.append(self._request_exception)
+
+    async def _request_end(self, session, context, params) -> None:
+        self.health.succeeded()
+
+    async def _request_exception(self, session, context, params) -> None:
+        if isinstance(params.exception, ClientResponseError):
+            # The peer answered.
+            self.health.succeeded()
+        elif isinstance(params.exception, Exception):
+            self.health.failed(params.exception)
+
+
+class PeerConnections(object):
+    """Connections to our peers, shared by all jobs.
+
+    Every peer gets a pool of keep-alive connections so that jobs do not
+    connect to every peer for every request. A pool is only replaced if the
+    configuration of its peer changes.
+
+    """
+
+    # Seconds to keep idle connections open.
+    keepalive: float = 60
+
+    limit: int = 8
+    timeout: float = 30
+    connect_timeout: float = 10
+    pools: dict[str, PeerPool]
+    log: BoundLogger
+    _settings: tuple
+
+    def __init__(self, log: BoundLogger):
+        self.log = log.bind(subsystem="connections")
+        self.pools = {}
+        self._settings = ()
+
+    def configure(
+        self,
+        peers: dict[str, dict],
+        limit: int,
+        timeout: float,
+        connect_timeout: float,
+    ) -> None:
+        settings = (limit, timeout, connect_timeout)
+        stale = [
+            name
+            for name, pool in self.pools.items()
+            if peers.get(name) != pool.conf or settings != self._settings
+        ]
+        self.limit, self.timeout, self.connect_timeout = settings
+        self._settings = settings
+        if stale:
+            self.log.debug("closing-pools", peers=", ".join(stale))
+            get_running_loop().create_task(
+                self._close([self.pools.pop(name) for name in stale]),
+                name="close-peer-pools",
+            )
+
+    async def _close(self, pools: List[PeerPool]) -> None:
+        try:
+            # Let requests in flight finish.
+            await asyncio.sleep(self.timeout)
+        finally:
+            for pool in pools:
+                await pool.connector.close()
+
+    def client(
+        self, name: str, conf: dict, taskid: str, log: BoundLogger
+    ) -> "Client":
+        pool = self.pools.get(name)
+        if pool is None:
+            pool = self.pools[name] = PeerPool(
+                conf, self.limit, self.timeout, self.connect_timeout
+            )
+        elif pool.conf != conf:
+            # The caller uses an outdated configuration, don't mix it up
+            # with the current one.
+            return Client.from_conf(name, conf, taskid, log)
+        return Client.from_conf(
+            name,
+            conf,
+            taskid,
+            log,
+            pool.connector,
+            timeout=pool.timeout,
+            trace_configs=[pool.trace],
+        )
+
+    def health(self) -> dict[str, PeerHealth]:
+        return {name: pool.health for name, pool in self.pools.items()}
+
+    async def close(self) -> None:
+        pools = list(self.pools.values())
+        self.pools.clear()
+        for pool in pools:
+            await pool.connector.close()
+
+
 class Client:
     log: BoundLogger
     server_name: str
@@ -299,6 +694,8 @@ class Client:
         taskid: str,
         log,
         connector=None,
+        timeout: Optional[ClientTimeout] = None,
+        trace_configs: Optional[List[aiohttp.TraceConfig]] = None,
     ):
         assert get_running_loop().is_running()
         self.log = log.bind(subsystem="APIClient")
@@ -307,9 +704,10 @@ class Client:
             url,
             headers={hdrs.AUTHORIZATION: "Bearer " + token, "taskid": taskid},
             raise_for_status=True,
-            timeout=ClientTimeout(30, connect=10),
+            timeout=timeout or ClientTimeout(30, connect=10),
             connector=connector,
             connector_owner=connector is None,
+            trace_configs=trace_configs,
         )
 
     @classmethod
@@ -327,16 +725,37 @@ class Client:
             "/v1/status", params={"filter": filter}
         ) as response:
             jobs = await response.json()
-            for job in jobs:
-                if job["last_time"]:
-                    job["last_time"] = datetime.datetime.fromisoformat(
-                        job["last_time"]
-                    )
-                if job["next_time"]:
-                    job["next_time"] = datetime.datetime.fromisoformat(
-                        job["next_time"]
-                    )
-            return jobs
+            return [parse_status(job) for job in jobs]
+
+    async def events(
+        self, cursor: Optional[str] = None, keepalive: float = 30
+    ) -> AsyncIterator[dict]:
+        """Stream the events of the server, see `backy.daemon.events`.
+
+        Yields dicts with the `cursor`, `type` and `data` of each event.
+        """
+        async with self.session.get(
+            "/v1/events",
+            params={"cursor": cursor} if cursor else {},
+            timeout=ClientTimeout(None, connect=10, sock_read=3 * keepalive),
+        ) as response:
+            event: dict = {}
+            async for line in response.content:
+                field, _, value = (
+                    line.decode("utf-8").rstrip("\n").partition(":")
+                )
+                value = value.removeprefix(" ")
+                if field == "id":
+                    event["cursor"] = value
+                elif field == "event":
+                    event["type"] = value
+                elif field == "data":
+                    event["data"] = json.loads(value)
+                elif not line.strip() and event:
+                    if event.get("type") == "status":
+                        event["data"] = parse_status(event["data"])
+                    yield event
+                    event = {}
 
     async def reload_daemon(self):
         async with self.session.post("/v1/reload"):
@@ -350,6 +769,30 @@ class Client:
         async with self.session.post(f"/v1/jobs/{name}/run"):
             return
 
+    async def get_scheduler(self) -> dict:
+        async with self.session.get("/v1/scheduler") as response:
+            return await response.json()
+
+    async def get_admission(self) -> dict:
+        async with self.session.get("/v1/admission") as response:
+            return await response.json()
+
+    async def get_io(self) -> dict:
+        async with self.session.get("/v1/io") as response:
+            return await response.json()
+
+    async def get_load(self) -> dict:
+        async with self.session.get("/v1/load") as response:
+            return await response.json()
+
+    async def get_peers(self) -> dict[str, dict]:
+        async with self.session.get("/v1/peers") as response:
+            return await response.json()
+
+    async def get_metrics(self) -> str:
+        async with self.session.get("/metrics") as response:
+            return await response.text()
+
     async def list_backups(self) -> List[str]:
         async with self.session.get("/v1/backups") as response:
             return await response.json()
@@ -362,6 +805,15 @@ class Client:
         async with self.session.post(f"/v1/backups/{name}/touch"):
             return
 
+    def _load_revs(
+        self, json: List[dict], repository: "backy.repository.Repository"
+    ) -> List[Revision]:
+        revs = [Revision.from_dict(r, repository, self.log) for r in json]
+        for r in revs:
+            r.orig_tags = r.tags
+            r.server = self.server_name
+        return revs
+
     async def get_revs(
         self, repository: "backy.repository.Repository", only_clean: bool = True
     ) -> List[Revision]:
@@ -369,12 +821,34 @@ class Client:
             f"/v1/backups/{repository.name}/revs",
             params={"only_clean": int(only_clean)},
         ) as response:
+            return self._load_revs(await response.json(), repository)
+
+    async def get_revs_since(
+        self,
+        repository: "backy.repository.Repository",
+        version: Optional[str],
+        only_clean: bool = True,
+    ) -> Optional[RevisionChanges]:
+        """The revisions that changed since `version`, None if nothing
+        changed."""
+        headers = {hdrs.IF_NONE_MATCH: f'"{version}"'} if version else {}
+        async with self.session.get(
+            f"/v1/backups/{repository.name}/revs",
+            params={"only_clean": int(only_clean), "since": version or ""},
+            headers=headers,
+        ) as response:
+            if response.status == HTTPNotModified.status_code:
+                return None
             json = await response.json()
-            revs = [Revision.from_dict(r, repository, self.log) for r in json]
-            for r in revs:
-                r.orig_tags = r.tags
-                r.server = self.server_name
-            return revs
+        if isinstance(json, list):
+            # Peers without versions send all revisions.
+            revs = self._load_revs(json, repository)
+            return RevisionChanges(None, revs, {r.uuid for r in revs})
+        return RevisionChanges(
+            json["version"],
+            self._load_revs(json["revs"], repository),
+            set(json["uuids"]),
+        )
 
     async def put_tags(self, rev: Revision, autoremove: bool = False):
         async with self.session.put(
@@ -384,6 +858,30 @@ class Client:
         ):
             return
 
+    async def update_tags(
+        self, revs: List[Revision], autoremove: bool = False
+    ) -> dict[str, int]:
+        """Push the tags of many revisions of a repository at once.
+
+        Returns the status of each revision as the status code that
+        `put_tags` would have received.
+        """
+        async with self.session.patch(
+            f"/v1/backups/{revs[0].repository.name}/revs",
+            json={
+                "revs": [
+                    {
+                        "uuid": r.uuid,
+                        "old_tags": list(r.orig_tags),
+                        "new_tags": list(r.tags),
+                    }
+                    for r in revs
+                ]
+            },
+            params={"autoremove": int(autoremove)},
+        ) as response:
+            return await response.json()
+
     async def close(self):
         await self.session.close()
 
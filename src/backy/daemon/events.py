@@ -0,0 +1,122 @@
+"""Job events, streamed to peers and clients as Server-Sent Events.
+
+The daemon publishes an event whenever a job changes its status (with the
+job's full status, as in `/v1/status`) and whenever a revision of a job is
+new, changed or removed.
+
+Every event has a cursor. Clients can resume a stream from the cursor of the
+last event they have seen and receive everything that happened since. If
+those events are no longer available (because the daemon was restarted or
+the client was away for too long) they receive a `reset` event instead and
+have to fetch the current state.
+
+"""
+
+import asyncio
+import collections
+import json
+import uuid
+from typing import Any, AsyncIterator, Mapping, Optional
+
+from backy.utils import BackyJSONEncoder
+
+
+class Event(object):
+    cursor: str
+    type: str
+    data: Mapping[str, Any]
+
+    def __init__(self, cursor: str, type: str, data: Mapping[str, Any]):
+        self.cursor = cursor
+        self.type = type
+        self.data = data
+
+    def encode(self) -> bytes:
+        data = json.dumps(self.data, cls=BackyJSONEncoder)
+        return (
+            f"id: {self.cursor}\nevent: {self.type}\ndata: {data}\n\n"
+        ).encode("utf-8")
+
+
+class EventLog(object):
+    """The most recent events, for subscribers to catch up from."""
+
+    size: int
+    # Identifies this daemon run: cursors of other runs can not be resumed.
+    epoch: str
+    sequence: int
+    events: collections.deque[tuple[int, Event]]
+    _published: asyncio.Event
+
+    def __init__(self, size: int = 1000):
+        self.size = size
+        self.epoch = uuid.uuid4().hex[:8]
+        self.sequence = 0
+        self.events = collections.deque(maxlen=size)
+        self._published = asyncio.Event()
+
+    @property
+    def cursor(self) -> str:
+        return f"{self.epoch}-{self.sequence}"
+
+    def publish(self, type: str, data: Mapping[str, Any]) -> Event:
+        self.sequence += 1
+        event = Event(self.cursor, type, data)
+        self.events.append((self.sequence, event))
+        self._published.set()
+        self._published = asyncio.Event()
+        return event
+
+    def _position(self, cursor: Optional[str]) -> Optional[int]:
+        """The sequence number to resume after, None if we can't."""
+        if not cursor:
+            return self.sequence
+        epoch, _, sequence = cursor.partition("-")
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        position = int(sequence)
+        first = self.events[0][0] if self.events else self.sequence + 1
+        if position > self.sequence or position < first - 1:
+            return None
+        return position
+
+    async def subscribe(
+        self,
+        cursor: Optional[str] = None,
+        stop: Optional[asyncio.Event] = None,
+        keepalive: float = 30,
+    ) -> AsyncIterator[Optional[Event]]:
+        """Yield the events after `cursor` (or from now on) until `stop`.
+
+        Yields None after `keepalive` seconds without events.
+        """
+        position = self._position(cursor)
+        if position is None:
+            position = self.sequence
+            yield Event(self.cursor, "reset", {})
+        while not (stop and stop.is_set()):
+            first = self.events[0][0] if self.events else self.sequence + 1
+            if position < first - 1:
+                # We were too slow to keep up.
+                position = self.sequence
+                yield Event(self.cursor, "reset", {})
+                continue
+            pending = [(s, e) for s, e in self.events if s > position]
+            if pending:
+                for position, event in pending:
+                    yield event
+                continue
+            waiters = [asyncio.ensure_future(self._published.wait())]
+            if stop:
+                waiters.append(asyncio.ensure_future(stop.wait()))
+            try:
+                done, _ = await asyncio.wait(
+                    waiters,
+                    timeout=keepalive,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+            if not done:
+                yield None
@@ -0,0 +1,189 @@
+"""Blocking repository I/O for the daemon.
+
+Scanning a repository parses a YAML file per revision, writing revision
+metadata fsyncs. On a slow disk or with a large repository this takes long
+enough to stall every job and every API request if it runs on the event
+loop. The daemon therefore runs this work in a bounded thread pool and only
+waits for the result.
+
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, Optional, TypedDict, TypeVar
+
+from structlog.stdlib import BoundLogger
+
+from backy.repository import Repository
+
+T = TypeVar("T")
+
+
+class ExecutorMetrics(TypedDict):
+    workers: int
+    running: int
+    waiting: int
+    calls: int
+    # How long calls took, in seconds.
+    duration_max: float
+    duration_mean: float
+
+
+class RepositoryExecutor(object):
+    """Runs blocking repository work in a thread pool.
+
+    Work on the same repository is serialised: repositories are not thread
+    safe and their locks are not re-entrant. Work on different repositories
+    runs in parallel, up to the number of workers.
+
+    """
+
+    workers: int
+    log: BoundLogger
+    _pool: ThreadPoolExecutor
+    _locks: dict[Path, asyncio.Lock]
+
+    running: int
+    waiting: int
+    calls: int
+    duration_max: float
+    duration_total: float
+
+    def __init__(self, log: BoundLogger, workers: int = 4):
+        self.log = log.bind(subsystem="executor")
+        self.workers = workers
+        self._pool = self._create_pool()
+        self._locks = {}
+        self.running = 0
+        self.waiting = 0
+        self.calls = 0
+        self.duration_max = 0.0
+        self.duration_total = 0.0
+
+    def _create_pool(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(
+            self.workers, thread_name_prefix="repository-io"
+        )
+
+    def configure(self, workers: int) -> None:
+        if workers == self.workers:
+            return
+        self.log.debug("resize", old=self.workers, new=workers)
+        self.workers = workers
+        # Work that was already submitted finishes in the old pool.
+        self._pool.shutdown(wait=False)
+        self._pool = self._create_pool()
+
+    async def run(
+        self, repository: Repository, func: Callable[..., T], *args, **kw
+    ) -> T:
+        """Call `func` in a worker thread once no other work on
+        `repository` is running."""
+        lock = self._locks.get(repository.path)
+        if lock is None:
+            lock = self._locks[repository.path] = asyncio.Lock()
+        self.waiting += 1
+        try:
+            await lock.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            self.running += 1
+            started = time.monotonic()
+            future = asyncio.get_running_loop().run_in_executor(
+                self._pool, partial(func, *args, **kw)
+            )
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The thread can't be stopped. Keep the repository to it
+                # until it is done.
+                await asyncio.wait([future])
+                raise
+            finally:
+                duration = time.monotonic() - started
+                self.running -= 1
+                self.calls += 1
+                self.duration_max = max(self.duration_max, duration)
+                self.duration_total += duration
+        finally:
+            lock.release()
+
+    def metrics(self) -> ExecutorMetrics:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "duration_max": self.duration_max,
+            "duration_mean": (
+                self.duration_total / self.calls if self.calls else 0.0
+            ),
+        }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False)
+
+
+class LagMetrics(TypedDict):
+    threshold: float
+    # Times the loop was blocked for longer than the threshold.
+    stalls: int
+    # Seconds the loop was blocked, as of the last check and at most.
+    lag: float
+    lag_max: float
+    last_stall: Optional[float]
+
+
+class LagMonitor(object):
+    """Watches for callbacks that block the event loop.
+
+    Wakes up every `interval` seconds. How late it wakes up is how long
+    other callbacks kept the loop busy. Lags over `threshold` are logged.
+
+    """
+
+    interval: float = 0.5
+    threshold: float
+    log: BoundLogger
+
+    stalls: int
+    lag: float
+    lag_max: float
+    # Wall clock time of the last stall.
+    last_stall: Optional[float]
+
+    def __init__(self, log: BoundLogger, threshold: float = 0.1):
+        self.log = log.bind(subsystem="lag")
+        self.threshold = threshold
+        self.stalls = 0
+        self.lag = 0.0
+        self.lag_max = 0.0
+        self.last_stall = None
+
+    def check(self, lag: float) -> None:
+        self.lag = lag
+        self.lag_max = max(self.lag_max, lag)
+        if lag > self.threshold:
+            self.stalls += 1
+            self.last_stall = time.time()
+            self.log.warning("event-loop-blocked", lag=round(lag, 3))
+
+    async def run_forever(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.check(max(loop.time() - expected, 0.0))
+
+    def metrics(self) -> LagMetrics:
+        return {
+            "threshold": self.threshold,
+            "stalls": self.stalls,
+            "lag": self.lag,
+            "lag_max": self.lag_max,
+            "last_stall": self.last_stall,
+        }
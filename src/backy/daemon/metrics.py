@@ -0,0 +1,366 @@
+"""Metrics in the Prometheus text format.
+
+Scrapes happen often and for all jobs at once, so everything here is taken
+from state the daemon keeps anyway: the state of each repository as of the
+last refresh of its job, the status table and the counters of the
+scheduler, admission, executor and api. Rendering never touches the disk.
+
+"""
+
+import bisect
+import math
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
+
+import backy.utils
+
+if TYPE_CHECKING:
+    from backy.daemon import BackyDaemon
+
+    from .scheduler import Job
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+Labels = dict[str, str]
+Sample = Tuple[Labels, float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(value)
+
+
+class Exposition(object):
+    """Collects metric families and renders them."""
+
+    lines: List[str]
+
+    def __init__(self):
+        self.lines = []
+
+    def add(
+        self,
+        name: str,
+        type: str,
+        help: str,
+        samples: Iterable[Sample],
+    ) -> None:
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {type}")
+        self.samples(name, samples)
+
+    def samples(self, name: str, samples: Iterable[Sample]) -> None:
+        for labels, value in samples:
+            if labels:
+                label_str = ",".join(
+                    f'{k}="{_escape(v)}"' for k, v in labels.items()
+                )
+                name_labels = f"{name}{{{label_str}}}"
+            else:
+                name_labels = name
+            self.lines.append(f"{name_labels} {_value(value)}")
+
+    def gauge(self, name: str, help: str, value: float) -> None:
+        self.add(name, "gauge", help, [({}, value)])
+
+    def counter(self, name: str, help: str, value: float) -> None:
+        self.add(name, "counter", help, [({}, value)])
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+class Histogram(object):
+    """Cumulative bucket counts of observations."""
+
+    buckets: Tuple[float, ...]
+    counts: List[int]
+    sum: float
+    count: int
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, labels: Labels) -> Iterable[Tuple[str, Sample]]:
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield "_bucket", ({**labels, "le": _value(bound)}, cumulative)
+        yield "_bucket", ({**labels, "le": "+Inf"}, self.count)
+        yield "_sum", (labels, self.sum)
+        yield "_count", (labels, self.count)
+
+
+class RequestLatency(object):
+    """How long the api took to answer requests, by route."""
+
+    buckets: Tuple[float, ...] = (
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+    )
+
+    # (method, route, status) -> histogram
+    series: dict[Tuple[str, str, int], Histogram]
+
+    def __init__(self):
+        self.series = {}
+
+    def observe(
+        self, method: str, route: str, status: int, duration: float
+    ) -> None:
+        key = (method, route, status)
+        histogram = self.series.get(key)
+        if histogram is None:
+            histogram = self.series[key] = Histogram(self.buckets)
+        histogram.observe(duration)
+
+    def export(self, exposition: Exposition) -> None:
+        name = "backy_api_request_duration_seconds"
+        exposition.lines.append(
+            f"# HELP {name} Time taken to answer api requests."
+        )
+        exposition.lines.append(f"# TYPE {name} histogram")
+        for (method, route, status), histogram in sorted(self.series.items()):
+            labels = {"method": method, "route": route, "status": str(status)}
+            for suffix, sample in histogram.samples(labels):
+                exposition.samples(name + suffix, [sample])
+
+
+def _last_backup(job: "Job") -> Optional[dict]:
+    return job.state.last_local if job.state else None
+
+
+def _job_samples(daemon: "BackyDaemon", exposition: Exposition) -> None:
+    last: dict[str, dict] = {}
+    for name, job in sorted(daemon.jobs.items()):
+        revision = _last_backup(job)
+        if revision is not None:
+            last[name] = revision
+
+    def stat(key: str) -> List[Sample]:
+        return [
+            ({"job": name}, rev["stats"][key])
+            for name, rev in last.items()
+            if key in rev["stats"]
+        ]
+
+    exposition.add(
+        "backy_job_last_backup_timestamp_seconds",
+        "gauge",
+        "When the last local backup was started.",
+        [({"job": n}, r["timestamp"].timestamp()) for n, r in last.items()],
+    )
+    exposition.add(
+        "backy_job_last_backup_duration_seconds",
+        "gauge",
+        "Duration of the last local backup.",
+        stat("duration"),
+    )
+    exposition.add(
+        "backy_job_last_backup_phase_duration_seconds",
+        "gauge",
+        "Duration of the phases of the last local backup.",
+        [
+            ({"job": name, "phase": phase}, values["duration"])
+            for name, rev in last.items()
+            for phase, values in sorted(rev["stats"].get("phases", {}).items())
+        ],
+    )
+    exposition.add(
+        "backy_job_last_backup_written_bytes",
+        "gauge",
+        "Bytes written by the last local backup.",
+        stat("bytes_written"),
+    )
+    exposition.add(
+        "backy_job_last_backup_chunk_writes",
+        "gauge",
+        "Chunks written by the last local backup, by kind of write.",
+        [
+            ({"job": name, "write": write.removeprefix("write_")}, count)
+            for name, rev in last.items()
+            for write, count in sorted(
+                rev["stats"].get("chunk_stats", {}).items()
+            )
+            if write.startswith("write_")
+        ],
+    )
+    exposition.add(
+        "backy_job_last_backup_trust",
+        "gauge",
+        "Trust in the last local backup (1 for the current state).",
+        [
+            ({"job": name, "trust": rev["trust"]}, 1)
+            for name, rev in last.items()
+        ],
+    )
+    exposition.add(
+        "backy_job_last_backup_source_verification",
+        "gauge",
+        "How the last local backup was compared to its source "
+        "(1 for the method used).",
+        [
+            (
+                {
+                    "job": name,
+                    "verification": rev["stats"]["ceph-verification"],
+                },
+                1,
+            )
+            for name, rev in last.items()
+            if "ceph-verification" in rev["stats"]
+        ],
+    )
+    exposition.add(
+        "backy_chunk_store_chunks",
+        "gauge",
+        "Chunks in the store as of the last local backup.",
+        stat("store_chunks"),
+    )
+    _, statuses = daemon.status_table.snapshot()
+    exposition.add(
+        "backy_job_sla_overdue_seconds",
+        "gauge",
+        "How long the SLA of a job has been breached.",
+        [({"job": s["job"]}, s["sla_overdue"]) for s in statuses],
+    )
+
+
+def render(daemon: "BackyDaemon", latency: RequestLatency) -> str:
+    exposition = Exposition()
+    _job_samples(daemon, exposition)
+
+    scheduler = daemon.scheduler.metrics()
+    exposition.gauge(
+        "backy_scheduler_queued_jobs",
+        "Jobs waiting for their deadline.",
+        scheduler["queued"],
+    )
+    exposition.gauge(
+        "backy_scheduler_running_jobs",
+        "Jobs that were started, including those waiting for a peer.",
+        scheduler["running"],
+    )
+    exposition.gauge(
+        "backy_scheduler_workers",
+        "Jobs that may work at once.",
+        scheduler["workers"],
+    )
+    exposition.gauge(
+        "backy_scheduler_busy_workers",
+        "Jobs that make a backup or do maintenance.",
+        scheduler["busy"],
+    )
+    exposition.counter(
+        "backy_scheduler_dispatched_total",
+        "Jobs that were started.",
+        scheduler["dispatched"],
+    )
+    exposition.gauge(
+        "backy_scheduler_lag_max_seconds",
+        "How late a job was started after its deadline, at most.",
+        scheduler["lag_max"],
+    )
+
+    now = backy.utils.now()
+    admission = daemon.admission
+    exposition.gauge(
+        "backy_admission_running_backups",
+        "Backups that were admitted and are running.",
+        len(admission.running),
+    )
+    exposition.gauge(
+        "backy_admission_waiting_backups",
+        "Backups that are waiting to be admitted.",
+        len(admission.waiting),
+    )
+    exposition.gauge(
+        "backy_admission_in_flight_bytes_per_second",
+        "Estimated I/O rate of the running backups.",
+        admission.in_flight,
+    )
+    exposition.gauge(
+        "backy_admission_wait_max_seconds",
+        "How long the backups that are waiting have waited, at most.",
+        max(
+            ((now - t.queued).total_seconds() for t in admission.waiting),
+            default=0.0,
+        ),
+    )
+    exposition.counter(
+        "backy_admission_admitted_total",
+        "Backups that were admitted.",
+        admission.admitted,
+    )
+    exposition.counter(
+        "backy_admission_wait_seconds_total",
+        "Time the admitted backups have waited for admission.",
+        admission.wait_total,
+    )
+
+    executor = daemon.executor.metrics()
+    exposition.gauge(
+        "backy_io_workers",
+        "Threads for blocking repository I/O.",
+        executor["workers"],
+    )
+    exposition.gauge(
+        "backy_io_running_calls",
+        "Blocking calls that run.",
+        executor["running"],
+    )
+    exposition.gauge(
+        "backy_io_waiting_calls",
+        "Blocking calls waiting for their repository.",
+        executor["waiting"],
+    )
+    exposition.counter(
+        "backy_io_calls_total",
+        "Blocking calls that were made.",
+        executor["calls"],
+    )
+
+    loop = daemon.lag.metrics()
+    exposition.gauge(
+        "backy_event_loop_lag_seconds",
+        "How long the event loop was blocked, as of the last check.",
+        loop["lag"],
+    )
+    exposition.gauge(
+        "backy_event_loop_lag_max_seconds",
+        "How long the event loop was blocked, at most.",
+        loop["lag_max"],
+    )
+    exposition.counter(
+        "backy_event_loop_stalls_total",
+        "Times the event loop was blocked for longer than the threshold.",
+        loop["stalls"],
+    )
+
+    latency.export(exposition)
+    return exposition.render()
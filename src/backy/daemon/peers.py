@@ -0,0 +1,221 @@
+"""A shared cache of the job statuses on our peers.
+
+Jobs ask our peers whether they are about to back up the same source. Instead
+of every job asking every peer for its own status, the cache fetches the
+status of all jobs from a peer with a single request and answers all jobs
+from it, as long as it is fresh enough for them.
+
+Likewise, jobs that follow a job on a peer share a single event stream from
+that peer.
+
+"""
+
+import asyncio
+from typing import Dict, Optional
+
+from aiohttp import ClientError
+from structlog.stdlib import BoundLogger
+
+from backy.repository import StatusDict
+from backy.utils import generate_taskid
+
+from .api import ClientManager, PeerConnections
+
+# Status updates of a job on a peer, None if updates may have been missed.
+Updates = asyncio.Queue[Optional[StatusDict]]
+
+
+class PeerStatus(object):
+    """The statuses of all jobs on a peer, as of `fetched` (loop time)."""
+
+    fetched: float
+    jobs: Dict[str, StatusDict]
+    error: Optional[BaseException]
+
+    def __init__(
+        self,
+        fetched: float,
+        jobs: Dict[str, StatusDict],
+        error: Optional[BaseException] = None,
+    ):
+        self.fetched = fetched
+        self.jobs = jobs
+        self.error = error
+
+
+class PeerStatusCache(object):
+    # How old a status may be, in seconds, if the caller does not require
+    # a newer one.
+    max_age: float = 60
+
+    peers: dict[str, dict]
+    statuses: dict[str, PeerStatus]
+    connections: Optional[PeerConnections]
+    log: BoundLogger
+    # server -> (started, task) of requests in flight
+    _refreshing: dict[str, tuple[float, asyncio.Task[PeerStatus]]]
+    # server -> job name -> the queues of its followers
+    _followers: dict[str, dict[str, set[Updates]]]
+    # server -> task streaming its events
+    _streams: dict[str, asyncio.Task]
+
+    def __init__(
+        self, log: BoundLogger, connections: Optional[PeerConnections] = None
+    ):
+        self.log = log.bind(subsystem="peers")
+        self.connections = connections
+        self.peers = {}
+        self.statuses = {}
+        self._refreshing = {}
+        self._followers = {}
+        self._streams = {}
+
+    def configure(self, peers: dict[str, dict]) -> None:
+        if peers == self.peers:
+            return
+        self.peers = peers
+        self.statuses.clear()
+        self._refreshing.clear()
+        for server, task in self._streams.items():
+            task.cancel()
+            self._dispatch(server, None, None)
+        self._streams.clear()
+
+    def __iter__(self):
+        return iter(self.peers)
+
+    async def _refresh(self, server: str, started: float) -> PeerStatus:
+        try:
+            async with ClientManager(
+                {server: self.peers[server]},
+                generate_taskid(),
+                self.log,
+                self.connections,
+            ) as api:
+                jobs = await api[server].fetch_status()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status = PeerStatus(started, {}, e)
+        else:
+            status = PeerStatus(started, {j["job"]: j for j in jobs})
+        finally:
+            if self._refreshing.get(server, (0, None))[1] is (
+                asyncio.current_task()
+            ):
+                del self._refreshing[server]
+        self.log.debug(
+            "refreshed",
+            server=server,
+            jobs=len(status.jobs),
+            failed=status.error is not None,
+        )
+        if server in self.peers:
+            self.statuses[server] = status
+        return status
+
+    async def get(
+        self, server: str, since: Optional[float] = None
+    ) -> PeerStatus:
+        """The statuses of all jobs on `server`, fetched after `since`.
+
+        `since` is in loop time and defaults to `max_age` ago. Callers share
+        the request that is in flight if it is fresh enough for them.
+        """
+        loop = asyncio.get_running_loop()
+        if since is None:
+            since = loop.time() - self.max_age
+        status = self.statuses.get(server)
+        if status and status.fetched >= since:
+            return status
+        pending = self._refreshing.get(server)
+        if pending is None or pending[0] < since:
+            started = loop.time()
+            task = loop.create_task(
+                self._refresh(server, started), name=f"peer-status-{server}"
+            )
+            pending = self._refreshing[server] = (started, task)
+        return await asyncio.shield(pending[1])
+
+    async def job_status(
+        self, server: str, name: str, since: Optional[float] = None
+    ) -> Optional[StatusDict]:
+        """The status of job `name` on `server`, None if it has no such job.
+
+        Raises the error of the request if the peer was unavailable.
+        """
+        status = await self.get(server, since)
+        if status.error:
+            raise status.error
+        return status.jobs.get(name)
+
+    def follow(self, server: str, name: str) -> Updates:
+        """A queue of the status updates of job `name` on `server`.
+
+        The queue gets None whenever updates may have been missed. Call
+        `unfollow` when done.
+        """
+        queue: Updates = asyncio.Queue()
+        self._followers.setdefault(server, {}).setdefault(name, set()).add(
+            queue
+        )
+        if server not in self._streams:
+            self._streams[server] = asyncio.get_running_loop().create_task(
+                self._stream(server), name=f"peer-events-{server}"
+            )
+        return queue
+
+    def unfollow(self, server: str, name: str, queue: Updates) -> None:
+        followers = self._followers.get(server, {})
+        followers.get(name, set()).discard(queue)
+        if not followers.get(name, True):
+            del followers[name]
+        if not followers:
+            self._followers.pop(server, None)
+            task = self._streams.pop(server, None)
+            if task:
+                task.cancel()
+
+    def _dispatch(
+        self, server: str, name: Optional[str], status: Optional[StatusDict]
+    ) -> None:
+        """Put `status` into the queues of the followers of `name`, or of
+        all jobs on `server` if `name` is None."""
+        followers = self._followers.get(server, {})
+        names = list(followers) if name is None else [name]
+        for name in names:
+            for queue in followers.get(name, ()):
+                queue.put_nowait(status)
+
+    async def _stream(self, server: str) -> None:
+        """Dispatch the status events of `server` to the followers.
+
+        Resumes the event stream if the peer closes it.
+        """
+        loop = asyncio.get_running_loop()
+        cursor = None
+        try:
+            # Streams hold on to their connection, they must not use up the
+            # daemon's connections to the peer.
+            async with ClientManager(
+                {server: self.peers[server]}, generate_taskid(), self.log
+            ) as api:
+                while True:
+                    connected = loop.time()
+                    async for event in api[server].events(cursor):
+                        cursor = event["cursor"]
+                        if event["type"] == "reset":
+                            self._dispatch(server, None, None)
+                        elif event["type"] == "status":
+                            self._dispatch(
+                                server, event["data"]["job"], event["data"]
+                            )
+                    if loop.time() - connected < 1:
+                        break
+        except (ClientError, asyncio.TimeoutError):
+            pass
+        finally:
+            if self._streams.get(server) is asyncio.current_task():
+                del self._streams[server]
+        # Followers fall back to asking for the status.
+        self._dispatch(server, None, None)
@@ -0,0 +1,248 @@
+"""Planned spreads: the offsets of jobs within their schedule interval.
+
+By default the offset of a job is a hash of its name, which spreads jobs
+uniformly regardless of how long they take. The planner instead places
+jobs one by one where they increase the peak of the estimated I/O the
+least, starting with the most expensive ones.
+
+Offsets are persisted and only jobs that are new (or whose interval
+changed) are placed, so that reloads and restarts do not move backups
+around.
+
+"""
+
+import collections
+import json
+import math
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, List, Optional, Sequence, TypedDict
+
+from structlog.stdlib import BoundLogger
+
+from backy.utils import SafeFile
+
+from .admission import Cost
+
+if TYPE_CHECKING:
+    from .scheduler import Job
+
+# The resolution of the load profile, in seconds.
+BUCKET = 5 * 60
+
+
+@dataclass(frozen=True)
+class Placement:
+    """What the planner needs to know about a job."""
+
+    name: str
+    # The smallest interval of the job's schedule, in seconds.
+    period: int
+    duration: float
+    # Estimated I/O while running, in bytes per second. None if unknown.
+    rate: Optional[float]
+    # The offset the job would have without the planner.
+    preferred: int
+
+    @classmethod
+    def from_job(cls, job: "Job") -> "Placement":
+        cost = Cost.estimate(job.repository)
+        period = int(
+            min(
+                x["interval"] for x in job.schedule.schedule.values()
+            ).total_seconds()
+        )
+        return cls(
+            job.name,
+            period,
+            cost.duration,
+            cost.rate if cost.known else None,
+            job.hash_spread % period,
+        )
+
+
+class BucketDict(TypedDict):
+    offset: int
+    backups: int
+    rate: float
+
+
+class ProfileDict(TypedDict):
+    mode: str
+    bucket: int
+    horizon: int
+    peak: float
+    buckets: List[BucketDict]
+
+
+class LoadProfile(object):
+    """The estimated backups and I/O in each bucket of a horizon.
+
+    The horizon is the largest period of all jobs, jobs with shorter periods
+    occur multiple times.
+
+    """
+
+    size: int
+    rates: List[float]
+    backups: List[int]
+    default_rate: float
+
+    def __init__(self, placements: Iterable[Placement]):
+        placements = list(placements)
+        horizon = max((p.period for p in placements), default=BUCKET)
+        self.size = max(1, horizon // BUCKET)
+        self.rates = [0.0] * self.size
+        self.backups = [0] * self.size
+        known = [p.rate for p in placements if p.rate is not None]
+        self.default_rate = sum(known) / len(known) if known else 0.0
+
+    def rate(self, placement: Placement) -> float:
+        if placement.rate is None:
+            return self.default_rate
+        return placement.rate
+
+    def _period(self, placement: Placement) -> int:
+        return min(self.size, max(1, placement.period // BUCKET))
+
+    def _width(self, placement: Placement) -> int:
+        width = max(1, math.ceil(placement.duration / BUCKET))
+        return min(width, self._period(placement))
+
+    def _starts(self, placement: Placement, offset: int) -> range:
+        period = self._period(placement)
+        return range(offset // BUCKET % period, self.size, period)
+
+    def add(self, placement: Placement, offset: int) -> None:
+        rate = self.rate(placement)
+        width = self._width(placement)
+        for start in self._starts(placement, offset):
+            for i in range(start, start + width):
+                self.rates[i % self.size] += rate
+                self.backups[i % self.size] += 1
+
+    def _window_max(self, values: Sequence[float], width: int) -> List[float]:
+        """The maximum of each `width` buckets, over the circular profile."""
+        result: List[float] = [0.0] * self.size
+        queue: collections.deque[int] = collections.deque()
+        for i in range(self.size + width - 1):
+            while queue and values[queue[-1] % self.size] <= (
+                values[i % self.size]
+            ):
+                queue.pop()
+            queue.append(i)
+            start = i - width + 1
+            if queue[0] < start:
+                queue.popleft()
+            if start >= 0:
+                result[start] = values[queue[0] % self.size]
+        return result
+
+    def best_offset(self, placement: Placement) -> int:
+        """The offset that increases the peak the least.
+
+        Ties are broken by the number of concurrent backups and then by the
+        distance to the preferred offset.
+        """
+        width = self._width(placement)
+        period = self._period(placement)
+        rates = self._window_max(self.rates, width)
+        backups = self._window_max(self.backups, width)
+        preferred = placement.preferred // BUCKET % period
+
+        def score(offset: int) -> tuple[float, float, int]:
+            starts = range(offset, self.size, period)
+            distance = abs(offset - preferred)
+            return (
+                max(rates[s] for s in starts),
+                max(backups[s] for s in starts),
+                min(distance, period - distance),
+            )
+
+        best = min(range(period), key=score)
+        if best == preferred:
+            # Keep the exact preferred offset, not just its bucket.
+            return placement.preferred
+        return best * BUCKET
+
+    def to_dict(self, mode: str) -> ProfileDict:
+        return {
+            "mode": mode,
+            "bucket": BUCKET,
+            "horizon": self.size * BUCKET,
+            "peak": max(self.rates),
+            "buckets": [
+                {"offset": i * BUCKET, "backups": backups, "rate": rate}
+                for i, (backups, rate) in enumerate(
+                    zip(self.backups, self.rates)
+                )
+            ],
+        }
+
+
+class SpreadPlanner(object):
+    path: Path
+    log: BoundLogger
+    # name -> (period, offset)
+    offsets: dict[str, tuple[int, int]]
+
+    def __init__(self, path: Path, log: BoundLogger):
+        self.path = path
+        self.log = log.bind(subsystem="planner")
+        self.offsets = {}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with self.path.open(encoding="utf-8") as f:
+                self.offsets = {
+                    name: (period, offset)
+                    for name, (period, offset) in json.load(f).items()
+                }
+        except FileNotFoundError:
+            pass
+        except (ValueError, TypeError):
+            self.log.warning("invalid-plan", exc_style="short")
+
+    def _save(self) -> None:
+        with SafeFile(self.path, encoding="utf-8") as f:
+            f.open_new("wb")
+            json.dump(self.offsets, f)
+
+    def plan(self, placements: List[Placement]) -> dict[str, int]:
+        """Return the offsets of all jobs, placing new ones."""
+        profile = LoadProfile(placements)
+        offsets: dict[str, tuple[int, int]] = {}
+        new = []
+        for p in placements:
+            planned = self.offsets.get(p.name)
+            if planned and planned[0] == p.period:
+                offsets[p.name] = planned
+                profile.add(p, planned[1])
+            else:
+                new.append(p)
+        # Most expensive first, they are the hardest to fit.
+        new.sort(key=lambda p: (-p.duration * profile.rate(p), p.name))
+        for p in new:
+            offset = profile.best_offset(p)
+            offsets[p.name] = (p.period, offset)
+            profile.add(p, offset)
+        if offsets != self.offsets:
+            self.log.info(
+                "planned",
+                placed=len(new),
+                removed=len(self.offsets.keys() - offsets.keys()),
+                peak=int(max(profile.rates)),
+            )
+            self.offsets = offsets
+            self._save()
+        return {name: offset for name, (_, offset) in offsets.items()}
+
+
+def load_profile(
+    placements: List[Placement], offsets: dict[str, int], mode: str
+) -> ProfileDict:
+    profile = LoadProfile(placements)
+    for p in placements:
+        profile.add(p, offsets[p.name])
+    return profile.to_dict(mode)
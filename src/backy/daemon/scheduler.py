@@ -1,31 +1,57 @@
 import asyncio
 import datetime
 import hashlib
+import heapq
+import itertools
 import random
 import subprocess
 from collections import defaultdict
 from datetime import timedelta
+from functools import partial
 from pathlib import Path
-from typing import TYPE_CHECKING, List, Literal, Optional, Set
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    TypedDict,
+    TypeVar,
+)
 
 import yaml
 from aiohttp import ClientConnectionError, ClientError, ClientResponseError
-from aiohttp.web_exceptions import HTTPForbidden, HTTPNotFound
+from aiohttp.web_exceptions import (
+    HTTPForbidden,
+    HTTPMethodNotAllowed,
+    HTTPNoContent,
+    HTTPNotFound,
+)
 from structlog.stdlib import BoundLogger
 
 import backy.utils
 from backy.repository import Repository
 from backy.revision import Revision
 from backy.schedule import Schedule
-from backy.utils import format_datetime_local, generate_taskid, time_or_event
+from backy.utils import (
+    AdjustableBoundedSemaphore,
+    format_datetime_local,
+    generate_taskid,
+)
 
 from ..source import AsyncCmdLineSource
-from .api import Client, ClientManager
+from .api import Client, ClientManager, RevisionChanges
+from .peers import Updates
+from .status import RepositoryState
 
 if TYPE_CHECKING:
     from backy.daemon import BackyDaemon
     from backy.repository import StatusDict
 
+T = TypeVar("T")
+
 
 def locked(target: str, mode: Literal["shared", "exclusive"]):
     return Repository.locked(target, mode, repo_attr="repository")
@@ -45,29 +71,54 @@ class Job(object):
     errors: int = 0
     backoff: int = 0
     taskid: str = ""
+    # Set by the daemon if spreads are planned, see `backy.daemon.planner`.
+    planned_spread: Optional[int] = None
+    # Our repository as of the last `refresh`.
+    state: Optional[RepositoryState] = None
+    # The revisions as of the last published events, by uuid, and the
+    # metadata version of our repository back then.
+    published_revs: Optional[dict[str, dict]] = None
+    published_version: Optional[str] = None
+    # server -> (metadata version, revision uuids) as of our last pull.
+    pulled: dict[str, tuple[str, set[str]]]
     log: BoundLogger
 
-    _task: Optional[asyncio.Task] = None
-
     def __init__(self, daemon: "BackyDaemon", name: str, log: BoundLogger):
         self.daemon = daemon
         self.name = name
         self.log = log.bind(job_name=name, subsystem="job")
         self.run_immediately = asyncio.Event()
+        self.pulled = {}
         self.path = self.daemon.base_dir / self.name
         self.logfile = self.path / "backy.log"
 
     def configure(self, config: dict) -> None:
+        """Use `config` from now on. See `prepare`."""
         repository = Repository(
             self.path, self.daemon.schedules[config["schedule"]], self.log
         )
-        repository.connect()
         self.source = AsyncCmdLineSource(repository, config["source"], self.log)
-        self.source.store()
         self.last_config = config
 
+    async def prepare(self) -> None:
+        """Create our repository if needed, store our source and take the
+        state of the repository. Needed after `configure`, before `start`.
+        """
+        self.state = await self._io(self._prepare)
+
+    def _prepare(self) -> RepositoryState:
+        state, _ = self._refresh(connect=True)
+        self.source.store()
+        return state
+
     @property
     def spread(self) -> int:
+        if self.planned_spread is not None:
+            return self.planned_spread
+        return self.hash_spread
+
+    @property
+    def hash_spread(self) -> int:
         seed = int(hashlib.md5(self.name.encode("utf-8")).hexdigest(), 16)
         limit = max(x["interval"] for x in self.schedule.schedule.values())
         limit = int(limit.total_seconds())
@@ -83,9 +134,102 @@ class Job(object):
     def repository(self) -> Repository:
         return self.source.repository
 
+    async def _io(self, func: Callable[..., T], *args, **kw) -> T:
+        """Run blocking work on our repository without blocking the event
+        loop."""
+        return await self.daemon.executor.run(
+            self.repository, func, *args, **kw
+        )
+
     def update_status(self, status: str) -> None:
         self.status = status
         self.log.debug("updating-status", status=self.status)
+        self.publish_events()
+
+    def publish_events(self) -> None:
+        """Publish our status if it changed.
+
+        Uses the state of our repository as of the last `refresh`.
+        """
+        if self.state is None:
+            # Not refreshed (yet).
+            return
+        status = self.daemon.job_status(self)
+        if self.daemon.status_table.update(status, self.state):
+            self.daemon.events.publish("status", status)
+
+    async def refresh(self, connect: bool = False) -> None:
+        """Scan our repository and publish what changed.
+
+        Scanning is cheap if nothing changed, see `Repository.scan`.
+        Connects the repository instead if `connect`.
+        """
+        state, events = await self._io(self._refresh, connect)
+        if state is self.state:
+            return
+        self.state = state
+        for data in events:
+            self.daemon.events.publish("revision", data)
+        self.publish_events()
+
+    def _refresh(self, connect: bool) -> tuple[RepositoryState, list[dict]]:
+        """Take the state of our repository and the revision events since
+        the last refresh.
+
+        Runs in the executor. The history is only walked if it changed.
+        """
+        repository = self.repository
+        if connect:
+            repository.connect()
+        else:
+            repository.scan()
+            repository.refresh_reports()
+        state = self.state
+        if (
+            state is not None
+            and state.version == repository.metadata_version
+            and state.problem_reports == len(repository.report_ids)
+        ):
+            return state, []
+        return RepositoryState(repository), self._revision_events()
+
+    def _revision_events(self) -> list[dict]:
+        """The revisions that changed since we last looked.
+
+        Only the revisions that changed since are serialised.
+        """
+        events: list[dict] = []
+        version = self.repository.metadata_version
+        if self.published_revs is None:
+            self.published_revs = {
+                r.uuid: r.to_dict() for r in self.repository.history
+            }
+        elif version != self.published_version:
+            published = self.published_revs
+            history = self.repository.history
+            changed = self.repository.changed_since(self.published_version)
+            for r in history:
+                if changed is not None and r.uuid not in changed:
+                    continue
+                rev = r.to_dict()
+                old = published.get(r.uuid)
+                if old == rev:
+                    continue
+                events.append(
+                    {
+                        "job": self.name,
+                        "action": "new" if old is None else "changed",
+                        "revision": rev,
+                    }
+                )
+                published[r.uuid] = rev
+            for uuid in published.keys() - {r.uuid for r in history}:
+                events.append(
+                    {"job": self.name, "action": "removed", "uuid": uuid}
+                )
+                del published[uuid]
+        self.published_version = version
+        return events
 
     def to_dict(self) -> dict:
         return {
@@ -96,29 +240,19 @@ class Job(object):
             "schedule": self.schedule.to_dict(),
         }
 
-    async def _wait_for_deadline(self) -> Optional[Literal[True]]:
-        assert self.next_time
-        self.update_status("waiting for deadline")
-        trigger = await time_or_event(self.next_time, self.run_immediately)
-        self.run_immediately.clear()
-        self.log.info("woken", trigger=trigger)
-        return trigger
-
     async def _wait_for_leader(self, next_time: datetime.datetime) -> bool:
-        api = None
+        peers = self.daemon.peer_status
         try:
-            api = ClientManager(self.daemon.peers, self.taskid, self.log)
+            servers = list(peers)
             statuses = await asyncio.gather(
-                *[api[server].fetch_status(f"^{self.name}$") for server in api],
+                *[peers.job_status(server, self.name) for server in servers],
                 return_exceptions=True,
             )
             leader = None
-            leader_revs = len(
-                self.repository.get_history(clean=True, local=True)
-            )
+            leader_revs = self.state.local_revs if self.state else 0
             leader_status: "StatusDict"
             self.log.info("local-revs", local_revs=leader_revs)
-            for server, status in zip(api, statuses):
+            for server, status in zip(servers, statuses):
                 log = self.log.bind(server=server)
                 if isinstance(status, BaseException):
                     log.info(
@@ -127,12 +261,15 @@ class Job(object):
                         exc_style="short",
                     )
                     continue
-                num_remote_revs = status[0]["local_revs"]
+                if status is None:
+                    log.debug("no-duplicate-job")
+                    continue
+                num_remote_revs = status["local_revs"]
                 log.info("duplicate-job", remote_revs=num_remote_revs)
                 if num_remote_revs > leader_revs:
                     leader_revs = num_remote_revs
                     leader = server
-                    leader_status = status[0]
+                    leader_status = status
 
             log = self.log.bind(leader=leader)
             log.info("leader-found", leader_revs=leader_revs)
@@ -140,156 +277,212 @@ class Job(object):
                 return False
 
             self.update_status(f"monitoring ({leader})")
-            res = leader_status
-            while True:
-                if (
-                    res["last_time"]
-                    and (next_time - res["last_time"]).total_seconds() < 5 * 60
-                ):
-                    # there was a backup in the last 5min
-                    log.info("leader-finished")
-                    return True
-                if not res["status"]:
-                    log.info("leader-stopped")
-                    return False
-                if res["next_time"] and (
-                    (res["next_time"] - next_time).total_seconds() > 5 * 60
-                ):
-                    # not currently running or scheduled in the next 5min
-                    log.info("leader-not-scheduled")
-                    return False
-
-                if await backy.utils.delay_or_event(300, self.run_immediately):
-                    self.run_immediately.clear()
-                    log.info("run-immediately-triggered")
-                    return False
-                try:
-                    res = (await api[leader].fetch_status(f"^{self.name}$"))[0]
-                except ClientError:
-                    log.warning("leader-failed", exc_style="short")
-                    return False
+            res: Optional["StatusDict"] = leader_status
+            updates: Optional[Updates] = None
+            try:
+                while True:
+                    if res is None:
+                        log.info("leader-stopped")
+                        return False
+                    if (
+                        res["last_time"]
+                        and (next_time - res["last_time"]).total_seconds()
+                        < 5 * 60
+                    ):
+                        # there was a backup in the last 5min
+                        log.info("leader-finished")
+                        return True
+                    if not res["status"]:
+                        log.info("leader-stopped")
+                        return False
+                    if res["next_time"] and (
+                        (res["next_time"] - next_time).total_seconds() > 5 * 60
+                    ):
+                        # not currently running or scheduled in the next 5min
+                        log.info("leader-not-scheduled")
+                        return False
+                    if res["next_time"] and (
+                        (backy.utils.now() - res["next_time"]).total_seconds()
+                        > 5 * 60
+                    ):
+                        # still queued long after its deadline, e.g. because
+                        # it is waiting for us
+                        log.info("leader-overdue")
+                        return False
+
+                    if updates is None:
+                        updates = peers.follow(leader, self.name)
+                    since = asyncio.get_running_loop().time()
+                    waiting = asyncio.ensure_future(
+                        backy.utils.delay_or_event(300, self.run_immediately)
+                    )
+                    update = asyncio.ensure_future(updates.get())
+                    try:
+                        await asyncio.wait(
+                            [waiting, update],
+                            return_when=asyncio.FIRST_COMPLETED,
+                        )
+                    finally:
+                        waiting.cancel()
+                        update.cancel()
+                    if waiting.done() and waiting.result():
+                        self.run_immediately.clear()
+                        log.info("run-immediately-triggered")
+                        return False
+                    if update.done() and update.result():
+                        res = update.result()
+                        continue
+                    # Nothing was streamed in a while (or the stream broke):
+                    # ask. Jobs monitoring the same leader share requests.
+                    try:
+                        res = await peers.job_status(leader, self.name, since)
+                    except ClientError:
+                        log.warning("leader-failed", exc_style="short")
+                        return False
+            finally:
+                if updates is not None:
+                    peers.unfollow(leader, self.name, updates)
         except asyncio.CancelledError:
             raise
         except Exception:
             self.log.exception("_wait_for_leader-failed")
             return False
-        finally:
-            if api:
-                await api.close()
 
-    async def run_forever(self) -> None:
-        """Generate backup tasks for this job.
+    @property
+    def active(self) -> bool:
+        """Whether the job is waiting for its deadline or running."""
+        return self.daemon.scheduler.is_active(self)
 
-        Tasks are based on the ideal next time in the future and
-        previous tasks to ensure we catch up quickly if the next job in
-        the future is too far away.
+    def schedule_next(self) -> None:
+        """Determine the next backup and queue it in the scheduler.
 
-        This may repetetively submit a task until its time has come and
-        then generate other tasks after the ideal next time has switched
-        over.
+        The next time is based on the ideal next time in the future and
+        previous backups to ensure we catch up quickly if the next time
+        in the future is too far away.
 
-        It doesn't care whether the tasks have been successfully worked
-        on or not. The task pool needs to deal with that.
+        After failures we only pause for the backoff period.
+
+        Uses the history as of the last scan of our repository.
         """
-        self.errors = 0
-        self.backoff = 0
-        self.log.debug("loop-started")
-        while True:
-            self.taskid = generate_taskid()
-            # TODO: use contextvars
-            self.log = self.log.bind(job_name=self.name, sub_taskid=self.taskid)
+        self.taskid = generate_taskid()
+        # TODO: use contextvars
+        self.log = self.log.bind(job_name=self.name, sub_taskid=self.taskid)
 
-            self.source.log = self.source.log.bind(
-                job_name=self.name, sub_taskid=self.taskid
-            )
-            self.repository.log = self.repository.log.bind(
-                job_name=self.name, sub_taskid=self.taskid
-            )
-            self.repository.connect()
+        self.source.log = self.source.log.bind(
+            job_name=self.name, sub_taskid=self.taskid
+        )
+        self.repository.log = self.repository.log.bind(
+            job_name=self.name, sub_taskid=self.taskid
+        )
 
-            next_time, next_tags = self.schedule.next(
-                backy.utils.now(), self.spread, self.repository
-            )
+        next_time, next_tags = self.schedule.next(
+            backy.utils.now(), self.spread, self.repository
+        )
 
-            if self.errors:
-                # We're retrying - do not pay attention to the schedule but
-                # we know that we have to make a backup if possible and only
-                # pause for the backoff period.
-                # We do, however, use the current tags just in case that we're
-                # not able to make backups for a longer period.
-                # This way we also use the queuing mechanism correctly so that
-                # one can still manually trigger a run if one wishes to.
-                next_time = backy.utils.now() + timedelta(seconds=self.backoff)
-
-            self.next_time = next_time
-            self.next_tags = next_tags
-            self.log.info(
-                "waiting",
-                next_time=format_datetime_local(self.next_time)[0],
-                next_tags=", ".join(next_tags),
-            )
-            run_immediately = await self._wait_for_deadline()
+        if self.errors:
+            # We're retrying - do not pay attention to the schedule but
+            # we know that we have to make a backup if possible and only
+            # pause for the backoff period.
+            # We do, however, use the current tags just in case that we're
+            # not able to make backups for a longer period.
+            # This way we also use the queuing mechanism correctly so that
+            # one can still manually trigger a run if one wishes to.
+            next_time = backy.utils.now() + timedelta(seconds=self.backoff)
+
+        self.next_time = next_time
+        self.next_tags = next_tags
+        self.log.info(
+            "waiting",
+            next_time=format_datetime_local(self.next_time)[0],
+            next_tags=", ".join(next_tags),
+        )
+        self.update_status("waiting for deadline")
+        if self.run_immediately.is_set():
+            # Triggered while we were running.
+            next_time = backy.utils.now()
+        self.daemon.scheduler.schedule(self, next_time)
 
-            # The UI shouldn't show a next any longer now that we have already
-            # triggered.
-            self.next_time = None
-            self.next_tags = None
+    def run_now(self) -> None:
+        """Run the job as soon as possible.
 
-            try:
-                self.update_status("checking neighbours")
-                if not run_immediately and await self._wait_for_leader(
-                    next_time
-                ):
-                    await self.pull_metadata()
-                    await self.run_callback()
-                else:
-                    speed = "slow"
-                    if (
-                        self.repository.clean_history
-                        and self.repository.clean_history[-1].stats["duration"]
-                        < 600
-                    ):
-                        speed = "fast"
-                    self.update_status(f"waiting for worker slot ({speed})")
-
-                    async with self.daemon.backup_semaphores[speed]:
-                        self.update_status(f"running ({speed})")
-
-                        self.repository._clean()
-                        await self.run_backup(next_tags)
-                        self.repository.scan()
-                        self.repository._clean()
-                        await self.pull_metadata()
-                        await self.run_expiry()
-                        await self.push_metadata()
-                        await self.run_gc()
-                        await self.run_callback()
-            except asyncio.CancelledError:
-                raise
-            except Exception:
-                self.log.exception("exception")
-
-                self.update_status("failed")
-                # Something went wrong. Use bounded expontial backoff to avoid
-                # hogging the workers. We sometimes can't make backups because
-                # of external reasons (i.e. the VM is shut down and properly
-                # making a snapshot fails
-                self.errors += 1
-                # Our retry series (in minutes). We converge on waiting
-                # 6 hours maximum for retries.
-                # 2, 4, 8, 16, 32, 65, ..., 6*60, 6*60, ...
-                self.backoff = min([2**self.errors, 6 * 60]) * 60
-                self.log.warning("backoff", backoff=self.backoff)
+        A job that is monitoring a peer stops waiting for it.
+        """
+        self.run_immediately.set()
+        self.daemon.scheduler.run_now(self)
+
+    async def run(self) -> None:
+        """Run the backup that is due (or wait for a peer to make it).
+
+        Called by the scheduler when the deadline was reached.
+
+        It doesn't care whether the backup has been successful or not:
+        failures are retried with a backoff when the job is scheduled
+        next.
+        """
+        assert self.next_time and self.next_tags is not None
+        run_immediately: Optional[Literal[True]] = (
+            True if self.run_immediately.is_set() else None
+        )
+        self.run_immediately.clear()
+        self.log.info("woken", trigger=run_immediately)
+        next_time, next_tags = self.next_time, self.next_tags
+
+        # The UI shouldn't show a next any longer now that we have already
+        # triggered.
+        self.next_time = None
+        self.next_tags = None
+
+        # Only the work itself takes a scheduler worker: waiting for a peer
+        # or for admission can take hours.
+        workers = self.daemon.scheduler.workers
+        try:
+            self.update_status("checking neighbours")
+            if not run_immediately and await self._wait_for_leader(next_time):
+                await self.pull_metadata()
+                await self.refresh(connect=True)
             else:
-                self.errors = 0
-                self.backoff = 0
-                self.update_status("finished")
+                self.update_status("waiting for worker slot")
+                async with self.daemon.admission.slot(self), workers:
+                    self.update_status("running")
+                    await self._io(self.repository._clean)
+                    await self.run_backup(next_tags)
+                # Maintenance does not count against the I/O budget of
+                # backups.
+                async with workers:
+                    await self._io(self.repository.scan)
+                    await self._io(self.repository._clean)
+                    await self.pull_metadata()
+                    await self.run_expiry()
+                    await self.push_metadata()
+                    await self.run_gc()
+                    await self.refresh(connect=True)
+            await self.run_callback()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.log.exception("exception")
+
+            self.update_status("failed")
+            # Something went wrong. Use bounded expontial backoff to avoid
+            # hogging the workers. We sometimes can't make backups because
+            # of external reasons (i.e. the VM is shut down and properly
+            # making a snapshot fails
+            self.errors += 1
+            # Our retry series (in minutes). We converge on waiting
+            # 6 hours maximum for retries.
+            # 2, 4, 8, 16, 32, 65, ..., 6*60, 6*60, ...
+            self.backoff = min([2**self.errors, 6 * 60]) * 60
+            self.log.warning("backoff", backoff=self.backoff)
+        else:
+            self.errors = 0
+            self.backoff = 0
+            self.update_status("finished")
 
     async def run_backup(self, tags: Set[str]) -> None:
         self.log.info("backup-started", tags=", ".join(tags))
 
         r = Revision.create(self.repository, tags, self.log)
-        r.materialize()
+        await self._io(r.materialize)
         return_code = await self.source.backup(r)
         if return_code:
             raise RuntimeError(f"Backup failed with return code {return_code}")
@@ -297,7 +490,7 @@ class Job(object):
     async def run_expiry(self) -> None:
         self.log.info("expiry-started")
         # includes lock and repository.scan()
-        self.repository.expire()
+        await self._io(self.repository.expire)
 
     async def run_gc(self) -> None:
         self.log.info("gc-started")
@@ -341,19 +534,16 @@ class Job(object):
             raise
 
     def start(self) -> None:
-        assert self._task is None
-        assert self.daemon.loop
-        self._task = self.daemon.loop.create_task(
-            self.run_forever(), name=f"backup-loop-{self.name}"
-        )
+        self.errors = 0
+        self.backoff = 0
+        self.log.debug("loop-started")
+        self.schedule_next()
 
     def stop(self) -> None:
         # XXX make shutdown graceful and let a previous run finish ...
         # schedule a reload after that.
-        if self._task:
+        if self.daemon.scheduler.cancel(self):
             self.log.info("stop")
-            self._task.cancel()
-            self._task = None
             self.update_status("")
 
     @locked(target=".backup", mode="exclusive")
@@ -366,7 +556,7 @@ class Job(object):
             "push-start", changes=sum(len(L) for L in grouped.values())
         )
         async with ClientManager(
-            self.daemon.peers, self.taskid, self.log
+            self.daemon.peers, self.taskid, self.log, self.daemon.connections
         ) as apis:
             errors = await asyncio.gather(
                 *[
@@ -380,26 +570,13 @@ class Job(object):
     async def _push_metadata_single(
         self, api: Client, revs: List[Revision]
     ) -> bool:
-        purge_required = False
         error = False
-        for r in revs:
-            log = self.log.bind(
-                server=r.server,
-                rev_uuid=r.uuid,
-            )
-            log.debug(
-                "push-updating-tags",
-                old_tags=r.orig_tags,
-                new_tags=r.tags,
-            )
+        log = self.log.bind(server=api.server_name)
+        results: dict[str, int] = {}
+        if revs:
+            log.debug("push-updating-tags", revs=len(revs))
             try:
-                await api.put_tags(r, autoremove=True)
-                if r.tags:
-                    r.orig_tags = r.tags
-                    r.write_info()
-                else:
-                    r.remove(force=True)
-                    purge_required = True
+                results = await self._update_tags(api, revs)
             except ClientResponseError:
                 log.warning("push-client-error", exc_style="short")
                 error = True
@@ -410,6 +587,11 @@ class Job(object):
                 log.exception("push-error")
                 error = True
 
+        rejected, purge_required = await self._io(
+            self._apply_pushed, log, revs, results
+        )
+        error |= rejected
+
         if purge_required:
             log = self.log.bind(server=api.server_name)
             log.debug("push-purging-remote")
@@ -426,9 +608,57 @@ class Job(object):
                 error = True
         return error
 
+    def _apply_pushed(
+        self, log: BoundLogger, revs: List[Revision], results: dict[str, int]
+    ) -> tuple[bool, bool]:
+        """Record which tag changes the peer accepted.
+
+        Returns whether changes were rejected and whether revisions were
+        removed, so that the peer has to purge.
+        """
+        rejected = False
+        purge_required = False
+        for r in revs:
+            if r.uuid not in results:
+                continue
+            if results[r.uuid] != HTTPNoContent.status_code:
+                log.warning(
+                    "push-rejected",
+                    rev_uuid=r.uuid,
+                    old_tags=r.orig_tags,
+                    new_tags=r.tags,
+                    status=results[r.uuid],
+                )
+                rejected = True
+            elif r.tags:
+                r.orig_tags = r.tags
+                r.write_info()
+            else:
+                r.remove(force=True)
+                purge_required = True
+        return rejected, purge_required
+
+    async def _update_tags(
+        self, api: Client, revs: List[Revision]
+    ) -> dict[str, int]:
+        try:
+            return await api.update_tags(revs, autoremove=True)
+        except ClientResponseError as e:
+            if e.status != HTTPMethodNotAllowed.status_code:
+                raise
+        # The peer can only update one revision at a time.
+        results = {}
+        for r in revs:
+            try:
+                await api.put_tags(r, autoremove=True)
+                results[r.uuid] = HTTPNoContent.status_code
+            except ClientResponseError as e:
+                results[r.uuid] = e.status
+        return results
+
     @locked(target=".backup", mode="exclusive")
     async def pull_metadata(self) -> int:
-        async def remove_dead_peer():
+        def remove_dead_peer():
             for r in list(self.repository.history):
                 if r.server and r.server not in self.daemon.peers:
                     self.log.info(
@@ -441,22 +671,45 @@ class Job(object):
 
         self.log.info("pull-start")
         async with ClientManager(
-            self.daemon.peers, self.taskid, self.log
+            self.daemon.peers, self.taskid, self.log, self.daemon.connections
         ) as apis:
             errors = await asyncio.gather(
-                remove_dead_peer(),
+                self._io(remove_dead_peer),
                 *[self._pull_metadata_single(apis[server]) for server in apis],
             )
         self.log.info("pull-end", errors=sum(errors))
         return sum(errors)
 
     async def _pull_metadata_single(self, api: Client) -> bool:
+        """Update our copies of the revisions on a peer.
+
+        We only fetch the revisions that changed since our last pull, unless
+        our copies changed in the meantime.
+        """
         error = False
         log = self.log.bind(server=api.server_name)
+        local = {
+            r.uuid: r
+            for r in self.repository.history
+            if r.server == api.server_name
+        }
+        version, uuids = self.pulled.get(api.server_name, (None, set()))
+        if uuids != local.keys() or any(
+            r.pending_changes for r in local.values()
+        ):
+            version = None
         try:
             await api.touch_backup(self.name)
-            remote_revs = await api.get_revs(self.repository)
-            log.debug("pull-found-revs", revs=len(remote_revs))
+            changes = await api.get_revs_since(self.repository, version)
+            if changes is None:
+                log.debug("pull-unchanged", version=version)
+                changes = RevisionChanges(version, [], uuids)
+            else:
+                log.debug(
+                    "pull-found-revs",
+                    revs=len(changes.revs),
+                    version=changes.version,
+                )
         except ClientResponseError as e:
             if e.status in [
                 HTTPNotFound.status_code,
@@ -466,35 +719,219 @@ class Job(object):
             else:
                 log.warning("pull-client-error", exc_style="short")
                 error = True
-            remote_revs = []
+            changes = RevisionChanges(None, [], set())
         except ClientConnectionError:
             log.warning("pull-connection-error", exc_style="short")
             return True
         except ClientError:
             log.exception("pull-error")
             error = True
-            remote_revs = []
+            changes = RevisionChanges(None, [], set())
 
-        local_uuids = {
-            r.uuid
-            for r in self.repository.history
-            if r.server == api.server_name
-        }
-        remote_uuids = {r.uuid for r in remote_revs}
-        for uuid in local_uuids - remote_uuids:
+        await self._io(self._apply_pulled, log, local, changes)
+
+        if changes.version:
+            self.pulled[api.server_name] = (changes.version, changes.uuids)
+        else:
+            self.pulled.pop(api.server_name, None)
+        return error
+
+    def _apply_pulled(
+        self,
+        log: BoundLogger,
+        local: dict[str, Revision],
+        changes: RevisionChanges,
+    ) -> None:
+        """Update our copies of a peer's revisions."""
+        for uuid in local.keys() - changes.uuids:
             log.warning("pull-removing-unknown-rev", rev_uuid=uuid)
-            self.repository.find_by_uuid(uuid).remove(force=True)
-
-        for r in remote_revs:
-            if r.uuid in local_uuids:
-                if (
-                    r.to_dict()
-                    == self.repository.find_by_uuid(r.uuid).to_dict()
-                ):
+            local[uuid].remove(force=True)
+
+        for r in changes.revs:
+            if r.uuid in local:
+                if r.to_dict() == local[r.uuid].to_dict():
                     continue
                 log.debug("pull-updating-rev", rev_uid=r.uuid)
             else:
                 log.debug("pull-new-rev", rev_uid=r.uuid)
             r.write_info()
 
-        return error
+
+class SchedulerMetrics(TypedDict):
+    queued: int
+    running: int
+    workers: int
+    busy: int
+    dispatched: int
+    # How late jobs were started after their deadline, in seconds.
+    lag_max: float
+    lag_mean: float
+    lag: dict[str, float]
+
+
+class Scheduler(object):
+    """Runs jobs when they are due.
+
+    Waiting jobs are kept in a heap ordered by their deadline so that a
+    single task waits for whichever job is due next. Due jobs are started
+    right away, they take one of a bounded number of `workers` while they
+    make a backup or do maintenance. Queueing, rescheduling and cancelling a
+    job is O(log n).
+
+    Cancelled heap entries are only marked and dropped once they reach the
+    top of the heap.
+
+    """
+
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    log: BoundLogger
+    workers: AdjustableBoundedSemaphore
+
+    # [loop time, sequence, job or None when cancelled]
+    _heap: list[list]
+    _entries: dict[Job, list]
+    _sequence: Iterator[int]
+    _changed: asyncio.Event
+    _task: Optional[asyncio.Task] = None
+    running: dict[Job, asyncio.Task]
+
+    dispatched: int
+    lag: dict[str, float]
+    lag_max: float
+    lag_total: float
+
+    def __init__(self, log: BoundLogger, workers: int = 1):
+        self.log = log.bind(subsystem="scheduler")
+        self.workers = AdjustableBoundedSemaphore(workers)
+        self._heap = []
+        self._entries = {}
+        self._sequence = itertools.count()
+        self._changed = asyncio.Event()
+        self.running = {}
+        self.dispatched = 0
+        self.lag = {}
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self._ensure_task()
+
+    def _ensure_task(self) -> None:
+        if self.loop and self._task is None:
+            self._task = self.loop.create_task(
+                self.run_forever(), name="scheduler"
+            )
+
+    def _time(self, deadline: datetime.datetime) -> float:
+        assert self.loop
+        # Wall clock deadlines are converted once, waiting uses the
+        # monotonic loop clock.
+        return self.loop.time() + (deadline - backy.utils.now()).total_seconds()
+
+    def schedule(self, job: Job, deadline: datetime.datetime) -> None:
+        """Run `job` at `deadline`, replacing an earlier deadline."""
+        self._discard(job)
+        entry = [self._time(deadline), next(self._sequence), job]
+        self._entries[job] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._changed.set()
+        self._ensure_task()
+
+    def run_now(self, job: Job) -> bool:
+        """Move the deadline of a waiting job to now.
+
+        Returns whether the job was waiting.
+        """
+        if job not in self._entries:
+            return False
+        self.schedule(job, backy.utils.now())
+        return True
+
+    def cancel(self, job: Job) -> bool:
+        """Stop a waiting or running job.
+
+        Returns whether the job was waiting or running.
+        """
+        found = self._discard(job)
+        task = self.running.pop(job, None)
+        if task is not None:
+            task.cancel()
+            found = True
+        return found
+
+    def _discard(self, job: Job) -> bool:
+        entry = self._entries.pop(job, None)
+        if entry is None:
+            return False
+        entry[-1] = None
+        return True
+
+    def is_active(self, job: Job) -> bool:
+        return job in self._entries or job in self.running
+
+    def metrics(self) -> SchedulerMetrics:
+        return {
+            "queued": len(self._entries),
+            "running": len(self.running),
+            "workers": self.workers._bound_value,
+            "busy": self.workers._bound_value - self.workers._value,
+            "dispatched": self.dispatched,
+            "lag_max": self.lag_max,
+            "lag_mean": (
+                self.lag_total / self.dispatched if self.dispatched else 0.0
+            ),
+            "lag": dict(self.lag),
+        }
+
+    async def _next_due(self) -> Job:
+        assert self.loop
+        while True:
+            self._changed.clear()
+            while self._heap and self._heap[0][-1] is None:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                await self._changed.wait()
+                continue
+            when, _, job = self._heap[0]
+            remaining = when - self.loop.time()
+            if remaining > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            del self._entries[job]
+            lag = -remaining
+            self.dispatched += 1
+            self.lag[job.name] = lag
+            self.lag_max = max(self.lag_max, lag)
+            self.lag_total += lag
+            return job
+
+    async def run_forever(self) -> None:
+        assert self.loop
+        while True:
+            job = await self._next_due()
+            task = self.loop.create_task(
+                self._run(job), name=f"backup-{job.name}"
+            )
+            self.running[job] = task
+            task.add_done_callback(partial(self._finished, job))
+
+    async def _run(self, job: Job) -> None:
+        await job.run()
+        if self.running.get(job) is asyncio.current_task():
+            # Not cancelled while running.
+            del self.running[job]
+            job.schedule_next()
+
+    def _finished(self, job: Job, task: asyncio.Task) -> None:
+        if self.running.get(job) is task:
+            del self.running[job]
+        if not task.cancelled() and task.exception():
+            self.log.error(
+                "job-crashed", job_name=job.name, exc_info=task.exception()
+            )
@@ -0,0 +1,184 @@
+"""The status of all jobs, as served by the api.
+
+Computing a job's status walks its history, and making sure the history is
+current means scanning its repository. Monitoring asks for the status of
+thousands of jobs every minute, so the daemon keeps a table that is updated
+when something happens instead: jobs update their entry whenever their
+status changes and after their repository was scanned.
+
+Jobs scan their repository in the executor while other threads may work on
+it, so everything the status needs from the repository is taken there, in
+a `RepositoryState`. The event loop only ever looks at that.
+
+"""
+
+import datetime
+import re
+from typing import Optional, Tuple
+
+import backy.utils
+from backy.repository import Repository, StatusDict
+from backy.revision import filter_manual_tags
+
+# Fields that depend on the time the status is looked at.
+SLA_FIELDS = ("sla", "sla_overdue")
+
+
+class RepositoryState(object):
+    """What the status of a job needs to know about its repository.
+
+    Must be taken while nothing else works on the repository, see
+    `Job.refresh`.
+
+    """
+
+    # See `Repository.metadata_version`.
+    version: str
+    # See `Repository.sla_deadline`.
+    sla_deadline: Optional[datetime.datetime]
+    last_clean: Optional[datetime.datetime]
+    last_time: Optional[datetime.datetime]
+    last_tags: Optional[str]
+    last_duration: Optional[float]
+    manual_tags: str
+    problem_reports: int
+    unsynced_revs: int
+    local_revs: int
+    # The newest clean local revision, see `Revision.to_dict`.
+    last_local: Optional[dict]
+
+    def __init__(self, repository: Repository):
+        self.version = repository.metadata_version
+        self.sla_deadline = repository.sla_deadline
+        last = repository.last_clean
+        self.last_clean = last.timestamp if last else None
+        manual_tags = set()
+        self.unsynced_revs = 0
+        history = repository.clean_history
+        for rev in history:
+            manual_tags |= filter_manual_tags(rev.tags)
+            if rev.pending_changes:
+                self.unsynced_revs += 1
+        self.manual_tags = ", ".join(manual_tags)
+        self.last_time = self.last_tags = self.last_duration = None
+        if history:
+            self.last_time = history[-1].timestamp
+            self.last_tags = ",".join(
+                repository.schedule.sorted_tags(history[-1].tags)
+            )
+            self.last_duration = history[-1].stats.get("duration", 0)
+        self.problem_reports = len(repository.report_ids)
+        self.local_revs = len(repository.get_history(clean=True, local=True))
+        local = repository.last_clean_revisions(1, local=True)
+        self.last_local = local[0].to_dict() if local else None
+
+    def sla_overdue(self, now: datetime.datetime) -> float:
+        """Amount of time the SLA is overdue at `now`."""
+        if (
+            self.sla_deadline is not None
+            and self.last_clean is not None
+            and now > self.sla_deadline
+        ):
+            return (now - self.last_clean).total_seconds()
+        return 0
+
+
+class StatusEntry(object):
+    status: StatusDict
+    state: RepositoryState
+
+    def __init__(self, status: StatusDict, state: RepositoryState):
+        self.status = status
+        self.state = state
+
+    def same(self, other: "StatusEntry") -> bool:
+        """Whether both entries tell the same, apart from the SLA."""
+        return self.state.sla_deadline == other.state.sla_deadline and all(
+            self.status[k] == other.status[k]  # type: ignore
+            for k in self.status
+            if k not in SLA_FIELDS
+        )
+
+    def at(self, now: datetime.datetime) -> StatusDict:
+        """The status with the SLA as of `now`."""
+        overdue = self.state.sla_overdue(now)
+        status = self.status.copy()
+        status["sla"] = "OK" if not overdue else "TOO OLD"
+        status["sla_overdue"] = overdue
+        return status
+
+
+class StatusTable(object):
+    """The latest status of every job.
+
+    Snapshots evaluate the SLAs of all jobs at the same time, which is
+    returned with the snapshot.
+
+    """
+
+    # The number of filters whose matching jobs we remember.
+    max_filters: int = 64
+
+    entries: dict[str, StatusEntry]
+    # When an entry was last changed.
+    updated: Optional[datetime.datetime]
+    # filter -> names of the matching jobs, sorted
+    _matches: dict[str, list[str]]
+    _names: Optional[list[str]]
+
+    def __init__(self):
+        self.entries = {}
+        self.updated = None
+        self._matches = {}
+        self._names = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def update(self, status: StatusDict, state: RepositoryState) -> bool:
+        """Store the status of a job.
+
+        Returns whether it differs from what we had.
+        """
+        name = status["job"]
+        entry = StatusEntry(status, state)
+        old = self.entries.get(name)
+        self.entries[name] = entry
+        if old is None:
+            self._names_changed()
+        elif old.same(entry):
+            return False
+        self.updated = backy.utils.now()
+        return True
+
+    def remove(self, name: str) -> None:
+        if self.entries.pop(name, None) is None:
+            return
+        self._names_changed()
+        self.updated = backy.utils.now()
+
+    def _names_changed(self) -> None:
+        self._names = None
+        self._matches.clear()
+
+    def names(self, filter: str = "") -> list[str]:
+        """The names of the jobs matching `filter` (a regex)."""
+        if self._names is None:
+            self._names = sorted(self.entries)
+        if not filter:
+            return self._names
+        names = self._matches.get(filter)
+        if names is None:
+            if len(self._matches) >= self.max_filters:
+                self._matches.clear()
+            filter_re = re.compile(filter)
+            names = self._matches[filter] = [
+                n for n in self._names if filter_re.search(n)
+            ]
+        return names
+
+    def snapshot(
+        self, filter: str = ""
+    ) -> Tuple[datetime.datetime, list[StatusDict]]:
+        now = backy.utils.now()
+        return now, [self.entries[n].at(now) for n in self.names(filter)]
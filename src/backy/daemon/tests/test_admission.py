@@ -0,0 +1,146 @@
+import asyncio
+import datetime
+from unittest import mock
+
+import backy.utils
+from backy.daemon.admission import AdmissionController, Cost
+from backy.revision import Revision
+
+
+def make_job(name, rate=None, sla_in=None):
+    job = mock.Mock()
+    job.name = name
+    revisions = []
+    if rate is not None:
+        revisions.append(
+            mock.Mock(stats={"bytes_written": rate * 10, "duration": 10})
+        )
+    job.repository.last_clean_revisions.return_value = revisions
+    job.repository.sla_deadline = (
+        backy.utils.now() + datetime.timedelta(hours=sla_in)
+        if sla_in is not None
+        else None
+    )
+    return job
+
+
+class Runner(object):
+    """Runs backups that finish when told to."""
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.running = []
+        self.done = {}
+        self.tasks = {}
+
+    async def backup(self, job):
+        async with self.controller.slot(job):
+            self.running.append(job.name)
+            self.done[job.name] = asyncio.Event()
+            await self.done[job.name].wait()
+
+    async def start(self, *jobs):
+        for job in jobs:
+            self.tasks[job.name] = asyncio.create_task(self.backup(job))
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    async def cancel(self):
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    async def finish(self, name):
+        self.done[name].set()
+        await self.tasks[name]
+        await asyncio.sleep(0)
+
+
+def test_cost_estimate(repository, log):
+    assert Cost.estimate(repository) == Cost()
+    for bytes, duration, server in [
+        (100, 10, ""),
+        (9999, 1, "remote"),
+        (300, 30, ""),
+    ]:
+        r = Revision.create(repository, {"daily"}, log)
+        r.stats = {"bytes_written": bytes, "duration": duration}
+        r.server = server
+        r.materialize()
+    repository.scan()
+    cost = Cost.estimate(repository)
+    assert cost == Cost(bytes=200, duration=20, known=True)
+    assert cost.rate == 10
+
+
+async def test_admit_most_urgent_first(clock):
+    controller = AdmissionController(limit=1)
+    runner = Runner(controller)
+    await runner.start(make_job("first", 10, sla_in=1))
+    await runner.start(
+        make_job("relaxed", 10, sla_in=30),
+        make_job("new"),
+        make_job("urgent", 10, sla_in=2),
+    )
+    assert runner.running == ["first"]
+    assert [t["job"] for t in controller.to_dict()["waiting"]] == [
+        "new",
+        "urgent",
+        "relaxed",
+    ]
+    clock.now.return_value += datetime.timedelta(seconds=10)
+    for name in ["first", "new", "urgent"]:
+        await runner.finish(name)
+    assert controller.admitted == 4
+    assert controller.wait_total == 30
+    assert runner.running == ["first", "new", "urgent", "relaxed"]
+    await runner.finish("relaxed")
+    assert controller.to_dict()["running"] == []
+
+
+async def test_admit_within_budget(clock):
+    controller = AdmissionController(limit=4, budget=100)
+    runner = Runner(controller)
+    # Too big, but nothing else is running.
+    await runner.start(make_job("huge", 1000, sla_in=1))
+    await runner.start(make_job("small", 10, sla_in=2))
+    assert runner.running == ["huge"]
+    await runner.finish("huge")
+    # Unknown backups get an even share of the budget.
+    await runner.start(
+        make_job("medium", 60, sla_in=3),
+        make_job("unknown", sla_in=4),
+        make_job("tiny", 10, sla_in=5),
+    )
+    assert runner.running == ["huge", "small", "medium", "unknown"]
+    assert controller.in_flight == 95
+    # The most urgent waiting backup holds back the others.
+    await runner.start(make_job("big", 50, sla_in=0))
+    await runner.finish("small")
+    assert runner.running == ["huge", "small", "medium", "unknown"]
+    assert [t["job"] for t in controller.to_dict()["waiting"]] == [
+        "big",
+        "tiny",
+    ]
+    await runner.finish("medium")
+    assert runner.running[-2:] == ["big", "tiny"]
+
+    # More budget admits more.
+    await runner.start(make_job("other", 100))
+    assert "other" not in runner.running
+    controller.configure(10, 1000)
+    await asyncio.sleep(0)
+    assert runner.running[-1] == "other"
+    await runner.cancel()
+
+
+async def test_stopped_while_waiting(clock):
+    controller = AdmissionController(limit=1)
+    runner = Runner(controller)
+    await runner.start(make_job("a", 10), make_job("b", 10))
+    runner.tasks["b"].cancel()
+    await asyncio.sleep(0)
+    assert controller.to_dict()["waiting"] == []
+    await runner.finish("a")
+    assert runner.running == ["a"]
+    assert controller.to_dict()["running"] == []
@@ -9,11 +9,14 @@ from unittest.mock import Mock
 
 import pytest
 import yaml
+from aiohttp import ClientResponseError
 from aiohttp.test_utils import unused_port
 
 import backy.utils
 from backy import utils
 from backy.daemon import BackyDaemon
+from backy.daemon.api import Client, ClientManager
+from backy.daemon.scheduler import Job
 from backy.revision import Revision
 from backy.tests import Ellipsis
 
@@ -92,7 +95,10 @@ jobs:
                 m.setattr(
                     asyncio.get_running_loop(), "create_task", fake_create_task
                 )
+                # Jobs are started by the tests.
+                m.setattr(Job, "start", lambda self: None)
                 daemon.start(asyncio.get_running_loop())
+            await asyncio.gather(*[j.prepare() for j in daemon.jobs.values()])
             daemon.reload_api.set()
             daemon.api_server()
 
@@ -106,6 +112,7 @@ jobs:
 
     for d in daemons:
         d.terminate()
+        await d.connections.close()
 
 
 def create_rev(backup, log):
@@ -270,6 +277,133 @@ async def test_simple_sync(daemons, log):
     assert p.exists(p.join(j1.path, ".purge_pending"))
 
 
+async def test_incremental_sync(daemons, log, monkeypatch):
+    ds = await daemons(2)
+
+    j0 = ds[0].jobs["test01"]
+    b0 = j0.repository
+    j1 = ds[1].jobs["test01"]
+    b1 = j1.repository
+    rev1 = create_rev(b1, log)
+
+    await j0.pull_metadata()
+    b0.scan()
+    assert [r.uuid for r in b0.history] == [rev1.uuid]
+    version, uuids = j0.pulled["server-1"]
+    assert version == b1.metadata_version
+    assert uuids == {rev1.uuid}
+
+    # Nothing changed.
+    utils.log_data = ""
+    await j0.pull_metadata()
+    assert "pull-unchanged" in utils.log_data
+    assert "get-revs-not-modified" in utils.log_data
+
+    # Only changed revisions are sent.
+    rev2 = create_rev(b1, log)
+    utils.log_data = ""
+    await j0.pull_metadata()
+    b0.scan()
+    assert "pull-found-revs                 [server-0] revs=1" in utils.log_data
+    assert [r.uuid for r in b0.history] == [rev1.uuid, rev2.uuid]
+
+    rev1.tags = {"manual:new"}
+    rev1.write_info()
+    b1.scan()
+    await j0.pull_metadata()
+    b0.scan()
+    assert b0.history[0].tags == {"manual:new"}
+
+    # Lost copies are fetched again.
+    b0.history[1].remove(force=True)
+    await j0.pull_metadata()
+    b0.scan()
+    assert [r.uuid for r in b0.history] == [rev1.uuid, rev2.uuid]
+
+    # Peers without bulk updates get one request per revision.
+    del ds[1].config["jobs"]["test01"]
+    ds[1]._apply_config()
+    b0.history[0].remove()
+    b0.history[1].tags = {"manual:b"}
+    b0.history[1].write_info()
+
+    async def update_tags(*args, **kw):
+        raise ClientResponseError(Mock(), (), status=405)
+
+    monkeypatch.setattr(Client, "update_tags", update_tags)
+    assert await j0.push_metadata() == 0
+    b0.scan()
+    assert [(r.uuid, r.tags) for r in b0.history] == [(rev2.uuid, {"manual:b"})]
+    assert not b0.history[0].pending_changes
+    b1 = ds[1].dead_repositories["test01"]
+    b1.scan()
+    assert [(r.uuid, r.tags) for r in b1.history] == [(rev2.uuid, {"manual:b"})]
+
+
+async def test_peer_connections_are_shared(daemons, log):
+    ds = await daemons(3)
+    j0 = ds[0].jobs["test01"]
+    f0 = ds[0].jobs["foo00"]
+    connections = ds[0].connections
+
+    await j0.pull_metadata()
+    pool = connections.pools["server-1"]
+    await f0.pull_metadata()
+    await j0.push_metadata()
+    assert connections.pools["server-1"] is pool
+    health = connections.health()
+    assert health["server-1"].requests == 4
+    assert health["server-1"].failures == 0
+    assert health["server-1"].last_success
+
+    # Only pools of changed peers are replaced.
+    ds[0].peers = dict(
+        ds[0].peers,
+        **{
+            "server-2": {
+                "url": f"http://localhost:{unused_port()}",
+                "token": "",
+            }
+        },
+    )
+    ds[0]._apply_config()
+    assert connections.pools == {"server-1": pool}
+
+    # Failures are tracked.
+    await j0.pull_metadata()
+    health = connections.health()
+    assert health["server-1"].failures == 0
+    assert health["server-2"].failures == 1
+    assert "ClientConnectorError" in health["server-2"].last_error
+
+    ds[0].peer_timeout = 5
+    ds[0]._apply_config()
+    assert connections.pools == {}
+
+
+async def test_metrics(daemons, log):
+    ds = await daemons(2)
+    create_rev(ds[0].jobs["test01"].repository, log)
+    await ds[0].jobs["test01"].refresh()
+
+    async with ClientManager(ds[1].peers, "taskid", log) as clients:
+        client = clients["server-0"]
+        await client.fetch_status()
+        text = await client.get_metrics()
+    assert 'backy_job_last_backup_duration_seconds{job="test01"} 60.0' in text
+    # Earlier requests are recorded.
+    assert (
+        'backy_api_request_duration_seconds_count{method="GET",'
+        'route="/v1/status",status="200"} 1'
+    ) in text
+
+    url = ds[1].peers["server-0"]["url"]
+    async with Client("server-0", url, "invalid", "taskid", log) as client:
+        with pytest.raises(ClientResponseError) as e:
+            await client.get_metrics()
+    assert e.value.status == 401
+
+
 async def test_split_brain(daemons, log):
     """split into 2 isolated groups with 2 severs and later allow communication
     server 0 and 2 contain dead jobs
@@ -391,6 +525,9 @@ def jobs_dry_run(daemons, monkeypatch, clock, log, seed_random, tz_berlin):
             r.timestamp = backy.utils.now() + delta
             r.stats["duration"] = 1
             r.write_info()
+            if not job.active:
+                # Like after a job run: our peers see it in our status.
+                await job.refresh()
 
         # This patch causes a single run through the generator loop.
         def update_status(job, orig_update_status, status):
@@ -454,7 +591,7 @@ async def test_wait_for_leader_parallel(jobs_dry_run):
     job0.start()
     job1.start()
 
-    while job0._task is not None or job1._task is not None:
+    while job0.active or job1.active:
         await asyncio.sleep(0.1)
 
     assert (
@@ -480,14 +617,13 @@ async def test_wait_for_leader_parallel(jobs_dry_run):
 ... AAAA I test01[A4WN]         job/local-revs                      [server-0] local_revs=1
 ... AAAA I test01[A4WN]         job/duplicate-job                   [server-0] remote_revs=0 server='server-1'
 ... AAAA I test01[A4WN]         job/leader-found                    [server-0] leader=None leader_revs=1
-... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='waiting for worker slot (fast)'
-... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='running (fast)'
+... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='waiting for worker slot'
+... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='running'
 ... AAAA D -                    revision/writing-info               revision_uuid='...' tags='daily'
 ...
 ... AAAA I test01[N6PW]         job/leader-finished                 [server-1] leader='server-0'
-... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='finished'
 ...
-... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='finished'
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='finished'
 ...
 """
         )
@@ -509,7 +645,7 @@ async def test_wait_for_leader_delayed(jobs_dry_run):
     job0.start()
     job1.start()
 
-    while job1._task is not None:
+    while job1.active:
         await asyncio.sleep(0.1)
 
     job0.stop()
@@ -531,9 +667,50 @@ async def test_wait_for_leader_delayed(jobs_dry_run):
 ... AAAA I test01[N6PW]         job/leader-found                    [server-1] leader='server-0' leader_revs=1
 ... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='monitoring (server-0)'
 ... AAAA I test01[N6PW]         job/leader-not-scheduled            [server-1] leader='server-0'
-... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='waiting for worker slot (slow)'
-... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='running (slow)'
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='waiting for worker slot'
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='running'
 ... AAAA D -                    revision/writing-info               revision_uuid='...' tags='daily'
+... AAAA D test01[N6PW]         repo/scan-reports                   [server-1] entries=0
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='finished'
+...
+"""
+        )
+        == utils.log_data
+    )
+
+
+async def test_wait_for_leader_overdue(jobs_dry_run, monkeypatch):
+    """
+    server 1 will not wait for server 0 (leader) whose job is stuck in its
+    queue, e.g. because server 0 is waiting for server 1 itself
+    """
+
+    job0, job1 = await jobs_dry_run([-600, 0.1])
+    # server 0 is leader
+    await job0.run_backup({"daily"}, delta=datetime.timedelta(hours=-1))
+    monkeypatch.setattr(job0.daemon.scheduler, "schedule", Mock())
+
+    utils.log_data = ""
+
+    job0.start()
+    job1.start()
+
+    while job1.active:
+        await asyncio.sleep(0.1)
+
+    assert (
+        Ellipsis(
+            """\
+...
+... AAAA I test01[A4WN]         job/waiting                         [server-0] next_tags='daily' next_time='2015-09-01 08:56:47'
+... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='waiting for deadline'
+...
+... AAAA I test01[N6PW]         job/leader-found                    [server-1] leader='server-0' leader_revs=1
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='monitoring (server-0)'
+... AAAA I test01[N6PW]         job/leader-overdue                  [server-1] leader='server-0'
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='waiting for worker slot'
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='running'
+...
 ... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='finished'
 ...
 """
@@ -568,7 +745,7 @@ async def test_wait_for_leader_crash(jobs_dry_run, monkeypatch):
     job0.start()
     job1.start()
 
-    while job1._task is not None:
+    while job1.active:
         await asyncio.sleep(0.1)
 
     job0.stop()
@@ -595,14 +772,15 @@ async def test_wait_for_leader_crash(jobs_dry_run, monkeypatch):
 ... AAAA I test01[A4WN]         job/duplicate-job                   [server-0] remote_revs=0 server='server-1'
 ... AAAA I test01[A4WN]         job/server-unavailable              [server-0] exception_class='aiohttp.client_exceptions.ClientConnectorError' exception_msg="Cannot connect to host ..." server='server-2'
 ... AAAA I test01[A4WN]         job/leader-found                    [server-0] leader=None leader_revs=1
-... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='waiting for worker slot (fast)'
-... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='running (fast)'
+... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='waiting for worker slot'
+... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='running'
 ... AAAA I -                    daemon/api-reconfigure              [server-0] \n\
 ...
 ... AAAA W test01[N6PW]         job/leader-failed                   [server-1] exception_class='aiohttp.client_exceptions.ClientResponseError' exception_msg="401, message='Unauthorized', url='...'" leader='server-0'
-... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='waiting for worker slot (slow)'
-... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='running (slow)'
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='waiting for worker slot'
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='running'
 ... AAAA D -                    revision/writing-info               revision_uuid='...' tags='daily'
+...
 ... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='finished'
 ...
 ... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='finished'
@@ -626,7 +804,7 @@ async def test_wait_for_leader_stopped(jobs_dry_run):
 
     job1.start()
 
-    while job1._task is not None:
+    while job1.active:
         await asyncio.sleep(0.1)
 
     assert (
@@ -643,9 +821,10 @@ async def test_wait_for_leader_stopped(jobs_dry_run):
 ... AAAA I test01[A4WN]         job/leader-found                    [server-1] leader='server-0' leader_revs=1
 ... AAAA D test01[A4WN]         job/updating-status                 [server-1] status='monitoring (server-0)'
 ... AAAA I test01[A4WN]         job/leader-stopped                  [server-1] leader='server-0'
-... AAAA D test01[A4WN]         job/updating-status                 [server-1] status='waiting for worker slot (slow)'
-... AAAA D test01[A4WN]         job/updating-status                 [server-1] status='running (slow)'
+... AAAA D test01[A4WN]         job/updating-status                 [server-1] status='waiting for worker slot'
+... AAAA D test01[A4WN]         job/updating-status                 [server-1] status='running'
 ... AAAA D -                    revision/writing-info               revision_uuid='...' tags='daily'
+... AAAA D test01[A4WN]         repo/scan-reports                   [server-1] entries=0
 ... AAAA D test01[A4WN]         job/updating-status                 [server-1] status='finished'
 ...
 """
@@ -672,7 +851,7 @@ async def test_wait_for_leader_ambiguous_leader(jobs_dry_run, monkeypatch):
     job0.start()
     job1.start()
 
-    while job0._task is not None or job1._task is not None:
+    while job0.active or job1.active:
         await asyncio.sleep(0.1)
 
     assert (
@@ -690,8 +869,9 @@ async def test_wait_for_leader_ambiguous_leader(jobs_dry_run, monkeypatch):
 ... AAAA I test01[N6PW]         job/local-revs                      [server-1] local_revs=0
 ... AAAA I test01[N6PW]         job/duplicate-job                   [server-1] remote_revs=0 server='server-0'
 ... AAAA I test01[N6PW]         job/leader-found                    [server-1] leader=None leader_revs=0
-... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='waiting for worker slot (slow)'
-... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='running (slow)'
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='waiting for worker slot'
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='running'
+... AAAA D test01[N6PW]         repo/scan-reports                   [server-1] entries=0
 ... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='finished'
 ...
 ... AAAA I test01[A4WN]         job/woken                           [server-0] trigger=None
@@ -700,9 +880,10 @@ async def test_wait_for_leader_ambiguous_leader(jobs_dry_run, monkeypatch):
 ... AAAA I test01[A4WN]         job/local-revs                      [server-0] local_revs=0
 ... AAAA I test01[A4WN]         job/duplicate-job                   [server-0] remote_revs=0 server='server-1'
 ... AAAA I test01[A4WN]         job/leader-found                    [server-0] leader=None leader_revs=0
-... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='waiting for worker slot (slow)'
-... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='running (slow)'
+... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='waiting for worker slot'
+... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='running'
 ... AAAA D -                    revision/writing-info               revision_uuid='...' tags='daily'
+... AAAA D test01[A4WN]         repo/scan-reports                   [server-0] entries=0
 ... AAAA D test01[A4WN]         job/updating-status                 [server-0] status='finished'
 ...
 """
@@ -728,7 +909,7 @@ async def test_wait_for_leader_run_immediately(jobs_dry_run):
     await asyncio.sleep(0.5)
     job1.run_immediately.set()
 
-    while job1._task is not None:
+    while job1.active:
         await asyncio.sleep(0.1)
 
     job0.stop()
@@ -751,8 +932,8 @@ async def test_wait_for_leader_run_immediately(jobs_dry_run):
 ... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='monitoring (server-0)'
 ...
 ... AAAA I test01[N6PW]         job/run-immediately-triggered       [server-1] leader='server-0'
-... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='waiting for worker slot (slow)'
-... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='running (slow)'
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='waiting for worker slot'
+... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='running'
 ...
 ... AAAA D test01[N6PW]         job/updating-status                 [server-1] status='finished'
 ...
@@ -4,6 +4,7 @@ import json
 import os
 import re
 import signal
+import time
 from pathlib import Path
 from unittest import mock
 from unittest.mock import Mock
@@ -14,6 +15,7 @@ import yaml
 import backy.daemon
 from backy import utils
 from backy.daemon import BackyDaemon
+from backy.daemon.metrics import RequestLatency, render
 from backy.daemon.scheduler import Job
 from backy.file import FileSource
 from backy.revision import Revision
@@ -121,6 +123,7 @@ jobs:
         m.setattr(daemon, "purge_old_files", null_coroutine)
         m.setattr(daemon, "purge_pending_backups", null_coroutine)
         daemon.start(asyncio.get_running_loop())
+    await daemon.starting
     yield daemon
     daemon.terminate()
 
@@ -131,7 +134,7 @@ def test_fail_on_nonexistent_config(log):
         daemon._read_config()
 
 
-def test_reload(daemon, tmp_path):
+async def test_reload(daemon, tmp_path):
     new_base_dir = tmp_path / "newdir"
     new_base_dir.mkdir()
     with open(str(tmp_path / "config"), "w") as f:
@@ -168,6 +171,11 @@ jobs:
     assert set(daemon.jobs) == {"test05", "foo05"}
     assert set(daemon.schedules) == {"default2"}
     assert daemon.api_port == BackyDaemon.api_port
+    # Changed jobs are started once their repositories are prepared.
+    assert not daemon.jobs["test05"].active
+    await daemon.starting
+    assert all(j.active for j in daemon.jobs.values())
+    assert (new_base_dir / "test05" / "config").exists()
 
 
 async def test_sighup(daemon, log, monkeypatch):
@@ -242,6 +250,39 @@ def test_spread(daemon):
     assert job.spread == 14532
 
 
+def test_planned_spread(daemon):
+    jobs = daemon.jobs
+    # A plan from a previous run.
+    with open(daemon.base_dir / ".spread-plan.json", "w") as f:
+        json.dump({"test01": [86400, 600], "old": [3600, 0]}, f)
+    config = daemon.config_file.read_text()
+    daemon.config_file.write_text(
+        config.replace("global:\n", "global:\n    spread: planned\n")
+    )
+    daemon.reload()
+
+    assert jobs["test01"].spread == 600
+    # New jobs are placed where they don't overlap.
+    assert jobs["foo00"].spread == jobs["foo00"].planned_spread
+    assert jobs["foo00"].spread // 300 != 2
+    profile = daemon.load_profile()
+    assert profile["mode"] == "planned"
+    assert max(b["backups"] for b in profile["buckets"]) == 1
+    for job in jobs.values():
+        assert job.next_time.timestamp() % (24 * 60 * 60) == job.spread
+    with open(daemon.base_dir / ".spread-plan.json") as f:
+        assert json.load(f) == {
+            "test01": [86400, 600],
+            "foo00": [86400, jobs["foo00"].spread],
+        }
+
+    daemon.config_file.write_text(config)
+    daemon.reload()
+    assert all(j.planned_spread is None for j in jobs.values())
+    assert jobs["test01"].spread == 19971
+    assert daemon.load_profile()["mode"] == "hash"
+
+
 def test_sla_before_first_backup(daemon):
     job = daemon.jobs["test01"]
     # No previous backups - we consider this to be OK initially.
@@ -322,10 +363,46 @@ def test_update_status(daemon, log):
     assert job.status == "asdf"
 
 
-async def cancel_and_wait(job):
-    while job._task.cancel():
-        await asyncio.sleep(0.1)
-    job._task = None
+async def test_update_status_publishes_events(daemon, log, monkeypatch):
+    job = daemon.jobs["test01"]
+    events = daemon.events
+    job.update_status("asdf")
+    _, status = events.events[-1]
+    assert status.type == "status"
+    assert status.data["job"] == "test01"
+    assert status.data["status"] == "asdf"
+
+    r = Revision.create(job.repository, {"daily"}, log)
+    r.materialize()
+    # Events are published as of the last refresh.
+    await job.refresh()
+    job.update_status("running")
+    r.tags = {"weekly"}
+    r.write_info()
+    r2 = Revision.create(job.repository, {"daily"}, log)
+    r2.materialize()
+    r.remove()
+    await job.refresh()
+    job.update_status("finished")
+    published = [(e.type, e.data) for _, e in events.events][-5:]
+    assert [(t, d.get("action")) for t, d in published] == [
+        ("revision", "new"),
+        ("status", None),
+        ("revision", "new"),
+        ("revision", "removed"),
+        ("status", None),
+    ]
+    assert published[0][1]["revision"]["uuid"] == r.uuid
+    assert published[-1][1]["status"] == "finished"
+
+    # Unchanged revisions are not serialised again.
+    monkeypatch.setattr(
+        Revision, "to_dict", mock.Mock(side_effect=AssertionError)
+    )
+    await job.refresh()
+    job.update_status("idle")
+    _, status = events.events[-1]
+    assert status.type == "status"
 
 
 async def test_task_generator(daemon, clock, tmp_path, monkeypatch, tz_berlin):
@@ -333,13 +410,13 @@ async def test_task_generator(daemon, clock, tmp_path, monkeypatch, tz_berlin):
     # so hey, better than nothing.
 
     for j in daemon.jobs.values():
-        await cancel_and_wait(j)
+        j.stop()
     job = daemon.jobs["test01"]
 
-    async def null_coroutine(*args, **kw):
-        return
-
-    monkeypatch.setattr(job, "_wait_for_deadline", null_coroutine)
+    # Everything is due immediately.
+    monkeypatch.setattr(
+        daemon.scheduler, "_time", lambda deadline: daemon.loop.time()
+    )
 
     # This patch causes a single run through the generator loop.
     def update_status(status):
@@ -349,7 +426,7 @@ async def test_task_generator(daemon, clock, tmp_path, monkeypatch, tz_berlin):
     monkeypatch.setattr(job, "update_status", update_status)
 
     async def wait_for_job_finished():
-        while job._task is not None:
+        while job.active:
             await asyncio.sleep(0.1)
 
     job.start()
@@ -361,7 +438,7 @@ async def test_task_generator_backoff(
     daemon, clock, tmp_path, monkeypatch, tz_berlin
 ):
     for j in daemon.jobs.values():
-        await cancel_and_wait(j)
+        j.stop()
     job = daemon.jobs["test01"]
 
     async def null_coroutine(*args, **kw):
@@ -382,7 +459,10 @@ async def test_task_generator_backoff(
         else:
             return
 
-    monkeypatch.setattr(job, "_wait_for_deadline", null_coroutine)
+    # Everything is due immediately.
+    monkeypatch.setattr(
+        daemon.scheduler, "_time", lambda deadline: daemon.loop.time()
+    )
     monkeypatch.setattr(job, "run_expiry", null_coroutine)
     monkeypatch.setattr(job, "run_gc", null_coroutine)
     monkeypatch.setattr(job, "run_callback", null_coroutine)
@@ -399,7 +479,7 @@ async def test_task_generator_backoff(
     monkeypatch.setattr(job, "update_status", update_status)
 
     async def wait_for_job_finished():
-        while job._task is not None:
+        while job.active:
             await asyncio.sleep(0.1)
 
     utils.log_data = ""
@@ -412,41 +492,40 @@ async def test_task_generator_backoff(
         Ellipsis(
             """\
 ... D test01[...]         job/loop-started                    \n\
-... D test01[...]         repo/scan-reports                   entries=0
 ... I test01[...]         job/waiting                         next_tags='daily' next_time='2015-09-02 07:32:51'
+... I test01[...]         job/woken                           trigger=None
 ... E test01[...]         job/exception                       exception_class='builtins.Exception' exception_msg=''
 exception>\tTraceback (most recent call last):
-exception>\t  File "/.../src/backy/daemon/scheduler.py", line ..., in run_forever
+exception>\t  File "/.../src/backy/daemon/scheduler.py", line ..., in run
 exception>\t    await self.run_backup(next_tags)
 exception>\t  File "/.../src/backy/daemon/tests/test_daemon.py", line ..., in failing_coroutine
 exception>\t    raise Exception()
 exception>\tException
 ... W test01[...]         job/backoff                         backoff=120
-... D test01[...]         repo/scan-reports                   entries=0
 ... I test01[...]         job/waiting                         next_tags='daily' next_time='2015-09-01 09:08:47'
+... I test01[...]         job/woken                           trigger=None
 ... E test01[...]         job/exception                       exception_class='builtins.Exception' exception_msg=''
 exception>\tTraceback (most recent call last):
-exception>\t  File "/.../src/backy/daemon/scheduler.py", line ..., in run_forever
+exception>\t  File "/.../src/backy/daemon/scheduler.py", line ..., in run
 exception>\t    await self.run_backup(next_tags)
 exception>\t  File "/.../src/backy/daemon/tests/test_daemon.py", line ..., in failing_coroutine
 exception>\t    raise Exception()
 exception>\tException
 ... W test01[...]         job/backoff                         backoff=240
-... D test01[...]         repo/scan-reports                   entries=0
 ... I test01[...]         job/waiting                         next_tags='daily' next_time='2015-09-01 09:10:47'
+... I test01[...]         job/woken                           trigger=None
 ... E test01[...]         job/exception                       exception_class='builtins.Exception' exception_msg=''
 exception>\tTraceback (most recent call last):
-exception>\t  File "/.../src/backy/daemon/scheduler.py", line ..., in run_forever
+exception>\t  File "/.../src/backy/daemon/scheduler.py", line ..., in run
 exception>\t    await self.run_backup(next_tags)
 exception>\t  File "/.../src/backy/daemon/tests/test_daemon.py", line ..., in failing_coroutine
 exception>\t    raise Exception()
 exception>\tException
 ... W test01[...]         job/backoff                         backoff=480
-... D test01[...]         repo/scan-reports                   entries=0
 ... I test01[...]         job/waiting                         next_tags='daily' next_time='2015-09-01 09:14:47'
-... I test01[...]         job/stop                            \n\
+... I test01[...]         job/woken                           trigger=None
 ... D test01[...]         repo/scan-reports                   entries=0
-... I test01[...]         job/waiting                         next_tags='daily' next_time='2015-09-02 07:32:51'
+... I test01[...]         job/stop                            \n\
 """
         )
         == utils.log_data
@@ -461,8 +540,115 @@ def test_daemon_status(daemon):
 
 
 def test_daemon_status_filter_re(daemon):
-    r = re.compile(r"foo\d\d")
-    assert {"foo00"} == set([s["job"] for s in daemon.status(r)])
+    assert {"foo00"} == set([s["job"] for s in daemon.status(r"foo\d\d")])
+
+
+async def test_refresh_status(daemon, log, monkeypatch):
+    job = daemon.jobs["test01"]
+    r = Revision.create(job.repository, {"daily"}, log)
+    r.stats["duration"] = 1.0
+    r.materialize()
+    [status] = daemon.status("test01")
+    assert status["last_tags"] is None
+
+    monkeypatch.setattr(daemon, "status_interval", 0)
+    task = asyncio.create_task(daemon.refresh_status())
+    while not daemon.status("test01")[0]["last_tags"]:
+        await asyncio.sleep(0.01)
+    task.cancel()
+    [status] = daemon.status("test01")
+    assert status["last_tags"] == "daily"
+    assert status["local_revs"] == 1
+
+
+async def test_refresh_skips_unchanged_repositories(daemon, monkeypatch):
+    job = daemon.jobs["test01"]
+    repository = job.repository
+    # Pretend that everything has been written a while ago.
+    past = time.time_ns() - 3600 * 10**9
+    for path in [repository.path, repository.report_path]:
+        os.utime(path, ns=(past, past))
+    await job.refresh()
+
+    # New problem reports are picked up.
+    (repository.report_path / "asdf.report").write_text("")
+    await job.refresh()
+    [status] = daemon.status("test01")
+    assert status["problem_reports"] == 1
+
+    for path in [repository.path, repository.report_path]:
+        os.utime(path, ns=(past, past))
+    await job.refresh()
+    state = job.state
+    monkeypatch.setattr(
+        "backy.daemon.scheduler.RepositoryState",
+        Mock(side_effect=AssertionError),
+    )
+    monkeypatch.setattr(
+        repository, "scan_reports", Mock(side_effect=AssertionError)
+    )
+    await job.refresh()
+    assert job.state is state
+
+
+async def test_metrics(daemon, log, monkeypatch):
+    job = daemon.jobs["test01"]
+    r = Revision.create(job.repository, {"daily"}, log)
+    r.stats.update(
+        duration=2.5,
+        bytes_written=4096,
+        chunk_stats={"write_full": 3, "write_partial": 1},
+        store_chunks=42,
+        phases={"export": {"duration": 2.0, "bytes": 4096}},
+    )
+    r.stats["ceph-verification"] = "partial"
+    r.materialize()
+    await job.refresh()
+
+    scan = mock.Mock(side_effect=AssertionError("scanned"))
+    monkeypatch.setattr("backy.repository.Repository.scan", scan)
+    text = render(daemon, RequestLatency())
+    assert (
+        Ellipsis(
+            """\
+# HELP backy_job_last_backup_timestamp_seconds When the last local backup \
+was started.
+# TYPE backy_job_last_backup_timestamp_seconds gauge
+backy_job_last_backup_timestamp_seconds{job="test01"} ...
+...
+backy_job_last_backup_duration_seconds{job="test01"} 2.5
+...
+backy_job_last_backup_phase_duration_seconds{job="test01",phase="export"} 2.0
+...
+backy_job_last_backup_written_bytes{job="test01"} 4096
+...
+backy_job_last_backup_chunk_writes{job="test01",write="full"} 3
+backy_job_last_backup_chunk_writes{job="test01",write="partial"} 1
+...
+backy_job_last_backup_trust{job="test01",trust="trusted"} 1
+...
+backy_job_last_backup_source_verification{job="test01",\
+verification="partial"} 1
+...
+backy_chunk_store_chunks{job="test01"} 42
+...
+backy_job_sla_overdue_seconds{job="test01"} 0
+...
+backy_scheduler_queued_jobs ...
+...
+backy_admission_waiting_backups 0
+...
+backy_io_workers 4
+...
+backy_event_loop_stalls_total 0
+# HELP backy_api_request_duration_seconds Time taken to answer api requests.
+# TYPE backy_api_request_duration_seconds histogram
+"""
+        )
+        == text
+    )
+    assert 'job="foo00"' in text
+    scan.assert_not_called()
 
 
 async def test_purge_pending(daemon, monkeypatch):
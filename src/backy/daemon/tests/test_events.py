@@ -0,0 +1,116 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from aiohttp import hdrs
+
+from backy.daemon.api import BackyAPI, Client
+from backy.daemon.events import EventLog
+
+
+async def collect(events, cursor=None, count=1, **kw):
+    result = []
+    async for event in events.subscribe(cursor, **kw):
+        result.append(event)
+        if len(result) == count:
+            break
+    return result
+
+
+async def test_subscribe_from_now_and_resume():
+    events = EventLog()
+    events.publish("status", {"job": "old"})
+    subscription = asyncio.create_task(collect(events, count=2))
+    await asyncio.sleep(0)
+    a = events.publish("status", {"job": "a"})
+    events.publish("status", {"job": "b"})
+    assert [e.data["job"] for e in await subscription] == ["a", "b"]
+
+    # Resume after a.
+    assert [e.data["job"] for e in await collect(events, a.cursor)] == ["b"]
+
+
+async def test_resume_unknown_cursor_resets():
+    events = EventLog(size=2)
+    first = events.publish("status", {"job": "a"})
+    for cursor in [
+        "other-1",
+        f"{events.epoch}-5",
+        f"{events.epoch}-x",
+    ]:
+        [reset] = await collect(events, cursor)
+        assert reset.type == "reset"
+        assert reset.cursor == events.cursor
+
+    for job in "bcd":
+        events.publish("status", {"job": job})
+    # a's successor is gone.
+    [reset] = await collect(events, first.cursor)
+    assert reset.type == "reset"
+
+
+async def test_subscribe_keepalive_and_stop():
+    events = EventLog()
+    stop = asyncio.Event()
+    assert await collect(events, keepalive=0.01) == [None]
+    stop.set()
+    assert await collect(events, stop=stop) == []
+
+
+@pytest.fixture
+async def client(aiohttp_client, log):
+    daemon = mock.Mock()
+    daemon.events = EventLog()
+    api = BackyAPI(daemon, log)
+    api.tokens = {"token": "peer"}
+    session = await aiohttp_client(
+        api.app, headers={hdrs.AUTHORIZATION: "Bearer token"}
+    )
+    client = Client("<server>", "http://localhost:0", "token", "task", log)
+    await client.session.close()
+    client.session = session
+    client.api = api
+    return client
+
+
+async def test_stream_events(client):
+    events = client.api.daemon.events
+    received = []
+
+    async def receive(cursor=None, count=None):
+        async for event in client.events(cursor):
+            received.append(event)
+            if len(received) == count:
+                break
+
+    task = asyncio.create_task(receive())
+    await asyncio.sleep(0.1)
+    events.publish(
+        "status",
+        {
+            "job": "a",
+            "last_time": "2015-09-01T07:06:47+00:00",
+            "next_time": None,
+        },
+    )
+    events.publish("revision", {"job": "a", "action": "removed", "uuid": "x"})
+    while len(received) < 2:
+        await asyncio.sleep(0.01)
+    status, revision = received
+    assert status["type"] == "status"
+    assert status["data"]["last_time"].isoformat() == (
+        "2015-09-01T07:06:47+00:00"
+    )
+    assert revision == {
+        "cursor": events.cursor,
+        "type": "revision",
+        "data": {"job": "a", "action": "removed", "uuid": "x"},
+    }
+
+    # Reconfiguring ends streams, they can be resumed.
+    await client.api.reconfigure({"token": "peer"}, [], 0)
+    await task
+    events.publish("status", {"job": "b", "last_time": None, "next_time": None})
+    received.clear()
+    await asyncio.wait_for(receive(status["cursor"], count=2), 1)
+    assert [e["data"]["job"] for e in received] == ["a", "b"]
@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from backy.daemon.executor import LagMonitor, RepositoryExecutor
+
+
+def make_repository(name):
+    repository = mock.Mock()
+    repository.path = Path("/srv/backy") / name
+    return repository
+
+
+class Blocker(object):
+    """Blocking calls that return when told to."""
+
+    def __init__(self):
+        self.started = []
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+
+    def __call__(self, name):
+        with self.lock:
+            self.started.append(name)
+        self.release.wait(5)
+        return name
+
+
+async def wait_for(condition):
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+async def test_runs_in_thread(log):
+    executor = RepositoryExecutor(log)
+    thread = await executor.run(
+        make_repository("a"), lambda: threading.current_thread()
+    )
+    assert thread is not threading.current_thread()
+    assert executor.metrics()["calls"] == 1
+    executor.shutdown()
+
+
+async def test_propagates_exceptions(log):
+    executor = RepositoryExecutor(log)
+
+    def fail():
+        raise BlockingIOError()
+
+    with pytest.raises(BlockingIOError):
+        await executor.run(make_repository("a"), fail)
+    assert executor.running == 0
+    executor.shutdown()
+
+
+async def test_serialises_work_per_repository(log):
+    executor = RepositoryExecutor(log, workers=4)
+    blocker = Blocker()
+    a, b = make_repository("a"), make_repository("b")
+    tasks = [
+        asyncio.create_task(executor.run(a, blocker, "a1")),
+        asyncio.create_task(executor.run(a, blocker, "a2")),
+        asyncio.create_task(executor.run(b, blocker, "b1")),
+    ]
+    await wait_for(lambda: len(blocker.started) == 2)
+    assert sorted(blocker.started) == ["a1", "b1"]
+    metrics = executor.metrics()
+    assert metrics["running"] == 2
+    assert metrics["waiting"] == 1
+    blocker.release.set()
+    assert await asyncio.gather(*tasks) == ["a1", "a2", "b1"]
+    assert executor.metrics()["calls"] == 3
+    executor.shutdown()
+
+
+async def test_bounds_threads(log):
+    executor = RepositoryExecutor(log, workers=1)
+    blocker = Blocker()
+    tasks = [
+        asyncio.create_task(executor.run(make_repository(n), blocker, n))
+        for n in "ab"
+    ]
+    await wait_for(lambda: blocker.started)
+    await asyncio.sleep(0.05)
+    assert blocker.started == ["a"]
+    blocker.release.set()
+    assert await asyncio.gather(*tasks) == ["a", "b"]
+    executor.shutdown()
+
+
+async def test_cancelled_work_keeps_repository(log):
+    executor = RepositoryExecutor(log)
+    blocker = Blocker()
+    a = make_repository("a")
+    first = asyncio.create_task(executor.run(a, blocker, "a1"))
+    await wait_for(lambda: blocker.started)
+    first.cancel()
+    second = asyncio.create_task(executor.run(a, blocker, "a2"))
+    await asyncio.sleep(0.05)
+    assert blocker.started == ["a1"]
+    blocker.release.set()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert await second == "a2"
+    executor.shutdown()
+
+
+async def test_configure_replaces_pool(log):
+    executor = RepositoryExecutor(log, workers=1)
+    pool = executor._pool
+    executor.configure(1)
+    assert executor._pool is pool
+    executor.configure(2)
+    assert executor._pool is not pool
+    assert await executor.run(make_repository("a"), lambda: 1) == 1
+    executor.shutdown()
+
+
+def test_lag_monitor_counts_stalls(log):
+    monitor = LagMonitor(log, threshold=0.1)
+    monitor.check(0.05)
+    assert monitor.stalls == 0
+    assert monitor.last_stall is None
+    monitor.check(0.3)
+    monitor.check(0.0)
+    metrics = monitor.metrics()
+    assert metrics["stalls"] == 1
+    assert metrics["lag"] == 0.0
+    assert metrics["lag_max"] == 0.3
+    assert metrics["last_stall"]
+
+
+async def test_lag_monitor_detects_blocked_loop(log):
+    monitor = LagMonitor(log, threshold=0.1)
+    monitor.interval = 0.01
+    task = asyncio.create_task(monitor.run_forever())
+    await asyncio.sleep(0.02)
+    time.sleep(0.2)
+    await wait_for(lambda: monitor.stalls)
+    task.cancel()
+    assert monitor.lag_max >= 0.15
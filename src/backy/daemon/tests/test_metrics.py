@@ -0,0 +1,68 @@
+from backy.daemon.metrics import Exposition, Histogram, RequestLatency
+
+
+def test_exposition():
+    exposition = Exposition()
+    exposition.gauge("backy_test", "A test.", 1.5)
+    exposition.counter("backy_test_total", "Tests.", 3)
+    exposition.add(
+        "backy_labeled",
+        "gauge",
+        "Labels.",
+        [({"job": 'a"b\\c\nd'}, True), ({}, float("inf"))],
+    )
+    assert exposition.render() == (
+        "# HELP backy_test A test.\n"
+        "# TYPE backy_test gauge\n"
+        "backy_test 1.5\n"
+        "# HELP backy_test_total Tests.\n"
+        "# TYPE backy_test_total counter\n"
+        "backy_test_total 3\n"
+        "# HELP backy_labeled Labels.\n"
+        "# TYPE backy_labeled gauge\n"
+        'backy_labeled{job="a\\"b\\\\c\\nd"} 1\n'
+        "backy_labeled +Inf\n"
+    )
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 2]:
+        histogram.observe(value)
+    assert list(histogram.samples({"a": "b"})) == [
+        ("_bucket", ({"a": "b", "le": "0.1"}, 2)),
+        ("_bucket", ({"a": "b", "le": "1.0"}, 3)),
+        ("_bucket", ({"a": "b", "le": "+Inf"}, 4)),
+        ("_sum", ({"a": "b"}, 2.65)),
+        ("_count", ({"a": "b"}, 4)),
+    ]
+
+
+def test_request_latency(monkeypatch):
+    monkeypatch.setattr(RequestLatency, "buckets", (0.1,))
+    latency = RequestLatency()
+    latency.observe("GET", "/v1/status", 200, 0.2)
+    latency.observe("GET", "/metrics", 200, 0.01)
+    exposition = Exposition()
+    latency.export(exposition)
+    assert exposition.render() == (
+        "# HELP backy_api_request_duration_seconds "
+        "Time taken to answer api requests.\n"
+        "# TYPE backy_api_request_duration_seconds histogram\n"
+        'backy_api_request_duration_seconds_bucket{method="GET",'
+        'route="/metrics",status="200",le="0.1"} 1\n'
+        'backy_api_request_duration_seconds_bucket{method="GET",'
+        'route="/metrics",status="200",le="+Inf"} 1\n'
+        'backy_api_request_duration_seconds_sum{method="GET",'
+        'route="/metrics",status="200"} 0.01\n'
+        'backy_api_request_duration_seconds_count{method="GET",'
+        'route="/metrics",status="200"} 1\n'
+        'backy_api_request_duration_seconds_bucket{method="GET",'
+        'route="/v1/status",status="200",le="0.1"} 0\n'
+        'backy_api_request_duration_seconds_bucket{method="GET",'
+        'route="/v1/status",status="200",le="+Inf"} 1\n'
+        'backy_api_request_duration_seconds_sum{method="GET",'
+        'route="/v1/status",status="200"} 0.2\n'
+        'backy_api_request_duration_seconds_count{method="GET",'
+        'route="/v1/status",status="200"} 1\n'
+    )
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from aiohttp import ClientConnectionError
+
+import backy.daemon.peers
+from backy.daemon.peers import PeerStatusCache
+
+
+class FakeClientManager(object):
+    """Answers status requests for servers from `jobs`."""
+
+    requests: list = []
+    jobs: dict = {}
+    streams: list = []
+    events: asyncio.Queue
+
+    def __init__(self, peers, taskid, log, connections=None):
+        self.peers = peers
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __getitem__(self, server):
+        return self.Client(server)
+
+    class Client(object):
+        def __init__(self, server):
+            self.server = server
+
+        async def fetch_status(self, filter=""):
+            FakeClientManager.requests.append(self.server)
+            await asyncio.sleep(0.01)
+            jobs = FakeClientManager.jobs[self.server]
+            if isinstance(jobs, Exception):
+                raise jobs
+            return [{"job": name, "status": s} for name, s in jobs.items()]
+
+        async def events(self, cursor=None):
+            FakeClientManager.streams.append(self.server)
+            while True:
+                yield await FakeClientManager.events.get()
+
+
+@pytest.fixture
+def peers(monkeypatch, log):
+    monkeypatch.setattr(backy.daemon.peers, "ClientManager", FakeClientManager)
+    FakeClientManager.requests = []
+    FakeClientManager.streams = []
+    FakeClientManager.events = asyncio.Queue()
+    FakeClientManager.jobs = {
+        "server-0": {"a": "running", "b": ""},
+        "server-1": ClientConnectionError("down"),
+    }
+    cache = PeerStatusCache(log)
+    cache.configure({"server-0": {}, "server-1": {}})
+    return cache
+
+
+async def test_jobs_share_requests(peers):
+    a, b, c = await asyncio.gather(
+        peers.job_status("server-0", "a"),
+        peers.job_status("server-0", "b"),
+        peers.job_status("server-0", "c"),
+    )
+    assert a == {"job": "a", "status": "running"}
+    assert b == {"job": "b", "status": ""}
+    assert c is None
+    assert FakeClientManager.requests == ["server-0"]
+
+    # Cached while fresh enough.
+    await peers.job_status("server-0", "a")
+    assert FakeClientManager.requests == ["server-0"]
+
+    # Callers can require newer statuses.
+    FakeClientManager.jobs["server-0"]["a"] = "finished"
+    since = asyncio.get_running_loop().time()
+    assert (await peers.job_status("server-0", "a", since))[
+        "status"
+    ] == "finished"
+    assert FakeClientManager.requests == ["server-0", "server-0"]
+
+
+async def test_unavailable_peer(peers):
+    for _ in range(2):
+        with pytest.raises(ClientConnectionError):
+            await peers.job_status("server-1", "a")
+    assert FakeClientManager.requests == ["server-1"]
+
+    peers.configure({"server-0": {}})
+    assert list(peers) == ["server-0"]
+    assert peers.statuses == {}
+
+
+async def test_jobs_share_event_streams(peers):
+    a1 = peers.follow("server-0", "a")
+    a2 = peers.follow("server-0", "a")
+    b = peers.follow("server-0", "b")
+    events = FakeClientManager.events
+    events.put_nowait(
+        {"cursor": "1", "type": "status", "data": {"job": "a", "status": "x"}}
+    )
+    events.put_nowait({"cursor": "2", "type": "revision", "data": {}})
+    events.put_nowait({"cursor": "3", "type": "reset", "data": {}})
+    assert await a1.get() == {"job": "a", "status": "x"}
+    assert await a2.get() == {"job": "a", "status": "x"}
+    # Missed updates are announced to all followers.
+    assert await a1.get() is None
+    assert await a2.get() is None
+    assert await b.get() is None
+    assert FakeClientManager.streams == ["server-0"]
+
+    stream = peers._streams["server-0"]
+    peers.unfollow("server-0", "a", a1)
+    peers.unfollow("server-0", "a", a2)
+    assert not stream.done()
+    peers.unfollow("server-0", "b", b)
+    assert peers._followers == {}
+    assert peers._streams == {}
+    await asyncio.sleep(0)
+    assert stream.cancelled()
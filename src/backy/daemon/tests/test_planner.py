@@ -0,0 +1,91 @@
+from backy.daemon.planner import (
+    BUCKET,
+    LoadProfile,
+    Placement,
+    SpreadPlanner,
+    load_profile,
+)
+
+DAY = 24 * 60 * 60
+
+
+def placement(name, duration=3600, rate=100.0, period=DAY, preferred=0):
+    return Placement(name, period, duration, rate, preferred)
+
+
+def test_plan_flattens_peak(tmp_path, log):
+    # With hashed spreads these all happen to start at the same time.
+    placements = [placement(f"job{i}") for i in range(12)]
+    hashed = load_profile(placements, {p.name: 0 for p in placements}, "hash")
+    assert hashed["peak"] == 1200
+
+    planner = SpreadPlanner(tmp_path / "plan.json", log)
+    offsets = planner.plan(placements)
+    planned = load_profile(placements, offsets, "planned")
+    assert planned["peak"] == 100
+    assert max(b["backups"] for b in planned["buckets"]) == 1
+    assert len(set(offsets.values())) == 12
+    assert all(o % BUCKET == 0 and 0 <= o < DAY for o in offsets.values())
+
+
+def test_plan_places_expensive_jobs_first(tmp_path, log):
+    planner = SpreadPlanner(tmp_path / "plan.json", log)
+    offsets = planner.plan(
+        [
+            placement("small", duration=60, preferred=123),
+            placement("big", duration=2 * 3600, rate=1000, preferred=100),
+        ]
+    )
+    # The big one gets its preferred offset, the small one is moved out of
+    # its way, as little as possible.
+    assert offsets["big"] == 100
+    assert offsets["small"] == DAY - BUCKET
+
+
+def test_plan_unknown_rate_uses_average(tmp_path, log):
+    profile = LoadProfile(
+        [
+            placement("a", rate=100),
+            placement("b", rate=300),
+            placement("c", rate=None),
+        ]
+    )
+    assert profile.rate(placement("c", rate=None)) == 200
+
+
+def test_shorter_periods_repeat_in_profile(log):
+    hourly = placement("hourly", duration=60, period=3600)
+    profile = load_profile(
+        [hourly, placement("daily")], {"hourly": 0, "daily": 0}, "hash"
+    )
+    assert profile["horizon"] == DAY
+    assert sum(b["backups"] for b in profile["buckets"]) == 24 + 12
+
+
+def test_plan_is_stable(tmp_path, log):
+    path = tmp_path / "plan.json"
+    placements = [placement(f"job{i}") for i in range(4)]
+    offsets = SpreadPlanner(path, log).plan(placements)
+
+    # New jobs do not move existing ones, neither do restarts.
+    placements.append(placement("new", duration=6 * 3600, rate=1000))
+    planner = SpreadPlanner(path, log)
+    new_offsets = planner.plan(placements)
+    assert {n: new_offsets[n] for n in offsets} == offsets
+
+    # Removed jobs are forgotten.
+    planner.plan(placements[1:])
+    assert "job0" not in SpreadPlanner(path, log).offsets
+
+    # Jobs whose interval changed are placed again.
+    placements[1] = placement("job1", period=DAY // 2)
+    assert planner.plan(placements[1:])["job1"] < DAY // 2
+
+
+def test_invalid_plan_is_ignored(tmp_path, log):
+    path = tmp_path / "plan.json"
+    path.write_text("garbage")
+    planner = SpreadPlanner(path, log)
+    assert planner.offsets == {}
+    assert planner.plan([placement("a")]) == {"a": 0}
+    assert SpreadPlanner(path, log).offsets == {"a": (DAY, 0)}
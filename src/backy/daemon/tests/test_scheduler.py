@@ -1,10 +1,11 @@
+import asyncio
 import datetime
 from unittest import mock
 
 import pytest
 
 import backy.utils
-from backy.daemon.scheduler import Job
+from backy.daemon.scheduler import Job, Scheduler
 
 
 @pytest.fixture
@@ -14,30 +15,119 @@ def daemon(tmp_path):
     return daemon
 
 
-async def test_wait_for_deadline_no_deadline_fails(daemon, log):
-    job = Job(daemon, "dummy", log)
-    # Not having a deadline set causes this to fail (immediately)
-    with pytest.raises(AssertionError):
-        await job._wait_for_deadline()
+class FakeJob(object):
+    def __init__(self, name, runs, block=None, workers=None):
+        self.name = name
+        self.runs = runs
+        self.block = block
+        self.workers = workers
+        self.working = False
+        self.scheduled = 0
 
+    async def run(self):
+        self.runs.append(self.name)
+        if self.workers:
+            async with self.workers:
+                self.working = True
+                await self.block.wait()
+        elif self.block:
+            await self.block.wait()
 
-async def test_wait_for_deadline(daemon, log):
-    job = Job(daemon, "dummy", log)
-    # Not having a deadline set causes this to fail.
-    now = backy.utils.now()
-    job.next_time = now + datetime.timedelta(seconds=0.3)
-    result = await job._wait_for_deadline()
-    assert result is None  # The deadline sleep was triggered.
-    assert backy.utils.now() - now >= datetime.timedelta(seconds=0.3)
+    def schedule_next(self):
+        self.scheduled += 1
+
+
+@pytest.fixture
+async def scheduler(log):
+    scheduler = Scheduler(log, workers=1)
+    scheduler.start(asyncio.get_running_loop())
+    yield scheduler
+    tasks = [scheduler._task, *scheduler.running.values()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def in_seconds(seconds):
+    return backy.utils.now() + datetime.timedelta(seconds=seconds)
+
+
+async def wait_for(condition):
+    while not condition():
+        await asyncio.sleep(0.01)
+
+
+async def test_scheduler_runs_jobs_in_deadline_order(scheduler):
+    runs = []
+    jobs = [FakeJob(name, runs) for name in "abc"]
+    scheduler.schedule(jobs[0], in_seconds(0.2))
+    scheduler.schedule(jobs[1], in_seconds(0.1))
+    scheduler.schedule(jobs[2], in_seconds(-10))
+    assert all(scheduler.is_active(j) for j in jobs)
+
+    await wait_for(lambda: len(runs) == 3)
+    assert runs == ["c", "b", "a"]
+    # Jobs schedule their next run themselves.
+    await wait_for(lambda: not scheduler.running)
+    assert [j.scheduled for j in jobs] == [1, 1, 1]
+
+    metrics = scheduler.metrics()
+    assert metrics["dispatched"] == 3
+    assert metrics["queued"] == metrics["running"] == 0
+    assert metrics["lag"]["c"] >= 10
+    assert metrics["lag"]["a"] < 5
+    assert metrics["lag_max"] == metrics["lag"]["c"]
+
+
+async def test_scheduler_reschedule_and_cancel(scheduler):
+    runs = []
+    a, b = FakeJob("a", runs), FakeJob("b", runs)
+    scheduler.schedule(a, in_seconds(1000))
+    scheduler.schedule(b, in_seconds(0.1))
+    # Rescheduling replaces the previous deadline.
+    scheduler.schedule(b, in_seconds(1000))
+    assert scheduler.run_now(a)
+
+    await wait_for(lambda: runs)
+    assert runs == ["a"]
+
+    assert scheduler.cancel(b)
+    assert not scheduler.is_active(b)
+    assert not scheduler.cancel(b)
+    assert not scheduler.run_now(b)
+    assert scheduler.metrics()["queued"] == 0
+
+
+async def test_scheduler_bounds_working_jobs(scheduler):
+    scheduler.workers.adjust(2)
+    runs = []
+    block = asyncio.Event()
+    jobs = [FakeJob(name, runs, block, scheduler.workers) for name in "abc"]
+    for job in jobs:
+        scheduler.schedule(job, in_seconds(0))
+
+    # Due jobs start right away, but only two of them may work.
+    await wait_for(lambda: len(runs) == 3)
+    await asyncio.sleep(0.1)
+    assert runs == ["a", "b", "c"]
+    assert [j.working for j in jobs] == [True, True, False]
+    metrics = scheduler.metrics()
+    assert metrics["running"] == 3
+    assert metrics["busy"] == 2
+
+    # Cancelling a working job frees its worker.
+    scheduler.cancel(jobs[0])
+    await wait_for(lambda: jobs[2].working)
+    assert not scheduler.is_active(jobs[0])
+    block.set()
+    await wait_for(lambda: not scheduler.running)
+    assert [j.scheduled for j in jobs] == [0, 1, 1]
 
 
-async def test_wait_for_deadline_1000(daemon, log):
+async def test_run_now_while_running_interrupts_waiting(daemon, log):
     job = Job(daemon, "dummy", log)
-    # Large deadline
-    now = backy.utils.now()
-    job.next_time = now + datetime.timedelta(seconds=1000)
-    job.run_immediately.set()
-    result = await job._wait_for_deadline()
-    assert result is True  # The event was triggered
-    assert not job.run_immediately.is_set()  # The event was reset.
-    assert backy.utils.now() - now < datetime.timedelta(seconds=0.5)
+    daemon.scheduler.run_now.return_value = False
+    job.run_now()
+    assert job.run_immediately.is_set()
+    daemon.scheduler.run_now.assert_called_once_with(job)
+    assert await backy.utils.delay_or_event(1000, job.run_immediately)
@@ -0,0 +1,103 @@
+import datetime
+import re
+
+import pytest
+
+import backy.utils
+from backy.daemon.status import RepositoryState, StatusTable
+from backy.revision import Revision
+
+
+def make_status(name, **kw):
+    status = dict(
+        job=name,
+        sla="OK",
+        sla_overdue=0,
+        status="",
+        last_time=None,
+        last_tags=None,
+        last_duration=None,
+        next_time=None,
+        next_tags=None,
+        manual_tags="",
+        problem_reports=0,
+        unsynced_revs=0,
+        local_revs=0,
+    )
+    status.update(kw)
+    return status
+
+
+@pytest.fixture
+def state(repository):
+    return RepositoryState(repository)
+
+
+def test_update_and_snapshot(state, clock):
+    table = StatusTable()
+    assert table.update(make_status("b"), state)
+    assert table.update(make_status("a", status="running"), state)
+    assert table.updated == clock.now()
+    now, statuses = table.snapshot()
+    assert now == clock.now()
+    assert [s["job"] for s in statuses] == ["a", "b"]
+    assert statuses[0]["status"] == "running"
+
+    assert not table.update(make_status("a", status="running"), state)
+    assert table.update(make_status("a", status="finished"), state)
+    assert table.snapshot("a")[1][0]["status"] == "finished"
+
+    table.remove("a")
+    table.remove("unknown")
+    assert [s["job"] for s in table.snapshot()[1]] == ["b"]
+
+
+def test_filter(state):
+    table = StatusTable()
+    for name in ["test01", "foo00", "foo01"]:
+        table.update(make_status(name), state)
+    assert table.names(r"foo\d\d") == ["foo00", "foo01"]
+    assert table._matches == {r"foo\d\d": ["foo00", "foo01"]}
+    table.update(make_status("foo02"), state)
+    assert table._matches == {}
+    assert [s["job"] for s in table.snapshot("foo")[1]] == [
+        "foo00",
+        "foo01",
+        "foo02",
+    ]
+    assert table.snapshot("^test")[1][0]["job"] == "test01"
+    assert table.snapshot("nomatch")[1] == []
+
+
+def test_filter_cache_is_bounded(state, monkeypatch):
+    monkeypatch.setattr(StatusTable, "max_filters", 2)
+    table = StatusTable()
+    table.update(make_status("test01"), state)
+    for f in ["a", "b", "c"]:
+        table.names(f)
+    assert len(table._matches) == 1
+
+
+def test_invalid_filter(state):
+    table = StatusTable()
+    table.update(make_status("test01"), state)
+    with pytest.raises(re.error):
+        table.snapshot("(")
+
+
+def test_sla_is_evaluated_on_snapshot(repository, clock, log):
+    r = Revision.create(repository, {"daily"}, log)
+    r.timestamp = backy.utils.now() - datetime.timedelta(hours=24)
+    r.stats["duration"] = 1
+    r.materialize()
+    repository.scan()
+    table = StatusTable()
+    table.update(make_status("test01"), RepositoryState(repository))
+    assert table.snapshot()[1][0]["sla"] == "OK"
+
+    clock.now.return_value += datetime.timedelta(hours=24)
+    [status] = table.snapshot()[1]
+    assert status["sla"] == "TOO OLD"
+    assert status["sla_overdue"] == 48 * 60 * 60
+    # The stored status is not touched.
+    assert table.entries["test01"].status["sla"] == "OK"
@@ -0,0 +1,370 @@
+"""Compiled revision specs for `Repository.find_revisions`.
+
+A spec is tokenized and compiled once into a program of steps. Every step
+evaluates one parenthesized group, the last step evaluates the top level.
+Steps are ordered like the original recursive evaluator reduced groups
+(innermost and rightmost first) so that specs with multiple errors fail
+with the same exception.
+
+Steps evaluate to selections: ordered sets of positions in the history,
+backed by a bitmap. Filters (`tag:`, `trust:`, `server:`, `clean`, ...) are
+looked up in a `RevisionIndex` that is built once per history.
+
+"""
+
+import bisect
+import datetime
+import functools
+import itertools
+import re
+from collections import defaultdict
+from math import ceil, floor
+from typing import TYPE_CHECKING, Iterator, List, Optional, Union
+
+from backy.utils import list_rindex, list_split
+
+from .revision import Revision, Trust
+
+if TYPE_CHECKING:
+    from .repository import Repository
+
+FUNCTIONS = ("first", "last", "not", "reverse")
+
+
+class RevisionIndex(object):
+    """Bitmaps of history positions by tag, trust and server."""
+
+    history: List[Revision]
+    full: int
+    positions: dict[Revision, int]
+    tags: dict[str, int]
+    trust: dict[Trust, int]
+    servers: dict[str, int]
+    clean: int
+    timestamps: List[datetime.datetime]
+    ordered: bool
+
+    def __init__(self, history: List[Revision]):
+        self.history = history
+        self.full = (1 << len(history)) - 1
+        self.positions = {}
+        self.tags = defaultdict(int)
+        self.trust = defaultdict(int)
+        self.servers = defaultdict(int)
+        self.clean = 0
+        for i, r in enumerate(history):
+            bit = 1 << i
+            self.positions.setdefault(r, i)
+            for tag in r.tags:
+                self.tags[tag] |= bit
+            self.trust[r.trust] |= bit
+            self.servers[r.server] |= bit
+            if "duration" in r.stats:
+                self.clean |= bit
+        self.timestamps = [r.timestamp for r in history]
+        self.ordered = all(
+            a <= b for a, b in itertools.pairwise(self.timestamps)
+        )
+
+    def index_by_date(self, date: datetime.datetime) -> float:
+        if self.ordered:
+            L = bisect.bisect_right(self.timestamps, date) - 1
+            r = bisect.bisect_left(self.timestamps, date)
+        else:
+            L = max(
+                (i for i, t in enumerate(self.timestamps) if t <= date),
+                default=-1,
+            )
+            r = min(
+                (i for i, t in enumerate(self.timestamps) if t >= date),
+                default=len(self.timestamps),
+            )
+        assert 0 <= r - L <= 1, (
+            "can not index with date if multiple revision have the same "
+            "timestamp"
+        )
+        return (L + r) / 2.0
+
+
+def bits(mask: int) -> Iterator[int]:
+    """The positions of the set bits, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Selection(object):
+    """An ordered set of history positions.
+
+    Selections in history order only keep the bitmap.
+    """
+
+    mask: int
+    order: Optional[List[int]]
+
+    def __init__(self, mask: int, order: Optional[List[int]] = None):
+        self.mask = mask
+        self.order = order
+
+    def positions(self) -> List[int]:
+        if self.order is None:
+            return list(bits(self.mask))
+        return self.order
+
+    def first(self) -> "Pick":
+        if self.order is None:
+            if not self.mask:
+                raise IndexError("no revisions selected")
+            return Pick((self.mask & -self.mask).bit_length() - 1)
+        return Pick(self.order[0])
+
+    def last(self) -> "Pick":
+        if self.order is None:
+            if not self.mask:
+                raise IndexError("no revisions selected")
+            return Pick(self.mask.bit_length() - 1)
+        return Pick(self.order[-1])
+
+    def union(self, other: "Selection") -> "Selection":
+        added = other.mask & ~self.mask
+        mask = self.mask | other.mask
+        if (
+            self.order is None
+            and other.order is None
+            and added >> self.mask.bit_length() << self.mask.bit_length()
+            == added
+        ):
+            # Everything new comes after us: still in history order.
+            return Selection(mask)
+        order = self.positions() + [
+            p for p in other.positions() if added >> p & 1
+        ]
+        return Selection(mask, order)
+
+    def intersection(self, other: "Selection") -> "Selection":
+        mask = self.mask & other.mask
+        if self.order is None:
+            return Selection(mask)
+        return Selection(mask, [p for p in self.order if mask >> p & 1])
+
+    def reverse(self) -> "Selection":
+        return Selection(self.mask, self.positions()[::-1])
+
+
+class Pick(object):
+    """A single revision, as returned by `first` and `last`."""
+
+    position: int
+
+    def __init__(self, position: int):
+        self.position = position
+
+    def selection(self) -> Selection:
+        return Selection(1 << self.position)
+
+
+Value = Union[Selection, Pick]
+
+
+class Context(object):
+    repository: "Repository"
+    index: RevisionIndex
+    values: List[Value]
+
+    def __init__(self, repository: "Repository", index: RevisionIndex):
+        self.repository = repository
+        self.index = index
+        self.values = []
+
+    def position(self, revision: Revision) -> int:
+        return self.index.positions[revision]
+
+
+class Node(object):
+    def evaluate(self, ctx: Context) -> Value:
+        raise NotImplementedError
+
+    def select(self, ctx: Context) -> Selection:
+        value = self.evaluate(ctx)
+        return value.selection() if isinstance(value, Pick) else value
+
+
+class Ref(Node):
+    """The value of a previous step, i.e. a parenthesized group."""
+
+    def __init__(self, step: int):
+        self.step = step
+
+    def evaluate(self, ctx: Context) -> Value:
+        return ctx.values[self.step]
+
+
+class Leaf(Node):
+    def __init__(self, token: str):
+        self.token = token
+
+    def evaluate(self, ctx: Context) -> Value:
+        index = ctx.index
+        token = self.token
+        if token.startswith("server:"):
+            return Selection(
+                index.servers.get(token.removeprefix("server:"), 0)
+            )
+        elif token.startswith("tag:"):
+            return Selection(index.tags.get(token.removeprefix("tag:"), 0))
+        elif token.startswith("trust:"):
+            trust = Trust(token.removeprefix("trust:").lower())
+            return Selection(index.trust.get(trust, 0))
+        elif token == "all":
+            return Selection(index.full)
+        elif token == "clean":
+            return Selection(index.clean)
+        elif token == "local":
+            return Selection(index.servers.get("", 0))
+        elif token == "remote":
+            return Selection(index.full & ~index.servers.get("", 0))
+        else:
+            revision = ctx.repository.find(token)
+            return Selection(1 << ctx.position(revision))
+
+
+class Apply(Node):
+    def __init__(self, function: str, arg: Node):
+        self.function = function
+        self.arg = arg
+
+    def evaluate(self, ctx: Context) -> Value:
+        arg = self.arg.select(ctx)
+        match self.function:
+            case "first":
+                return arg.first()
+            case "last":
+                return arg.last()
+            case "not":
+                return Selection(ctx.index.full & ~arg.mask)
+            case "reverse":
+                return arg.reverse()
+        raise ValueError(self.function)
+
+
+class Or(Node):
+    def __init__(self, left: Node, right: Node):
+        self.left = left
+        self.right = right
+
+    def evaluate(self, ctx: Context) -> Value:
+        left = self.left.select(ctx)
+        return left.union(self.right.select(ctx))
+
+
+class And(Node):
+    def __init__(self, left: Node, right: Node):
+        self.left = left
+        self.right = right
+
+    def evaluate(self, ctx: Context) -> Value:
+        left = self.left.select(ctx)
+        return left.intersection(self.right.select(ctx))
+
+
+class Range(Node):
+    def __init__(self, start: str | Ref, end: str | Ref):
+        self.start = start
+        self.end = end
+
+    def _index(self, ctx: Context, bound: str | Ref) -> float:
+        if isinstance(bound, str):
+            return ctx.repository.index_by_date(bound) or ctx.position(
+                ctx.repository.find(bound)
+            )
+        value = bound.evaluate(ctx)
+        assert isinstance(
+            value, Pick
+        ), "can only index a single revision specifier"
+        return value.position
+
+    def evaluate(self, ctx: Context) -> Value:
+        a = self._index(ctx, self.start)
+        b = self._index(ctx, self.end)
+        start = ceil(min(a, b))
+        end = min(floor(max(a, b)), len(ctx.index.history) - 1)
+        if end < start:
+            return Selection(0)
+        return Selection(((1 << (end + 1)) - 1) & ~((1 << start) - 1))
+
+
+class Fail(Node):
+    """A syntax error that is raised when it is reached."""
+
+    def __init__(self, exception: type[Exception], *args):
+        self.exception = exception
+        self.args = args
+
+    def evaluate(self, ctx: Context) -> Value:
+        raise self.exception(*self.args)
+
+
+class Query(object):
+    steps: List[Node]
+
+    def __init__(self, steps: List[Node]):
+        self.steps = steps
+
+    def evaluate(
+        self, repository: "Repository", index: RevisionIndex
+    ) -> List[Revision]:
+        ctx = Context(repository, index)
+        for step in self.steps:
+            ctx.values.append(step.evaluate(ctx))
+        selection = self.steps[-1].select(ctx)
+        return [index.history[p] for p in selection.positions()]
+
+
+def tokenize(spec: str) -> List[str]:
+    return [t.strip() for t in re.split(r"(\(|\)|,|&|\.\.)", spec) if t.strip()]
+
+
+def _compile_flat(tokens: List[str | Ref]) -> Node:
+    # Operators by precedence: "," binds weakest, then "&", then "..".
+    if "," in tokens:
+        i = tokens.index(",")
+        return Or(_compile_flat(tokens[:i]), _compile_flat(tokens[i + 1 :]))
+    elif "&" in tokens:
+        i = tokens.index("&")
+        return And(_compile_flat(tokens[:i]), _compile_flat(tokens[i + 1 :]))
+    elif ".." in tokens:
+        parts = list_split(tokens, "..")
+        if len(parts) != 2:
+            return Fail(ValueError, "only one range allowed")
+        a, b = parts
+        if len(a) > 1 or len(b) > 1:
+            return Fail(AssertionError)
+        return Range(a[0] if a else "first", b[0] if b else "last")
+    if len(tokens) != 1:
+        return Fail(AssertionError)
+    token = tokens[0]
+    return token if isinstance(token, Ref) else Leaf(token)
+
+
+@functools.lru_cache(maxsize=512)
+def parse(spec: str) -> Query:
+    tokens: List[str | Ref] = list(tokenize(spec))
+    steps: List[Node] = []
+    while "(" in tokens and ")" in tokens:
+        i = list_rindex(tokens, "(")
+        try:
+            j = tokens.index(")", i)
+        except ValueError:
+            steps.append(Fail(ValueError, "unbalanced parentheses"))
+            return Query(steps)
+        prev, middle, next = tokens[:i], tokens[i + 1 : j], tokens[j + 1 :]
+        node = _compile_flat(middle)
+        if prev and isinstance(prev[-1], str) and prev[-1] in FUNCTIONS:
+            function = prev.pop()
+            assert isinstance(function, str)
+            node = Apply(function, node)
+        steps.append(node)
+        tokens = prev + [Ref(len(steps) - 1)] + next
+    steps.append(_compile_flat(tokens))
+    return Query(steps)
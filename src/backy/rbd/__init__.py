@@ -1,3 +1,4 @@
+import argparse
 import json
 import os
 import subprocess
@@ -8,9 +9,20 @@ from argparse import _ActionsContainer
 from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
-from typing import IO, Any, Callable, Iterable, Literal, Optional, Set, cast
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Iterable,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    cast,
+)
 
 import consulate
+import humanize
 from structlog.stdlib import BoundLogger
 
 import backy
@@ -28,9 +40,11 @@ from backy.utils import (
     copy,
     posix_fadvise,
     report_status,
+    timed,
 )
 
-from .chunked import BackendException, Chunk, File, Hash, Store
+from . import parallel
+from .chunked import BackendException, Chunk, File, Hash, Store, mapping
 from .rbd import RBDClient
 
 
@@ -41,6 +55,7 @@ def locked(target: str, mode: Literal["shared", "exclusive"]):
 class RestoreBackend(Enum):
     AUTO = "auto"
     PYTHON = "python"
+    PARALLEL = "parallel"
     RUST = "rust"
 
     def __str__(self):
@@ -51,13 +66,17 @@ class RestoreBackend(Enum):
 class RBDRestoreArgs(RestoreArgs):
     target: str
     backend: RestoreBackend = RestoreBackend.AUTO
+    differential: bool = False
 
     def to_cmdargs(self) -> Iterable[str]:
-        return ["--backend", self.backend.value, self.target]
+        args = ["--backend", self.backend.value]
+        if self.differential:
+            args.append("--differential")
+        return args + [self.target]
 
     @classmethod
     def from_args(cls, **kw: Any) -> "RBDRestoreArgs":
-        return cls(kw["target"], kw["restore_backend"])
+        return cls(kw["target"], kw["restore_backend"], kw["differential"])
 
     @classmethod
     def setup_argparse(cls, restore_parser: _ActionsContainer) -> None:
@@ -69,6 +88,12 @@ class RBDRestoreArgs(RestoreArgs):
             dest="restore_backend",
             help="(default: %(default)s)",
         )
+        restore_parser.add_argument(
+            "--differential",
+            action="store_true",
+            help="Only write chunks that differ from what TARGET contains "
+            "(parallel backend only)",
+        )
         restore_parser.add_argument(
             "target",
             metavar="TARGET",
@@ -80,6 +105,45 @@ class RBDSource(Source[RBDRestoreArgs]):
     type_ = "rbd"
     restore_type = RBDRestoreArgs
 
+    @classmethod
+    def setup_subcommands(cls, subparsers: Any) -> None:
+        p = subparsers.add_parser(
+            "check-store",
+            help="Check the chunk index against the chunks on disk",
+        )
+        p.add_argument(
+            "--repair",
+            action="store_true",
+            help="Update the index to match the chunks on disk",
+        )
+        p.set_defaults(func="check_store")
+        p = subparsers.add_parser(
+            "convert-mappings",
+            help="Convert revisions to the binary mapping format",
+        )
+        p.set_defaults(func="convert_mappings")
+
+    def run_subcommand(self, func: str, args: argparse.Namespace) -> int:
+        match func:
+            case "check_store":
+                return int(not self.check_store(args.repair))
+            case "convert_mappings":
+                self.convert_mappings()
+                return 0
+        return super().run_subcommand(func, args)
+
+    # Run a full mark-and-sweep gc at least this often (in seconds) to
+    # correct drift in the chunk reference counts.
+    gc_audit_interval = 7 * 24 * 60 * 60
+    # Number of chunks to load ahead of the current one when restoring.
+    restore_readahead = 8
+    # The parallel restore backend: number of worker processes, number of
+    # consecutive chunks each worker writes at once, and the maximum number
+    # of chunks in flight when restoring to stdout.
+    restore_workers = os.cpu_count() or 1
+    restore_batch = 16
+    restore_queue = 16
+
     ceph_rbd: "CephRBD"
     store: Store
     log: BoundLogger
@@ -107,7 +171,9 @@ class RBDSource(Source[RBDRestoreArgs]):
         revision: Revision,
         mode: str = "rb",
         parent: Optional[Revision] = None,
+        readahead: int = 0,
     ) -> File:
+        stats = None
         if "w" in mode or "+" in mode:
             if parent and not self._path_for_revision(revision).exists():
                 with (
@@ -116,7 +182,16 @@ class RBDSource(Source[RBDRestoreArgs]):
                 ):
                     # This is ok, this is just metadata, not the actual data.
                     new.write(old.read())
-        file = File(self._path_for_revision(revision), self.store, mode)
+            # Account written bytes and chunk pipeline timings on the
+            # revision.
+            stats = revision.stats
+        file = File(
+            self._path_for_revision(revision),
+            self.store,
+            mode,
+            stats,
+            readahead=readahead,
+        )
 
         if file.writable() and self.repository.contains_distrusted:
             # "Force write"-mode if any revision is distrusted.
@@ -141,18 +216,28 @@ class RBDSource(Source[RBDRestoreArgs]):
                 "Source is not ready (does it exist? can you access it?)"
             )
 
+        stats = revision.stats
         try:
             with self.ceph_rbd(revision) as source:
                 parent_rev = source.get_parent()
-                with self.open(revision, "wb", parent_rev) as file:
-                    if parent_rev:
-                        source.diff(file, parent_rev)
-                    else:
-                        source.full(file)
-                with self.open(revision) as file:
-                    verified = source.verify(
-                        file, report=self.repository.add_report
-                    )
+                with timed(stats, "export") as phase:
+                    # Closing the file waits for the chunks to be stored.
+                    with self.open(revision, "wb", parent_rev) as file:
+                        if parent_rev:
+                            source.diff(file, parent_rev)
+                        else:
+                            source.full(file)
+                    phase["bytes"] = stats.get("bytes_written", 0)
+                # Count the chunks right away. If the revision gets removed
+                # then gc will only need to look at its chunks.
+                with timed(stats, "count"):
+                    self._count_revision(revision)
+                with timed(stats, "verify") as phase:
+                    with self.open(revision) as file:
+                        verified = source.verify(
+                            file, report=self.repository.add_report
+                        )
+                    phase["bytes"] = file.stats.get("bytes_read", 0)
         except BackendException:
             self.log.exception("ceph-error-distrust-all")
             verified = False
@@ -167,12 +252,18 @@ class RBDSource(Source[RBDRestoreArgs]):
             revision.remove()
         else:
             self.log.info("verification-ok", revision_uuid=revision.uuid)
+        # Switched from a fine-grained syncing mechanism to "everything
+        # once" when we're done. This is as safe but much faster.
+        with timed(stats, "sync"):
+            os.sync()
+        if verified:
             revision.stats["duration"] = time.time() - start
+            # Exported as a metric by the daemon, which can't afford to look
+            # into the store itself.
+            revision.stats["store_chunks"] = len(self.store.index)
+            # The info file is synced on its own.
             revision.write_info()
             revision.readonly()
-        # Switched from a fine-grained syncing mechanism to "everything
-        # once" when we're done. This is as safe but much faster.
-        os.sync()
 
         # If there are distrusted revisions, then perform at least one
         # verification after a backup - for good measure and to keep things
@@ -203,7 +294,7 @@ class RBDSource(Source[RBDRestoreArgs]):
             if verified_revision.trust != Trust.VERIFIED:
                 continue
             verified_chunks.update(
-                self.open(verified_revision)._mapping.values()
+                self.open(verified_revision)._mapping.hashes()
             )
 
         log.debug("verify-loaded-chunks", verified_chunks=len(verified_chunks))
@@ -211,7 +302,7 @@ class RBDSource(Source[RBDRestoreArgs]):
         errors = False
         # Go through all chunks and check them. Delete problematic ones.
         f = self.open(revision)
-        hashes = set(f._mapping.values()) - verified_chunks
+        hashes = f._mapping.hashes() - verified_chunks
         yield len(hashes) + 2
         for candidate in hashes:
             yield
@@ -224,7 +315,7 @@ class RBDSource(Source[RBDRestoreArgs]):
                 log.exception("verify-error", chunk=candidate)
                 errors = True
                 try:
-                    self.store.chunk_path(candidate).unlink(missing_ok=True)
+                    self.store.remove(candidate)
                 except Exception:
                     log.exception("verify-remove-error", chunk=candidate)
                 # This is an optimisation: we can skip this revision, purge it
@@ -254,37 +345,141 @@ class RBDSource(Source[RBDRestoreArgs]):
         yield None
 
     @locked(target=".purge", mode="exclusive")
-    def gc(self) -> None:
+    def gc(self, audit: bool = False) -> None:
         self.log.debug("purge")
-        used_chunks: Set[Hash] = set()
         # TODO: also remove mapping file
         # TODO: purge quarantine store
-        for revision in self.repository.local_history:
-            used_chunks.update(self.open(revision)._mapping.values())
-        self.store.purge(used_chunks)
+        last_audit = self.store.refs.last_audit
+        if (
+            audit
+            or last_audit is None
+            or time.time() - last_audit > self.gc_audit_interval
+            or not self._update_refs()
+        ):
+            self._audit_refs()
+        else:
+            self.store.purge_unreferenced()
         # TODO: move this to cli/daemon?
         self.repository.clear_purge_pending()
 
+    def _revision_hashes(self, path: Path) -> Set[Hash]:
+        with File(path, self.store, "r") as f:
+            return f._mapping.hashes()
+
+    def _count_revision(self, revision: Revision) -> None:
+        path = self._path_for_revision(revision)
+        if path.exists():
+            self.store.refs.add(revision.uuid, self._revision_hashes(path))
+
+    def _update_refs(self) -> bool:
+        """Count new revisions and uncount removed ones.
+
+        Returns whether the reference counts could be updated.
+        """
+        refs = self.store.refs
+        local = {r.uuid: r for r in self.repository.local_history}
+        counted = refs.revisions()
+        for uuid in counted - local.keys():
+            path = self.repository.path / uuid
+            if not path.exists():
+                self.log.warning("gc-mapping-missing", revision_uuid=uuid)
+                return False
+            refs.remove(uuid, self._revision_hashes(path))
+        for uuid in local.keys() - counted:
+            self._count_revision(local[uuid])
+        return True
+
+    def _audit_refs(self) -> None:
+        """Full mark-and-sweep: recount all revisions and purge everything
+        that isn't used."""
+        self.log.info("gc-audit")
+        used_chunks: Set[Hash] = set()
+
+        def revisions():
+            for revision in self.repository.local_history:
+                path = self._path_for_revision(revision)
+                if not path.exists():
+                    continue
+                hashes = self._revision_hashes(path)
+                used_chunks.update(hashes)
+                yield revision.uuid, hashes
+
+        self.store.refs.replace(revisions())
+        self.store.purge(used_chunks)
+
+    @locked(target=".purge", mode="exclusive")
+    def check_store(self, repair: bool = False) -> bool:
+        """Check the chunk index against the chunks on disk."""
+        return self.store.check(repair)
+
+    @locked(target=".backup", mode="exclusive")
+    @locked(target=".purge", mode="exclusive")
+    def convert_mappings(self) -> None:
+        """Convert legacy JSON revision files to the binary format."""
+        converted = 0
+        for revision in self.repository.local_history:
+            path = self._path_for_revision(revision)
+            if path.exists() and mapping.convert(path):
+                converted += 1
+        self.log.info("convert-mappings", converted=converted)
+
     #################
     # Restoring
 
     # This needs no locking as it's only a wrapper for restore_file and
     # restore_stdout and locking isn't re-entrant.
     def restore(self, revision: Revision, args: RBDRestoreArgs) -> None:
-        s = self.open(revision)
         restore_backend = args.backend
+        if restore_backend == RestoreBackend.RUST and not mapping.is_legacy(
+            self._path_for_revision(revision)
+        ):
+            raise ValueError(
+                f"Revision {revision.uuid} uses the binary mapping format, "
+                "which backy-extract can't read. "
+                "Use `--backend parallel` instead."
+            )
+        s = self.open(revision, readahead=self.restore_readahead)
         if restore_backend == RestoreBackend.AUTO:
-            if self.backy_extract_supported(s):
+            if not args.differential and self.backy_extract_supported(s):
                 restore_backend = RestoreBackend.RUST
             else:
-                restore_backend = RestoreBackend.PYTHON
+                restore_backend = RestoreBackend.PARALLEL
             self.log.info("restore-backend", backend=restore_backend.value)
-        if restore_backend == RestoreBackend.PYTHON:
+        if args.differential and (
+            restore_backend != RestoreBackend.PARALLEL or args.target == "-"
+        ):
+            raise ValueError(
+                "Differential restores need the parallel backend "
+                "and a target file or device."
+            )
+        if restore_backend in (RestoreBackend.PYTHON, RestoreBackend.PARALLEL):
+            started = time.time()
+            written, skipped = s.size, 0
             with s as source:
-                if args.target != "-":
+                if restore_backend == RestoreBackend.PARALLEL:
+                    if args.target != "-":
+                        written, skipped = self.restore_file_parallel(
+                            source, args.target, args.differential
+                        )
+                    else:
+                        self.restore_stdout_parallel(source)
+                elif args.target != "-":
                     self.restore_file(source, args.target)
                 else:
                     self.restore_stdout(source)
+            duration = time.time() - started
+            self.log.info(
+                "restore-finished",
+                bytes=s.size,
+                bytes_written=written,
+                bytes_skipped=skipped,
+                duration=round(duration, 2),
+                throughput=humanize.naturalsize(
+                    s.size / max(duration, 0.001), binary=True
+                )
+                + "/s",
+                readahead_wait=round(s.stats.get("readahead_wait_time", 0), 2),
+            )
         elif restore_backend == RestoreBackend.RUST:
             self.restore_backy_extract(revision, args.target)
 
@@ -293,6 +488,10 @@ class RBDSource(Source[RBDRestoreArgs]):
         if file.size % CHUNK_SIZE != 0:
             log.debug("not-chunk-aligned")
             return False
+        if not mapping.is_legacy(file.name):
+            # backy-extract only reads JSON mappings.
+            log.info("binary-mapping")
+            return False
         try:
             version = subprocess.check_output(
                 [BACKY_EXTRACT, "--version"],
@@ -352,6 +551,47 @@ class RBDSource(Source[RBDRestoreArgs]):
                     break
                 target.write(chunk)
 
+    @locked(target=".purge", mode="shared")
+    def restore_file_parallel(
+        self, source: File, target_name: str, differential: bool = False
+    ) -> Tuple[int, int]:
+        """Restore to a target file or device with multiple processes.
+
+        Returns the number of bytes written and skipped.
+        """
+        self.log.debug(
+            "restore-file-parallel",
+            source=source.name,
+            target=target_name,
+            workers=self.restore_workers,
+            differential=differential,
+        )
+        open(target_name, "ab").close()  # touch into existence
+        return parallel.restore_file(
+            source,
+            target_name,
+            self.restore_workers,
+            self.restore_batch,
+            differential,
+        )
+
+    @locked(target=".purge", mode="shared")
+    def restore_stdout_parallel(self, source: File) -> None:
+        """Emit restore data to stdout, loading chunks in multiple
+        processes."""
+        self.log.debug(
+            "restore-stdout-parallel",
+            source=source.name,
+            workers=self.restore_workers,
+        )
+        with os.fdopen(os.dup(1), "wb") as target:
+            parallel.restore_stream(
+                source,
+                target,
+                self.restore_workers,
+                self.restore_queue,
+            )
+
 
 class CephRBD:
     """The Ceph RBD source.
@@ -418,7 +658,8 @@ class CephRBD:
 
     def __enter__(self):
         snapname = "backy-{}".format(self.revision.uuid)
-        self.create_snapshot(snapname)
+        with timed(self.revision.stats, "snapshot"):
+            self.create_snapshot(snapname)
         return self
 
     def create_snapshot(self, name: str) -> None:
@@ -489,7 +730,8 @@ class CephRBD:
         return "{}/{}".format(self.pool, self.image)
 
     def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
-        self._delete_old_snapshots()
+        with timed(self.revision.stats, "delete-snapshots"):
+            self._delete_old_snapshots()
 
     def get_parent(self) -> Optional[Revision]:
         if self.always_full:
@@ -518,7 +760,12 @@ class CephRBD:
         s = self.rbd.export_diff(self._image_name + "@" + snap_to, snap_from)
         with s as source:
             source.integrate(target, snap_from, snap_to)
-        self.log.info("diff-integration-finished")
+        chunk_stats = target.stats.get("chunk_stats", {})
+        self.log.info(
+            "diff-integration-finished",
+            write_full=chunk_stats.get("write_full", 0),
+            write_partial=chunk_stats.get("write_partial", 0),
+        )
 
     def full(self, target: File) -> None:
         self.log.info("full")
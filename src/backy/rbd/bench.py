@@ -0,0 +1,623 @@
+"""Benchmarks for the chunked store and the RBD source.
+
+`backy-bench run` generates a synthetic image in a scratch directory and
+times the hot paths of backups, restores, verification and gc on it. The
+results are written as JSON so that runs of different backy versions can
+be compared with `backy-bench compare`.
+
+All data is generated locally and deterministically from a seed: the same
+image specification produces the same chunks on every run.
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import random
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from importlib.metadata import PackageNotFoundError, version
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+import humanize
+import structlog
+from rich import print as rprint
+from rich.table import Column, Table
+from structlog.stdlib import BoundLogger
+
+from backy import logging
+from backy.repository import Repository
+from backy.revision import Revision
+from backy.schedule import Schedule
+from backy.utils import CHUNK_SIZE, MiB, kiB
+
+from . import CephRBD, RBDSource
+from .chunked import Chunk, File, Store
+from .rbd import RBDDiffV1
+
+# Version of the result format.
+FORMAT = 1
+
+SIZE_UNITS = {"": 1, "k": kiB, "m": MiB, "g": 1024 * MiB}
+
+
+def parse_size(value: str) -> int:
+    """Parse sizes like `512`, `64k`, `256M` or `2GiB`."""
+    text = value.strip().lower().removesuffix("ib").removesuffix("b")
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ""
+    try:
+        return int(float(text.removesuffix(unit)) * SIZE_UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r}")
+
+
+@dataclass(frozen=True)
+class ImageSpec:
+    """Describes a synthetic image.
+
+    `dedup` is the share of chunks that repeat an earlier chunk and
+    `compressibility` the share of each chunk that consists of zeroes.
+
+    """
+
+    size: int = 256 * MiB
+    dedup: float = 0.2
+    compressibility: float = 0.5
+    seed: int = 0
+
+    def __post_init__(self):
+        if not 0 <= self.dedup <= 1:
+            raise ValueError("dedup must be between 0 and 1")
+        if not 0 <= self.compressibility <= 1:
+            raise ValueError("compressibility must be between 0 and 1")
+
+    def _block(self, seed: int) -> bytes:
+        random_size = int(CHUNK_SIZE * (1 - self.compressibility))
+        data = random.Random(seed).randbytes(random_size)
+        return data + bytes(CHUNK_SIZE - random_size)
+
+    def blocks(self) -> Iterator[bytes]:
+        """Generate the image data in chunk sized blocks."""
+        rng = random.Random(self.seed)
+        seeds: list[int] = []
+        remaining = self.size
+        while remaining:
+            if seeds and rng.random() < self.dedup:
+                seed = rng.choice(seeds)
+            else:
+                seed = rng.getrandbits(64)
+                seeds.append(seed)
+            block = self._block(seed)[:remaining]
+            remaining -= len(block)
+            yield block
+
+    def write(self, path: Path) -> None:
+        with path.open("wb") as f:
+            for block in self.blocks():
+                f.write(block)
+
+
+class Timer(object):
+    """Accumulates the time spent in its context and the work done.
+
+    Benchmarks enter the timer only around the code they measure and keep
+    setup (e.g. generating data) outside.
+
+    """
+
+    seconds: float
+    bytes: int
+    ops: int
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.bytes = 0
+        self.ops = 0
+        self._started = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type=None, exc_val=None, exc_tb=None):
+        self.seconds += time.perf_counter() - self._started
+
+
+@dataclass
+class Result:
+    name: str
+    runs: list[float] = field(default_factory=list)
+    bytes: int = 0
+    ops: int = 0
+
+    @property
+    def seconds(self) -> float:
+        return min(self.runs)
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second of the best run."""
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return dict(
+            name=self.name,
+            seconds=self.seconds,
+            median=statistics.median(self.runs),
+            runs=self.runs,
+            bytes=self.bytes,
+            ops=self.ops,
+            throughput=self.throughput,
+        )
+
+
+class Environment(object):
+    """A scratch directory with the image and a backup of it.
+
+    Benchmarks must not modify the shared image, base store or base
+    revision. They copy them or create their own in `tmp()`.
+
+    """
+
+    path: Path
+    spec: ImageSpec
+    log: BoundLogger
+    block_size: int
+    rng: random.Random
+
+    def __init__(
+        self, path: Path, spec: ImageSpec, log: BoundLogger, block_size: int
+    ):
+        self.path = path
+        self.spec = spec
+        self.log = log
+        self.block_size = block_size
+        self.rng = random.Random(spec.seed)
+        self._tmp = 0
+        self._store: Optional[Store] = None
+
+    @property
+    def image(self) -> Path:
+        image = self.path / "image"
+        if not image.exists():
+            self.log.info("generate-image", size=self.spec.size)
+            self.spec.write(image)
+        return image
+
+    @property
+    def store(self) -> Store:
+        """A store that contains the base revision."""
+        if self._store is None:
+            self._store = Store(self.path / "chunks", self.log)
+            with (
+                self.image.open("rb") as source,
+                File(self.path / "base", self._store, "wb") as target,
+            ):
+                while block := source.read(CHUNK_SIZE):
+                    target.write(block)
+            self._store.flush()
+        return self._store
+
+    @property
+    def base(self) -> Path:
+        """The mapping of a backup of the image in `store`."""
+        self.store
+        return self.path / "base"
+
+    def tmp(self) -> Path:
+        self._tmp += 1
+        path = self.path / f"tmp-{self._tmp}"
+        path.mkdir()
+        return path
+
+    def offsets(self, count: int) -> list[int]:
+        """Random, block aligned offsets in the image."""
+        blocks = max(self.spec.size // self.block_size, 1)
+        return [
+            self.rng.randrange(blocks) * self.block_size for _ in range(count)
+        ]
+
+    def diff(self, path: Path, changed: float = 0.25) -> None:
+        """Write an rbd diff that changes a share of the image.
+
+        Records have random lengths and do not start on chunk boundaries.
+        About every fourth record is a zero record.
+        """
+        size = self.spec.size
+        target = int(size * changed)
+        with path.open("wb") as f:
+            f.write(RBDDiffV1.header)
+            f.write(b"s" + struct.pack("<Q", size))
+            offset = self.rng.randrange(CHUNK_SIZE)
+            changed_bytes = 0
+            while changed_bytes < target and offset < size:
+                length = min(
+                    self.rng.randrange(1, 2 * CHUNK_SIZE), size - offset
+                )
+                if self.rng.random() < 0.25:
+                    f.write(b"z" + struct.pack("<QQ", offset, length))
+                else:
+                    f.write(b"w" + struct.pack("<QQ", offset, length))
+                    f.write(self.rng.randbytes(length))
+                changed_bytes += length
+                # Leave gaps, but also adjacent records.
+                offset += length + self.rng.choice([0, 0, self.block_size])
+            f.write(b"e")
+
+
+Benchmark = Callable[[Environment, Timer], None]
+
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    def register(f: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = f
+        return f
+
+    return register
+
+
+@benchmark("chunk-write")
+def chunk_write(env: Environment, timer: Timer) -> None:
+    """Chunk.write and Chunk.flush of full chunks into an empty store."""
+    store = Store(env.tmp() / "chunks", env.log)
+    with env.image.open("rb") as f:
+        while block := f.read(CHUNK_SIZE):
+            with timer:
+                chunk = Chunk(store, None)
+                chunk.write(0, block)
+                chunk.flush()
+            timer.bytes += len(block)
+            timer.ops += 1
+    store.flush()
+
+
+@benchmark("chunk-read")
+def chunk_read(env: Environment, timer: Timer) -> None:
+    """Chunk._read_existing: read, decompress and verify stored chunks."""
+    with File(env.base, env.store, "rb") as f:
+        hashes = f._mapping.hashes()
+    with timer:
+        for hash in hashes:
+            chunk = Chunk(env.store, hash)
+            chunk._read_existing()
+            assert chunk.data
+            timer.bytes += len(chunk.data.getbuffer())
+            timer.ops += 1
+
+
+@benchmark("file-write-seq")
+def file_write_seq(env: Environment, timer: Timer) -> None:
+    """File.write of the whole image into an empty store."""
+    store = Store(env.tmp() / "chunks", env.log)
+    target = File(env.path / "write-seq", store, "wb")
+    with env.image.open("rb") as f:
+        while block := f.read(env.block_size):
+            with timer:
+                target.write(block)
+            timer.bytes += len(block)
+            timer.ops += 1
+    with timer:
+        target.close()
+
+
+@benchmark("file-write-random")
+def file_write_random(env: Environment, timer: Timer) -> None:
+    """File.write of random blocks on top of the base revision."""
+    path = env.tmp() / "revision"
+    shutil.copy(env.base, path)
+    count = max(env.spec.size // env.block_size // 4, 1)
+    writes = [
+        (offset, env.rng.randbytes(env.block_size))
+        for offset in env.offsets(count)
+    ]
+    with timer:
+        with File(path, env.store, "r+b") as target:
+            for offset, data in writes:
+                target.seek(offset)
+                target.write(data)
+    timer.bytes = count * env.block_size
+    timer.ops = count
+
+
+@benchmark("file-read-seq")
+def file_read_seq(env: Environment, timer: Timer) -> None:
+    """File.read of the whole base revision."""
+    with timer:
+        with File(env.base, env.store, "rb") as f:
+            while block := f.read(env.block_size):
+                timer.bytes += len(block)
+                timer.ops += 1
+
+
+@benchmark("file-read-random")
+def file_read_random(env: Environment, timer: Timer) -> None:
+    """File.read of random blocks of the base revision."""
+    offsets = env.offsets(max(env.spec.size // env.block_size // 4, 1))
+    with timer:
+        with File(env.base, env.store, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                timer.bytes += len(f.read(env.block_size))
+                timer.ops += 1
+
+
+@benchmark("diff-integrate")
+def diff_integrate(env: Environment, timer: Timer) -> None:
+    """RBDDiffV1.integrate of a synthetic diff on top of the base revision."""
+    tmp = env.tmp()
+    diff = tmp / "diff"
+    env.diff(diff)
+    path = tmp / "revision"
+    shutil.copy(env.base, path)
+    with timer:
+        with File(path, env.store, "r+b") as target:
+            with open(diff, "rb") as f:
+                timer.bytes = RBDDiffV1(f).integrate(target, None, None)
+    timer.ops = 1
+
+
+@benchmark("store-purge")
+def store_purge(env: Environment, timer: Timer) -> None:
+    """Store.purge of a store where half of the chunks are unused."""
+    store = Store(env.tmp() / "chunks", env.log)
+    used: set[str] = set()
+    for i, block in enumerate(env.spec.blocks()):
+        chunk = Chunk(store, None)
+        chunk.write(0, block)
+        hash = chunk.flush()
+        # Make every other chunk unique so that there is something to purge.
+        if i % 2:
+            chunk = Chunk(store, None)
+            chunk.write(0, block[:-8] + struct.pack("<Q", i))
+            chunk.flush()
+        if hash is not None:
+            used.add(hash)
+    store.flush()
+    count = len(list(store.ls()))
+    with timer:
+        store.purge(used)
+    timer.ops = count - len(used)
+
+
+@benchmark("rbd-verify")
+def rbd_verify(env: Environment, timer: Timer) -> None:
+    """RBDSource.verify of a backup of the image, including the gc."""
+    schedule = Schedule()
+    schedule.configure({"daily": {"interval": "1d", "keep": 5}})
+    repository = Repository(env.tmp(), schedule, env.log)
+    repository.connect()
+    source = RBDSource(repository, CephRBD("bench", "bench", env.log), env.log)
+    revision = Revision.create(repository, {"daily"}, env.log)
+    revision.materialize()
+    with (
+        env.image.open("rb") as f,
+        source.open(revision, "wb") as target,
+    ):
+        while block := f.read(CHUNK_SIZE):
+            target.write(block)
+    source.store.flush()
+    timer.bytes = env.spec.size
+    with timer:
+        source.verify(revision)
+    timer.ops = 1
+
+
+def run(
+    path: Path,
+    spec: ImageSpec,
+    names: list[str],
+    repeat: int,
+    block_size: int,
+    log: BoundLogger,
+) -> dict:
+    """Run benchmarks and return the results as a JSON-able document."""
+    env = Environment(path, spec, log, block_size)
+    results = []
+    for name in names:
+        result = Result(name)
+        for _ in range(repeat):
+            timer = Timer()
+            BENCHMARKS[name](env, timer)
+            result.runs.append(timer.seconds)
+            result.bytes = timer.bytes
+            result.ops = timer.ops
+        log.info(
+            "benchmark-finished",
+            benchmark=name,
+            seconds=round(result.seconds, 3),
+            ops=result.ops,
+            throughput=humanize.naturalsize(result.throughput, binary=True)
+            + "/s",
+        )
+        results.append(result.to_dict())
+    try:
+        backy_version = version("backy")
+    except PackageNotFoundError:  # pragma: no cover
+        backy_version = "unknown"
+    return dict(
+        format=FORMAT,
+        backy=backy_version,
+        python=platform.python_version(),
+        machine=platform.machine(),
+        created=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        spec=asdict(spec),
+        block_size=block_size,
+        results=results,
+    )
+
+
+def compare(old: dict, new: dict, threshold: float) -> list[dict]:
+    """Compare the best times of two runs.
+
+    `change` is the relative change of the time taken, i.e. positive values
+    are slowdowns. Benchmarks that are slower than `threshold` are marked as
+    regressions.
+    """
+    old_results = {r["name"]: r for r in old["results"]}
+    comparison = []
+    for result in new["results"]:
+        name = result["name"]
+        if name not in old_results or not old_results[name]["seconds"]:
+            continue
+        change = result["seconds"] / old_results[name]["seconds"] - 1
+        comparison.append(
+            dict(
+                name=name,
+                old=old_results[name]["seconds"],
+                new=result["seconds"],
+                change=change,
+                regression=change > threshold,
+            )
+        )
+    return comparison
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="backy-bench",
+        description="Benchmark the chunked store on synthetic images.",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="verbose output"
+    )
+    subparsers = parser.add_subparsers()
+
+    # LIST
+    p = subparsers.add_parser("list", help="List the available benchmarks")
+    p.set_defaults(func="list")
+
+    # RUN
+    p = subparsers.add_parser("run", help="Run benchmarks")
+    p.add_argument(
+        "benchmarks",
+        nargs="*",
+        metavar="<benchmark>",
+        help="benchmarks to run (default: all)",
+    )
+    p.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="write the results to this file instead of stdout",
+    )
+    p.add_argument(
+        "--workdir",
+        type=Path,
+        help="create the scratch directory in this directory "
+        "(default: system temporary directory)",
+    )
+    p.add_argument(
+        "--size",
+        type=parse_size,
+        default=ImageSpec.size,
+        help="size of the image (default: 256MiB)",
+    )
+    p.add_argument(
+        "--dedup",
+        type=float,
+        default=ImageSpec.dedup,
+        help="share of chunks that are duplicates (default: %(default)s)",
+    )
+    p.add_argument(
+        "--compressibility",
+        type=float,
+        default=ImageSpec.compressibility,
+        help="share of each chunk that is zeroes (default: %(default)s)",
+    )
+    p.add_argument(
+        "--seed",
+        type=int,
+        default=ImageSpec.seed,
+        help="(default: %(default)s)",
+    )
+    p.add_argument(
+        "--block-size",
+        type=parse_size,
+        default=64 * kiB,
+        help="size of reads and writes on files (default: 64KiB)",
+    )
+    p.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="runs per benchmark, the best one counts (default: %(default)s)",
+    )
+    p.set_defaults(func="run")
+
+    # COMPARE
+    p = subparsers.add_parser("compare", help="Compare the results of two runs")
+    p.add_argument("old", type=Path, help="results of the baseline")
+    p.add_argument("new", type=Path, help="results to compare")
+    p.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown that counts as a regression "
+        "(default: %(default)s)",
+    )
+    p.set_defaults(func="compare")
+
+    args = parser.parse_args(argv)
+    if not hasattr(args, "func"):
+        parser.print_usage()
+        return 0
+
+    logging.init_logging(args.verbose)
+    log = structlog.stdlib.get_logger(subsystem="bench")
+
+    match args.func:
+        case "list":
+            for name, f in BENCHMARKS.items():
+                print(f"{name:<20} {f.__doc__}")
+        case "run":
+            names = args.benchmarks or list(BENCHMARKS)
+            unknown = set(names) - set(BENCHMARKS)
+            if unknown:
+                parser.error(
+                    "unknown benchmarks: " + ", ".join(sorted(unknown))
+                )
+            spec = ImageSpec(
+                args.size, args.dedup, args.compressibility, args.seed
+            )
+            with tempfile.TemporaryDirectory(dir=args.workdir) as path:
+                results = run(
+                    Path(path), spec, names, args.repeat, args.block_size, log
+                )
+            output = json.dumps(results, indent=2)
+            if args.output:
+                args.output.write_text(output + "\n")
+            else:
+                print(output)
+        case "compare":
+            old = json.loads(args.old.read_text())
+            new = json.loads(args.new.read_text())
+            comparison = compare(old, new, args.threshold)
+            t = Table(
+                "Benchmark",
+                Column(old["backy"], justify="right"),
+                Column(new["backy"], justify="right"),
+                Column("Change", justify="right"),
+            )
+            for c in comparison:
+                change = f"{c['change']:+.1%}"
+                if c["regression"]:
+                    change = f"[red]{change}[/]"
+                t.add_row(
+                    c["name"], f"{c['old']:.3f}s", f"{c['new']:.3f}s", change
+                )
+            rprint(t)
+            if any(c["regression"] for c in comparison):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
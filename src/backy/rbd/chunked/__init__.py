@@ -12,8 +12,12 @@ class InconsistentHash(BackendException):
         self.expected = expected
         self.actual = actual
 
+    def __reduce__(self):
+        # Allow passing this from worker processes.
+        return (self.__class__, (self.expected, self.actual))
 
-from .chunk import Chunk
+
+from .chunk import ZERO_HASH, Chunk
 from .file import File
 from .store import Store
 
@@ -22,6 +26,7 @@ __all__ = [
     "File",
     "Store",
     "Hash",
+    "ZERO_HASH",
     "BackendException",
     "InconsistentHash",
 ]
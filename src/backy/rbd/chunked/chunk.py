@@ -2,6 +2,8 @@ import binascii
 import io
 import os
 import tempfile
+import threading
+import time
 from typing import TYPE_CHECKING, Optional, Tuple
 
 import lzo
@@ -14,6 +16,8 @@ from . import BackendException, Hash, InconsistentHash
 if TYPE_CHECKING:
     from .store import Store
 
+_stats_lock = threading.Lock()
+
 
 class Chunk(object):
     """A chunk in a file that represents a part of it.
@@ -46,21 +50,10 @@ class Chunk(object):
         # Prepare working with the chunk. We keep the data in RAM for
         # easier random access combined with transparent compression.
         data = b""
-        if self.hash:
-            chunk_file = self.store.chunk_path(self.hash)
-            try:
-                with open(chunk_file, "rb") as f:
-                    posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)  # type: ignore
-                    data = f.read()
-                    data = lzo.decompress(data)
-            except (lzo.error, IOError) as e:
-                raise BackendException from e
-
-            disk_hash = hash(data)
-            # This is a safety belt. Hashing is sufficiently fast to avoid
-            # us accidentally reading garbage.
-            if disk_hash != self.hash:
-                raise InconsistentHash(self.hash, disk_hash)
+        if self.hash == ZERO_HASH:
+            data = bytes(self.CHUNK_SIZE)
+        elif self.hash:
+            data = read_chunk(self.store.chunk_path(self.hash), self.hash)
         self._init_data(data)
 
     def _init_data(self, data: bytes) -> None:
@@ -71,6 +64,12 @@ class Chunk(object):
 
         Return the data and the remaining size that should be read.
         """
+        if self.data is None and self.hash == ZERO_HASH:
+            # Serve zeroes without materialising the chunk.
+            available = max(0, self.CHUNK_SIZE - offset)
+            length = available if size == -1 else min(size, available)
+            remaining = -1 if size == -1 else size - length
+            return bytes(length), remaining
         self._read_existing()
         assert self.data
 
@@ -110,32 +109,76 @@ class Chunk(object):
     def flush(self) -> Optional[Hash]:
         """Writes data to disk if necessary
         Returns the new Hash on updates
+
+        This may be called from a worker thread (see `File.flush_workers`)
+        and thus must not touch any state other than this chunk's and the
+        store's `seen` set and index.
         """
         if self.clean:
             return None
         assert self.data
         # I'm not using read() here to a) avoid cache accounting and b)
         # use a faster path to get the data.
+        started = time.perf_counter()
         self.hash = hash(self.data.getvalue())
+        hashed = time.perf_counter()
+        self._account("hash_time", hashed - started)
         target = self.store.chunk_path(self.hash)
         if self.hash not in self.store.seen:
-            if self.store.force_writes or not target.exists():
+            if self.store.force_writes or self.hash not in self.store.index:
+                data = lzo.compress(self.data.getvalue())
+                compressed = time.perf_counter()
+                self._account("compress_time", compressed - hashed)
                 # Create the tempfile in the right directory to increase
                 # locality of our change - avoid renaming between multiple
                 # directories to reduce traffic on the directory nodes.
                 fd, tmpfile_name = tempfile.mkstemp(dir=target.parent)
                 posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)  # type: ignore
                 with os.fdopen(fd, mode="wb") as f:
-                    data = lzo.compress(self.data.getvalue())
                     f.write(data)
                 # Micro-optimization: chmod before rename to help against
                 # metadata flushes and then changing metadata again.
                 os.chmod(tmpfile_name, 0o440)
                 os.rename(tmpfile_name, target)
+                self.store.index.add(self.hash)
+                self._account("store_time", time.perf_counter() - compressed)
             self.store.seen.add(self.hash)
         self.clean = True
         return self.hash
 
+    def _account(self, key: str, duration: float) -> None:
+        # Multiple chunks share one stats dict and may be flushed
+        # concurrently.
+        with _stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + duration
+
 
 def hash(data: bytes) -> Hash:
     return binascii.hexlify(mmh3.hash_bytes(data)).decode("ascii")
+
+
+def read_chunk(path: "os.PathLike | str", expected: Hash) -> bytes:
+    """Read, decompress and verify a chunk file.
+
+    This does not need a store and can thus be used in worker processes.
+    """
+    try:
+        with open(path, "rb") as f:
+            posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)  # type: ignore
+            data = f.read()
+            data = lzo.decompress(data)
+    except (lzo.error, IOError) as e:
+        raise BackendException from e
+
+    disk_hash = hash(data)
+    # This is a safety belt. Hashing is sufficiently fast to avoid
+    # us accidentally reading garbage.
+    if disk_hash != expected:
+        raise InconsistentHash(expected, disk_hash)
+    return data
+
+
+# The hash of a chunk that consists of zeroes only. Chunks mapped to this hash
+# are never read from disk. The store still keeps the chunk file so that other
+# readers of the mapping (e.g. backy-extract) do not need to know about this.
+ZERO_HASH: Hash = "c72b4ba82d1f51b71c8a18195ad33fc8"
@@ -1,12 +1,14 @@
 import io
-import json
 import os
 import os.path
 import time
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from typing import TYPE_CHECKING, Optional, Tuple
 
-from .chunk import Chunk, Hash
+from . import mapping
+from .chunk import ZERO_HASH, Chunk, Hash
+from .mapping import ChunkMapping
 
 if TYPE_CHECKING:
     from backy.rbd.chunked import Store
@@ -31,6 +33,17 @@ class File(object):
     """
 
     flush_target = 10
+    # Evicted chunks are hashed, compressed and stored by a pool of worker
+    # threads so that this work does not stall reading the source. lzo
+    # releases the GIL while compressing, which is where most of the time is
+    # spent. Set to 0 to flush synchronously.
+    flush_workers = min(4, os.cpu_count() or 1)
+    # Backpressure: the maximum number of evicted chunks waiting to be
+    # stored. Memory is capped at (2 * flush_target + flush_queue) chunks.
+    flush_queue = 8
+    # Number of worker threads loading, decompressing and verifying chunks
+    # ahead of sequential reads (see `readahead`).
+    readahead_workers = min(4, os.cpu_count() or 1)
 
     name: str
     store: "Store"
@@ -38,11 +51,16 @@ class File(object):
     closed: bool
     size: int
     mode: str
+    readahead: int
 
     _position: int
     _access_stats: dict[int, Tuple[int, float]]  # (count, last)
-    _mapping: dict[int, Hash]
+    _mapping: ChunkMapping
     _chunks: dict[int, Chunk]
+    _pending: dict[int, Tuple[Chunk, Future]]
+    _executor: Optional[ThreadPoolExecutor]
+    _prefetched: dict[int, Future]
+    _readahead_executor: Optional[ThreadPoolExecutor]
 
     def __init__(
         self,
@@ -50,6 +68,7 @@ class File(object):
         store: "Store",
         mode: str = "rw",
         stats: Optional[dict] = None,
+        readahead: int = 0,
     ):
         self.name = str(name)
         self.store = store
@@ -73,28 +92,28 @@ class File(object):
             raise FileNotFoundError("File not found: {}".format(self.name))
 
         if not os.path.exists(name):
-            self._mapping = {}
+            self._mapping = ChunkMapping()
             self.size = 0
         else:
-            # The mapping stores its chunk IDs as strings, because JSON can't
-            # have ints as keys. We convert them explicitly back to integers
-            # because we keep computing with them.
-            with open(self.name, "r") as f:
-                # Safeguard: Make sure the file looks like json.
-                if f.read(2) != '{"':
-                    raise ValueError(
-                        "Revision does not look like it's chunked."
-                    )
-                f.seek(0)
-                meta = json.load(f)
-                self._mapping = {int(k): v for k, v in meta["mapping"].items()}
-                self.size = meta["size"]
+            # Read-only files memory-map their mapping instead of parsing it.
+            self._mapping, self.size = mapping.load(
+                self.name, writable="w" in self.mode
+            )
 
         if "a" in self.mode:
             self._position = self.size
 
         # Chunks that we are working on.
         self._chunks = {}
+        # Chunks that have been evicted and are being flushed in the
+        # background.
+        self._pending = {}
+        self._executor = None
+        # Read-only files load up to `readahead` chunks following the
+        # current one in the background. This bounds the extra memory used.
+        self.readahead = readahead if "w" not in self.mode else 0
+        self._prefetched = {}
+        self._readahead_executor = None
 
     def fileno(self) -> int:
         raise OSError(
@@ -112,27 +131,74 @@ class File(object):
         keep_chunks = chunks[:target]
         remove_chunks = chunks[target:]
 
+        self._chunks = dict(keep_chunks)
+
         for id, chunk in remove_chunks:
-            hash = chunk.flush()
-            if hash:
-                self._mapping[id] = hash
+            if chunk.clean:
+                continue
+            if not self.flush_workers:
+                self._update_mapping(id, chunk.flush())
+                continue
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.flush_workers, thread_name_prefix="chunk-flush"
+                )
+            while len(self._pending) >= self.flush_queue:
+                self._wait_pending(FIRST_COMPLETED)
+            self._pending[id] = (chunk, self._executor.submit(chunk.flush))
 
-        self._chunks = dict(keep_chunks)
+        if not target:
+            self._wait_pending()
+
+    def _wait_pending(self, return_when: str = "ALL_COMPLETED") -> None:
+        """Wait for background flushes and record their hashes."""
+        if not self._pending:
+            return
+        started = time.perf_counter()
+        done, _ = wait(
+            [f for _, f in self._pending.values()], return_when=return_when
+        )
+        self.stats.setdefault("flush_wait_time", 0)
+        self.stats["flush_wait_time"] += time.perf_counter() - started
+        for id, (_, future) in list(self._pending.items()):
+            if future in done:
+                del self._pending[id]
+                self._update_mapping(id, future.result())
+
+    def _reclaim_pending(self, id: int) -> Optional[Chunk]:
+        """Take back a chunk that is being flushed in the background."""
+        if id not in self._pending:
+            return None
+        chunk, future = self._pending.pop(id)
+        self._update_mapping(id, future.result())
+        return chunk
+
+    def _update_mapping(self, id: int, hash: Optional[Hash]) -> None:
+        if hash:
+            self._mapping[id] = hash
 
     def flush(self) -> None:
         assert "w" in self.mode and not self.closed
 
+        # This is the durability barrier: all chunks have been stored
+        # before the mapping referring to them is written.
         self._flush_chunks(0)
+        self.store.flush()
 
-        with open(self.name, "w") as f:
-            json.dump({"mapping": self._mapping, "size": self.size}, f)
-            f.flush()
-            os.fsync(f)
+        mapping.dump(self.name, self._mapping, self.size)
 
     def close(self) -> None:
         assert not self.closed
         if "w" in self.mode:
             self.flush()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._readahead_executor is not None:
+            self._readahead_executor.shutdown(cancel_futures=True)
+            self._readahead_executor = None
+        self._prefetched.clear()
+        self._mapping.close()
         self.closed = True
 
     def isatty(self) -> bool:
@@ -176,6 +242,8 @@ class File(object):
         assert "w" in self.mode and not self.closed
         if target is None:
             target = self._position
+        # Background flushes must not re-add chunks that we remove here.
+        self._wait_pending()
         # Remove chunks past the size
         to_remove = set(
             key
@@ -186,31 +254,14 @@ class File(object):
             self._mapping.pop(key, None)
             self._chunks.pop(key, None)
 
-        # Fill up the missing parts with zeroes.
+        # Fill up the missing parts with zeroes. We fill up to the end of the
+        # last chunk so that all new chunks can be mapped to the zero chunk.
         orig_pos = self._position
         self._position = self.size
 
         if target > self._position:
-            # fill first chunk
-            data = min(target - self._position, Chunk.CHUNK_SIZE) * b"\00"
-            chunk, _, offset = self._current_chunk()
-            written, _ = chunk.write(offset, data)
-            self._position += written
-
-        if target > self._position:
-            chunk, chunk_id, offset = self._current_chunk()
-            assert offset == 0
-            written, _ = chunk.write(offset, Chunk.CHUNK_SIZE * b"\00")
-            assert written == Chunk.CHUNK_SIZE
-            self._position += Chunk.CHUNK_SIZE
-            empty_chunk_hash = chunk.flush()
-            assert empty_chunk_hash
-            self._mapping[chunk_id] = empty_chunk_hash
-
-            while target > self._position:
-                chunk_id = self._position // Chunk.CHUNK_SIZE
-                self._mapping[chunk_id] = empty_chunk_hash
-                self._position += Chunk.CHUNK_SIZE
+            end = -(-target // Chunk.CHUNK_SIZE) * Chunk.CHUNK_SIZE
+            self._write_zeroes(end - self._position)
 
         # Filling up should have caused our position to have moved properly.
         # Note that we will always fill full chunks. This is safe as data after
@@ -229,6 +280,8 @@ class File(object):
             size = min([size, max_size])
         while size:
             chunk, id, offset = self._current_chunk()
+            if self.readahead:
+                self._prefetch(id + 1)
             data, size = chunk.read(offset, size)
             if not data:
                 raise ValueError(
@@ -236,8 +289,51 @@ class File(object):
                 )
             self._position += len(data)
             result.write(data)
+        self.stats.setdefault("bytes_read", 0)
+        self.stats["bytes_read"] += result.tell()
         return result.getvalue()
 
+    def _prefetch(self, start: int) -> None:
+        """Load the chunks following `start` in the background."""
+        end = min(
+            start + self.readahead,
+            -(-self.size // Chunk.CHUNK_SIZE),
+        )
+        # Drop what we loaded for a different position.
+        for id in list(self._prefetched):
+            if not start <= id < end:
+                self._prefetched.pop(id).cancel()
+        for id in range(start, end):
+            if id in self._chunks or id in self._prefetched:
+                continue
+            hash = self._mapping.get(id)
+            if hash is None or hash == ZERO_HASH:
+                continue
+            if self._readahead_executor is None:
+                self._readahead_executor = ThreadPoolExecutor(
+                    self.readahead_workers, thread_name_prefix="chunk-read"
+                )
+            self._prefetched[id] = self._readahead_executor.submit(
+                self._load_chunk, hash
+            )
+
+    def _load_chunk(self, hash: Hash) -> Chunk:
+        chunk = Chunk(
+            self.store, hash, self.stats.setdefault("chunk_stats", dict())
+        )
+        chunk._read_existing()
+        return chunk
+
+    def _claim_prefetched(self, id: int) -> Optional[Chunk]:
+        if id not in self._prefetched:
+            return None
+        future = self._prefetched.pop(id)
+        started = time.perf_counter()
+        chunk = future.result()
+        self.stats.setdefault("readahead_wait_time", 0)
+        self.stats["readahead_wait_time"] += time.perf_counter() - started
+        return chunk
+
     def writable(self) -> bool:
         return "w" in self.mode and not self.closed
 
@@ -252,16 +348,56 @@ class File(object):
             if self._position > self.size:
                 self.size = self._position
 
+    def write_zeroes(self, size: int) -> None:
+        """Write `size` zero bytes without allocating them.
+
+        Chunks that are covered completely are mapped to the zero chunk
+        instead of being hashed, compressed and stored.
+        """
+        assert "w" in self.mode and not self.closed
+        self.stats.setdefault("bytes_written", 0)
+        self.stats["bytes_written"] += size
+        self._write_zeroes(size)
+
+    def _write_zeroes(self, size: int) -> None:
+        end = self._position + size
+        while self._position < end:
+            offset = self._position % Chunk.CHUNK_SIZE
+            length = min(end - self._position, Chunk.CHUNK_SIZE - offset)
+            if length == Chunk.CHUNK_SIZE:
+                self._map_zero_chunk(self._position // Chunk.CHUNK_SIZE)
+            else:
+                chunk, _, offset = self._current_chunk()
+                chunk.write(offset, bytes(length))
+            self._position += length
+            if self._position > self.size:
+                self.size = self._position
+
+    def _map_zero_chunk(self, chunk_id: int) -> None:
+        # Whatever we had for this chunk is replaced completely.
+        self._chunks.pop(chunk_id, None)
+        self._reclaim_pending(chunk_id)
+        self.store.ensure_zero_chunk()
+        self._mapping[chunk_id] = ZERO_HASH
+        chunk_stats = self.stats.setdefault("chunk_stats", dict())
+        chunk_stats.setdefault("write_zero", 0)
+        chunk_stats["write_zero"] += 1
+
     def _current_chunk(self) -> Tuple[Chunk, int, int]:
         chunk_id = self._position // Chunk.CHUNK_SIZE
         offset = self._position % Chunk.CHUNK_SIZE
         if chunk_id not in self._chunks:
             self._flush_chunks()
-            self._chunks[chunk_id] = Chunk(
-                self.store,
-                self._mapping.get(chunk_id),
-                self.stats.setdefault("chunk_stats", dict()),
-            )
+            chunk = self._reclaim_pending(chunk_id)
+            if chunk is None:
+                chunk = self._claim_prefetched(chunk_id)
+            if chunk is None:
+                chunk = Chunk(
+                    self.store,
+                    self._mapping.get(chunk_id),
+                    self.stats.setdefault("chunk_stats", dict()),
+                )
+            self._chunks[chunk_id] = chunk
         count = self._access_stats[chunk_id][0]
         self._access_stats[chunk_id] = (count + 1, time.time())
         return self._chunks[chunk_id], chunk_id, offset
@@ -0,0 +1,149 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from . import Hash
+
+
+class ChunkIndex(object):
+    """A persistent index of the chunks that are present in a store.
+
+    This avoids globbing and stat'ing the chunk directories whenever we
+    need to know whether a chunk exists.
+
+    The index only ever lags behind the disk: chunks are added after they
+    have been renamed into place and removed before they are unlinked. A
+    crash may thus leave chunk files that are not indexed (which wastes
+    space until the index is repaired) but the index never claims a chunk
+    that does not exist (which would lose data on the next backup).
+
+    The index is safe to use from multiple threads and processes.
+
+    """
+
+    # Number of additions after which we commit automatically. This bounds
+    # the amount of work lost on a crash and the time we block other
+    # writers.
+    commit_interval = 1000
+
+    # Number of hashes fetched at once when iterating.
+    batch_size = 10000
+
+    path: Path
+    _db: sqlite3.Connection
+    _lock: threading.Lock
+    _uncommitted: int
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS chunks "
+                "(hash BLOB PRIMARY KEY) WITHOUT ROWID"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS meta "
+                "(key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._db.commit()
+
+    @property
+    def complete(self) -> bool:
+        """Whether the index has been fully populated from disk once."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM meta WHERE key = 'complete'"
+            ).fetchone()
+        return row is not None and row[0] == "1"
+
+    def __contains__(self, hash: Hash) -> bool:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM chunks WHERE hash = ?", (bytes.fromhex(hash),)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM chunks").fetchone()[0]
+
+    def __iter__(self) -> Iterator[Hash]:
+        # Page through the index instead of keeping a cursor open. This
+        # allows modifying the index while iterating.
+        last = b""
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT hash FROM chunks WHERE hash > ? "
+                    "ORDER BY hash LIMIT ?",
+                    (last, self.batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for (hash,) in rows:
+                yield hash.hex()
+            last = rows[-1][0]
+
+    def add(self, hash: Hash) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO chunks VALUES (?)",
+                (bytes.fromhex(hash),),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_interval:
+                self._commit()
+
+    def update(self, hashes: Iterable[Hash]) -> None:
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO chunks VALUES (?)",
+                ((bytes.fromhex(h),) for h in hashes),
+            )
+            self._commit()
+
+    def discard(self, hashes: Iterable[Hash]) -> None:
+        with self._lock:
+            self._db.executemany(
+                "DELETE FROM chunks WHERE hash = ?",
+                ((bytes.fromhex(h),) for h in hashes),
+            )
+            self._commit()
+
+    def replace(self, hashes: Iterable[Hash]) -> None:
+        """Atomically replace the index content and mark it complete."""
+        with self._lock:
+            self._db.commit()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM chunks")
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO chunks VALUES (?)",
+                    ((bytes.fromhex(h),) for h in hashes),
+                )
+                self._db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('complete', '1')"
+                )
+            except BaseException:
+                self._db.rollback()
+                raise
+            self._commit()
+
+    def commit(self) -> None:
+        with self._lock:
+            self._commit()
+
+    def _commit(self) -> None:
+        self._db.commit()
+        self._uncommitted = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._commit()
+            self._db.close()
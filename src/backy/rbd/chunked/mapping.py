@@ -0,0 +1,178 @@
+import json
+import mmap
+import os
+import struct
+from collections.abc import MutableMapping
+from typing import IO, Iterator, Optional, Tuple
+
+from backy.utils import SafeFile
+
+from .chunk import Chunk, Hash
+
+# The binary mapping format (version 1):
+#
+#   magic (8 bytes), version, size, chunk size (unsigned 64 bit each, LE)
+#   one 16 byte digest per chunk, in chunk order
+#
+# Missing chunks are stored as an all-zero digest.
+#
+# The legacy format is a JSON object: {"mapping": {"<id>": "<hash>", ...},
+# "size": <size>}.
+MAGIC = b"BACKYMAP"
+VERSION = 1
+HEADER = struct.Struct("<8sQQQ")
+DIGEST_SIZE = 16
+_MISSING = bytes(DIGEST_SIZE)
+
+
+class ChunkMapping(MutableMapping[int, Hash]):
+    """A mapping of chunk ids to hashes, stored as a dense array of digests.
+
+    Read-only mappings may be backed by a memory map of the revision file.
+    The data is copied on the first modification.
+
+    """
+
+    _digests: bytearray | memoryview
+    _mmap: Optional[mmap.mmap]
+
+    def __init__(self, digests: bytearray | memoryview | None = None):
+        if digests is None:
+            digests = bytearray()
+        if len(digests) % DIGEST_SIZE:
+            raise ValueError("Mapping is truncated.")
+        self._digests = digests
+        self._mmap = None
+
+    @classmethod
+    def from_mmap(cls, f: IO, offset: int) -> "ChunkMapping":
+        if os.fstat(f.fileno()).st_size <= offset:
+            return cls()
+        map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mapping = cls(memoryview(map)[offset:])
+        mapping._mmap = map
+        return mapping
+
+    def _digest(self, id: int) -> bytes:
+        if id < 0:
+            raise KeyError(id)
+        digest = bytes(self._digests[id * DIGEST_SIZE : (id + 1) * DIGEST_SIZE])
+        if not digest or digest == _MISSING:
+            raise KeyError(id)
+        return digest
+
+    def _make_writable(self) -> bytearray:
+        if not isinstance(self._digests, bytearray):
+            digests = bytearray(self._digests)
+            self.close()
+            self._digests = digests
+        return self._digests
+
+    def __getitem__(self, id: int) -> Hash:
+        return self._digest(id).hex()
+
+    def __setitem__(self, id: int, hash: Hash) -> None:
+        if id < 0:
+            raise KeyError(id)
+        digests = self._make_writable()
+        end = (id + 1) * DIGEST_SIZE
+        if end > len(digests):
+            digests.extend(bytes(end - len(digests)))
+        digests[end - DIGEST_SIZE : end] = bytes.fromhex(hash)
+
+    def __delitem__(self, id: int) -> None:
+        self._digest(id)
+        digests = self._make_writable()
+        digests[id * DIGEST_SIZE : (id + 1) * DIGEST_SIZE] = _MISSING
+        # Keep the array dense: drop missing chunks at the end.
+        end = len(digests)
+        while end and digests[end - DIGEST_SIZE : end] == _MISSING:
+            end -= DIGEST_SIZE
+        del digests[end:]
+
+    def _entries(self) -> Iterator[Tuple[int, bytes]]:
+        digests = self._digests
+        for id in range(len(digests) // DIGEST_SIZE):
+            digest = bytes(digests[id * DIGEST_SIZE : (id + 1) * DIGEST_SIZE])
+            if digest != _MISSING:
+                yield id, digest
+
+    def __iter__(self) -> Iterator[int]:
+        for id, _ in self._entries():
+            yield id
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._entries())
+
+    def hashes(self) -> set[Hash]:
+        """Return the set of all hashes referenced by this mapping."""
+        return {digest.hex() for _, digest in self._entries()}
+
+    def tobytes(self) -> bytes:
+        return bytes(self._digests)
+
+    def close(self) -> None:
+        if self._mmap is None:
+            return
+        # The memoryview must be released before closing the map.
+        assert isinstance(self._digests, memoryview)
+        self._digests.release()
+        self._digests = bytearray()
+        self._mmap.close()
+        self._mmap = None
+
+
+def is_legacy(path: str | os.PathLike) -> bool:
+    with open(path, "rb") as f:
+        return f.read(2) == b'{"'
+
+
+def load(
+    path: str | os.PathLike, writable: bool = True
+) -> Tuple[ChunkMapping, int]:
+    """Load a mapping and the file size from a revision file.
+
+    Read-only mappings in the binary format are memory-mapped.
+    """
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        # Safeguard: Make sure the file looks like a mapping.
+        if header.startswith(b'{"'):
+            f.seek(0)
+            meta = json.load(f)
+            # The mapping stores its chunk IDs as strings, because JSON
+            # can't have ints as keys.
+            mapping = ChunkMapping()
+            for k, v in meta["mapping"].items():
+                mapping[int(k)] = v
+            return mapping, meta["size"]
+        if len(header) < HEADER.size or not header.startswith(MAGIC):
+            raise ValueError("Revision does not look like it's chunked.")
+        _, version, size, chunk_size = HEADER.unpack(header)
+        if version != VERSION:
+            raise ValueError(f"Unsupported mapping version: {version}")
+        if chunk_size != Chunk.CHUNK_SIZE:
+            raise ValueError(f"Unsupported chunk size: {chunk_size}")
+        if writable:
+            return ChunkMapping(bytearray(f.read())), size
+        return ChunkMapping.from_mmap(f, HEADER.size), size
+
+
+def dump(path: str | os.PathLike, mapping: ChunkMapping, size: int) -> None:
+    """Write a mapping in the binary format, replacing `path` atomically."""
+    with SafeFile(path) as f:
+        f.open_new("wb")
+        f.write(HEADER.pack(MAGIC, VERSION, size, Chunk.CHUNK_SIZE))
+        f.write(mapping.tobytes())
+
+
+def convert(path: str | os.PathLike) -> bool:
+    """Convert a legacy JSON revision file to the binary format.
+
+    Returns whether the file needed converting.
+    """
+    if not is_legacy(path):
+        return False
+    mapping, size = load(path)
+    dump(path, mapping, size)
+    return True
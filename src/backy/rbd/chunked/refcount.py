@@ -0,0 +1,147 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from . import Hash
+
+
+class RefCount(object):
+    """Counts how many revisions refer to each chunk in a store.
+
+    Revisions are counted once, when their mapping has been written, and
+    uncounted once they are gone. Chunks whose count dropped to zero are
+    candidates for garbage collection.
+
+    Chunks that are not counted at all (e.g. written by a backup that
+    crashed before its mapping was written) are only found by a full audit.
+
+    """
+
+    path: Path
+    _db: sqlite3.Connection
+    _lock: threading.Lock
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS refs "
+                "(hash BLOB PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS revisions (uuid TEXT PRIMARY KEY)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS meta "
+                "(key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._db.commit()
+
+    @property
+    def last_audit(self) -> Optional[float]:
+        """The time of the last full audit, if any."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM meta WHERE key = 'last-audit'"
+            ).fetchone()
+        return float(row[0]) if row is not None else None
+
+    def revisions(self) -> set[str]:
+        """The uuids of all revisions that are counted."""
+        with self._lock:
+            rows = self._db.execute("SELECT uuid FROM revisions").fetchall()
+        return {uuid for (uuid,) in rows}
+
+    def __getitem__(self, hash: Hash) -> int:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT count FROM refs WHERE hash = ?", (bytes.fromhex(hash),)
+            ).fetchone()
+        return row[0] if row is not None else 0
+
+    def add(self, uuid: str, hashes: Iterable[Hash]) -> bool:
+        """Count the chunks of a revision.
+
+        `hashes` must not contain duplicates. Returns whether the revision
+        was counted, i.e. was not counted before.
+        """
+        with self._lock, self._transaction():
+            if not self._register(uuid):
+                return False
+            self._increment(hashes)
+        return True
+
+    def remove(self, uuid: str, hashes: Iterable[Hash]) -> bool:
+        """Uncount the chunks of a revision.
+
+        Returns whether the revision was uncounted, i.e. was counted before.
+        """
+        with self._lock, self._transaction():
+            cursor = self._db.execute(
+                "DELETE FROM revisions WHERE uuid = ?", (uuid,)
+            )
+            if not cursor.rowcount:
+                return False
+            self._db.executemany(
+                "UPDATE refs SET count = count - 1 WHERE hash = ?",
+                ((bytes.fromhex(h),) for h in hashes),
+            )
+        return True
+
+    def unreferenced(self) -> list[Hash]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT hash FROM refs WHERE count <= 0"
+            ).fetchall()
+        return [hash.hex() for (hash,) in rows]
+
+    def forget(self, hashes: Iterable[Hash]) -> None:
+        """Drop unreferenced chunks after they have been removed."""
+        with self._lock, self._transaction():
+            self._db.executemany(
+                "DELETE FROM refs WHERE hash = ? AND count <= 0",
+                ((bytes.fromhex(h),) for h in hashes),
+            )
+
+    def replace(self, revisions: Iterable[Tuple[str, Iterable[Hash]]]) -> None:
+        """Atomically recount from scratch and record the audit."""
+        with self._lock, self._transaction():
+            self._db.execute("DELETE FROM refs")
+            self._db.execute("DELETE FROM revisions")
+            for uuid, hashes in revisions:
+                if self._register(uuid):
+                    self._increment(hashes)
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('last-audit', ?)",
+                (str(time.time()),),
+            )
+
+    def _register(self, uuid: str) -> bool:
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO revisions VALUES (?)", (uuid,)
+        )
+        return bool(cursor.rowcount)
+
+    def _increment(self, hashes: Iterable[Hash]) -> None:
+        self._db.executemany(
+            "INSERT INTO refs VALUES (?, 1) "
+            "ON CONFLICT (hash) DO UPDATE SET count = count + 1",
+            ((bytes.fromhex(h),) for h in hashes),
+        )
+
+    def _transaction(self) -> sqlite3.Connection:
+        # Commits on success and rolls back on errors.
+        self._db.commit()
+        self._db.execute("BEGIN IMMEDIATE")
+        return self._db
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.commit()
+            self._db.close()
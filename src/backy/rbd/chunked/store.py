@@ -1,9 +1,12 @@
+import re
 from pathlib import Path
 from typing import Iterable, Set
 
 from structlog.stdlib import BoundLogger
 
-from backy.rbd.chunked.chunk import Hash
+from backy.rbd.chunked.chunk import ZERO_HASH, Chunk, Hash
+from backy.rbd.chunked.index import ChunkIndex
+from backy.rbd.chunked.refcount import RefCount
 
 # A chunkstore, is responsible for all revisions for a single backup, for now.
 # We can start having statistics later how much reuse between images is
@@ -15,6 +18,9 @@ def rreplace(str, old, new):
     return new.join(str.rsplit(old, 1))
 
 
+HASH_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
 class Store(object):
     # Signal that we should always override chunks that we want to write.
     # This can be used in the face of suspected inconsistencies while still
@@ -23,6 +29,8 @@ class Store(object):
 
     path: Path
     seen: set[Hash]
+    index: ChunkIndex
+    refs: RefCount
     log: BoundLogger
 
     def __init__(self, path: Path, log: BoundLogger):
@@ -36,6 +44,10 @@ class Store(object):
             self.convert_to_v2()
 
         self.seen = set()
+        self.index = ChunkIndex(self.path / "index.sqlite")
+        if not self.index.complete:
+            self.rebuild_index()
+        self.refs = RefCount(self.path / "refs.sqlite")
 
     def convert_to_v2(self) -> None:
         self.log.info("to-v2")
@@ -51,21 +63,107 @@ class Store(object):
             f.write(b"v2")
         self.log.info("to-v2-finished")
 
-    def ls(self) -> Iterable[Hash]:
-        # XXX this is fucking expensive
+    def scan(self) -> Iterable[Hash]:
+        """List the chunks on disk.
+
+        This is expensive for large stores. Use `ls()` instead unless you
+        need to check the index.
+        """
         for file in self.path.glob("*/*.chunk.lzo"):
-            yield file.name.removesuffix(".chunk.lzo")
+            hash = file.name.removesuffix(".chunk.lzo")
+            if not HASH_PATTERN.fullmatch(hash):
+                self.log.warning("scan-invalid-name", file=str(file))
+                continue
+            yield hash
+
+    def ls(self) -> Iterable[Hash]:
+        return iter(self.index)
+
+    def remove(self, hash: Hash) -> None:
+        self.index.discard([hash])
+        self.chunk_path(hash).unlink(missing_ok=True)
+        self.seen.discard(hash)
+
+    def ensure_zero_chunk(self) -> None:
+        """Make sure the chunk for `ZERO_HASH` exists on disk.
+
+        We never read it ourselves, but other readers of our mappings expect
+        every referenced chunk to exist.
+        """
+        if ZERO_HASH in self.seen:
+            return
+        if ZERO_HASH in self.index and not self.force_writes:
+            self.seen.add(ZERO_HASH)
+            return
+        chunk = Chunk(self, None)
+        chunk.write(0, bytes(Chunk.CHUNK_SIZE))
+        assert chunk.flush() == ZERO_HASH
+
+    def flush(self) -> None:
+        """Persist all chunks registered so far in the index."""
+        self.index.commit()
 
     def purge(self, used_chunks: Set[Hash]) -> None:
         # This assumes exclusive lock on the store. This is guaranteed by
         # backy's main locking.
         self.log.info("purge")
-        for file_hash in self.ls():
-            if file_hash in used_chunks:
-                continue
+        unused = [h for h in self.ls() if h not in used_chunks]
+        self._remove_chunks(unused)
+        self.log.info("purge-finished", removed=len(unused))
+
+    def purge_unreferenced(self) -> None:
+        """Remove the chunks that are no longer referenced by any revision.
+
+        This only looks at chunks whose reference count dropped to zero and
+        thus relies on all revisions being counted in `refs`.
+        """
+        self.log.info("purge-unreferenced")
+        unused = self.refs.unreferenced()
+        self._remove_chunks(unused)
+        self.refs.forget(unused)
+        self.log.info("purge-finished", removed=len(unused))
+
+    def _remove_chunks(self, hashes: list[Hash]) -> None:
+        # Remove from the index first: a crash must not leave index entries
+        # for chunks that are gone.
+        self.index.discard(hashes)
+        for file_hash in hashes:
             self.chunk_path(file_hash).unlink(missing_ok=True)
             self.seen.discard(file_hash)
 
+    def rebuild_index(self) -> None:
+        self.log.info("rebuild-index")
+        self.index.replace(self.scan())
+        self.log.info("index-rebuilt", chunks=len(self.index))
+
+    def check(self, repair: bool = False) -> bool:
+        """Compare the index with the chunks on disk.
+
+        Returns whether both are consistent. Optionally repairs the index.
+        """
+        on_disk = set(self.scan())
+        indexed = set(self.ls())
+        # Indexed chunks that do not exist will not be written again by
+        # new backups and are thus critical.
+        missing = indexed - on_disk
+        # Chunks that are not indexed will not be purged and only waste
+        # space.
+        unindexed = on_disk - indexed
+        self.log.info(
+            "check",
+            chunks=len(on_disk),
+            missing=len(missing),
+            unindexed=len(unindexed),
+        )
+        for hash in missing:
+            self.log.error("check-missing-chunk", chunk=hash)
+        if repair and (missing or unindexed):
+            self.index.discard(missing)
+            self.index.update(unindexed)
+            self.seen -= missing
+            self.log.info("check-repaired")
+        return not (missing or unindexed)
+
     def chunk_path(self, hash: Hash) -> Path:
         dir1 = hash[:2]
         extension = ".chunk.lzo"
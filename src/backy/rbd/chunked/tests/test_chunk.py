@@ -3,7 +3,7 @@ from unittest.mock import Mock
 import lzo
 import pytest
 
-from backy.rbd.chunked.chunk import Chunk, InconsistentHash, hash
+from backy.rbd.chunked.chunk import ZERO_HASH, Chunk, InconsistentHash, hash
 from backy.rbd.chunked.file import File
 from backy.rbd.chunked.store import Store
 
@@ -118,3 +118,20 @@ def test_chunk_write_existing_partial_complete_does_not_read_existing_data(
     chunk.write(0, b"X" * Chunk.CHUNK_SIZE)
     chunk._read_existing.assert_not_called()
     assert chunk.read(0, 3) == (b"XXX", 0)
+
+
+def test_zero_hash_matches_zero_chunk():
+    assert hash(bytes(Chunk.CHUNK_SIZE)) == ZERO_HASH
+
+
+def test_zero_chunk_is_not_read_from_disk(tmp_path, log):
+    store = Store(tmp_path / "store", log)
+    assert not store.chunk_path(ZERO_HASH).exists()
+
+    chunk = Chunk(store, ZERO_HASH)
+    assert chunk.read(10, 20) == (b"\0" * 20, 0)
+    assert chunk.read(Chunk.CHUNK_SIZE - 5, 10) == (b"\0" * 5, 5)
+    assert chunk.data is None
+
+    chunk.write(2, b"asdf")
+    assert chunk.read(0, 8) == (b"\0\0asdf\0\0", 0)
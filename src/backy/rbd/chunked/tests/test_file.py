@@ -4,7 +4,7 @@ import random
 import lzo
 import pytest
 
-from backy.rbd.chunked.chunk import Chunk, InconsistentHash
+from backy.rbd.chunked.chunk import ZERO_HASH, Chunk, InconsistentHash
 from backy.rbd.chunked.file import File
 from backy.rbd.chunked.store import Store
 
@@ -284,4 +284,117 @@ def test_rplus_and_append_positions(tmp_path, log):
         assert f.read() == b"bsdfcsdf"
 
 
+def test_background_flush_matches_synchronous_flush(tmp_path, log, monkeypatch):
+    store = Store(tmp_path, log)
+    data = b"".join(bytes([i]) * Chunk.CHUNK_SIZE for i in range(30))
+
+    monkeypatch.setattr(File, "flush_workers", 0)
+    with File(tmp_path / "sync", store) as f:
+        f.write(data)
+    monkeypatch.setattr(File, "flush_workers", 3)
+    monkeypatch.setattr(File, "flush_queue", 2)
+    stats: dict = {}
+    with File(tmp_path / "async", store, stats=stats) as f:
+        f.write(data)
+        assert len(f._pending) <= 2
+
+    sync = File(tmp_path / "sync", store, mode="r")
+    async_ = File(tmp_path / "async", store, mode="r")
+    assert sync._mapping == async_._mapping
+    assert async_.read() == data
+    assert stats["bytes_written"] == len(data)
+    assert "flush_wait_time" in stats
+    assert stats["chunk_stats"]["write_full"] == 30
+    assert stats["chunk_stats"]["hash_time"] > 0
+
+
+def test_reaccess_chunk_while_flushing(tmp_path, log, monkeypatch):
+    monkeypatch.setattr(File, "flush_workers", 2)
+    store = Store(tmp_path, log)
+    with File(tmp_path / "asdf", store) as f:
+        f.write(b"a" * Chunk.CHUNK_SIZE * 25)
+        assert f._pending
+        pending_id = next(iter(f._pending))
+        f.seek(pending_id * Chunk.CHUNK_SIZE)
+        f.write(b"b")
+        assert pending_id not in f._pending
+        f.seek(pending_id * Chunk.CHUNK_SIZE)
+        assert f.read(2) == b"ba"
+
+    with File(tmp_path / "asdf", store, mode="r") as f:
+        f.seek(pending_id * Chunk.CHUNK_SIZE)
+        assert f.read(2) == b"ba"
+
+
+def test_write_zeroes_maps_full_chunks_to_zero_chunk(tmp_path, log):
+    store = Store(tmp_path, log)
+    stats: dict = {}
+    with File(tmp_path / "asdf", store, stats=stats) as f:
+        f.write(b"a" * 4 * Chunk.CHUNK_SIZE)
+        f.seek(10)
+        f.write_zeroes(2 * Chunk.CHUNK_SIZE)
+
+    assert stats["bytes_written"] == 6 * Chunk.CHUNK_SIZE
+    assert stats["chunk_stats"]["write_zero"] == 1
+    with File(tmp_path / "asdf", store, mode="r") as f:
+        assert f._mapping[1] == ZERO_HASH
+        assert f._mapping[2] != ZERO_HASH
+        assert f.read() == (
+            b"a" * 10
+            + b"\0" * 2 * Chunk.CHUNK_SIZE
+            + b"a" * (2 * Chunk.CHUNK_SIZE - 10)
+        )
+    # The zero chunk is kept for other readers of the mapping.
+    assert store.chunk_path(ZERO_HASH).exists()
+    assert ZERO_HASH in store.index
+
+
+def test_truncate_increase_uses_zero_chunk(tmp_path, log):
+    store = Store(tmp_path, log)
+    with File(tmp_path / "asdf", store) as f:
+        f.write(b"asdf")
+        f.truncate(2 * Chunk.CHUNK_SIZE + 20)
+        assert f._mapping == {1: ZERO_HASH, 2: ZERO_HASH}
+        f.seek(0)
+        assert f.read() == b"asdf" + b"\0" * (2 * Chunk.CHUNK_SIZE + 16)
+
+
+def test_readahead_loads_following_chunks(tmp_path, log):
+    store = Store(tmp_path, log)
+    data = b"".join(bytes([i]) * Chunk.CHUNK_SIZE for i in range(1, 11))
+    with File(tmp_path / "asdf", store) as f:
+        f.write(data)
+        f.write_zeroes(Chunk.CHUNK_SIZE)
+
+    stats: dict = {}
+    with File(
+        tmp_path / "asdf", store, mode="r", stats=stats, readahead=3
+    ) as f:
+        assert f.read(10) == b"\1" * 10
+        assert sorted(f._prefetched) == [1, 2, 3]
+        assert f.read(Chunk.CHUNK_SIZE) == (
+            b"\1" * (Chunk.CHUNK_SIZE - 10) + b"\2" * 10
+        )
+        assert sorted(f._prefetched) == [2, 3, 4]
+        # Seeking elsewhere drops chunks that are no longer needed.
+        f.seek(8 * Chunk.CHUNK_SIZE)
+        assert f.read(1) == b"\x09"
+        # The zero chunk is not loaded.
+        assert sorted(f._prefetched) == [9]
+        f.seek(0)
+        assert f.read() == data + bytes(Chunk.CHUNK_SIZE)
+    assert stats["bytes_read"] == 2 * Chunk.CHUNK_SIZE + 11 + len(data)
+    assert "readahead_wait_time" in stats
+
+
+def test_readahead_is_disabled_for_writable_files(tmp_path, log):
+    store = Store(tmp_path, log)
+    with File(tmp_path / "asdf", store, readahead=3) as f:
+        assert f.readahead == 0
+        f.write(b"a" * 2 * Chunk.CHUNK_SIZE)
+        f.seek(0)
+        assert f.read(1) == b"a"
+        assert not f._prefetched
+
+
 # TODO test bytes_written and chunk_stats
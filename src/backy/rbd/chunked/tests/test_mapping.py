@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+from backy.rbd.chunked import mapping
+from backy.rbd.chunked.mapping import HEADER, ChunkMapping
+
+HASH1 = "c01b5d75bfe6a1fa5bca6e492c5ab09a"
+HASH2 = "c72b4ba82d1f51b71c8a18195ad33fc8"
+
+
+def test_mapping_behaves_like_dict():
+    m = ChunkMapping()
+    assert m == {}
+    m[3] = HASH1
+    m[0] = HASH2
+    assert m == {0: HASH2, 3: HASH1}
+    assert list(m) == [0, 3]
+    assert len(m) == 2
+    assert m.get(1) is None
+    assert m.hashes() == {HASH1, HASH2}
+    with pytest.raises(KeyError):
+        m[4]
+    with pytest.raises(KeyError):
+        m[-1]
+
+    del m[3]
+    assert m == {0: HASH2}
+    # Missing chunks at the end are not stored.
+    assert len(m.tobytes()) == 16
+    with pytest.raises(KeyError):
+        del m[3]
+
+
+def test_dump_and_load_binary(tmp_path):
+    m = ChunkMapping()
+    m[0] = HASH1
+    m[2] = HASH2
+    mapping.dump(tmp_path / "rev", m, 12 * 1024**2)
+
+    data = (tmp_path / "rev").read_bytes()
+    assert data.startswith(b"BACKYMAP")
+    assert len(data) == HEADER.size + 3 * 16
+    assert not mapping.is_legacy(tmp_path / "rev")
+
+    loaded, size = mapping.load(tmp_path / "rev")
+    assert size == 12 * 1024**2
+    assert loaded == {0: HASH1, 2: HASH2}
+
+
+def test_load_read_only_is_memory_mapped(tmp_path):
+    m = ChunkMapping()
+    m[1] = HASH1
+    mapping.dump(tmp_path / "rev", m, 20)
+
+    loaded, _ = mapping.load(tmp_path / "rev", writable=False)
+    assert loaded._mmap is not None
+    assert loaded == {1: HASH1}
+    # Modifications copy the data.
+    loaded[0] = HASH2
+    assert loaded._mmap is None
+    assert loaded == {0: HASH2, 1: HASH1}
+    loaded.close()
+
+
+def test_load_empty_binary(tmp_path):
+    mapping.dump(tmp_path / "rev", ChunkMapping(), 0)
+    loaded, size = mapping.load(tmp_path / "rev", writable=False)
+    assert loaded == {}
+    assert size == 0
+
+
+def test_load_and_convert_legacy(tmp_path):
+    path = tmp_path / "rev"
+    path.write_text(
+        json.dumps({"mapping": {"0": HASH1, "2": HASH2}, "size": 9})
+    )
+    assert mapping.is_legacy(path)
+
+    loaded, size = mapping.load(path)
+    assert loaded == {0: HASH1, 2: HASH2}
+    assert size == 9
+
+    assert mapping.convert(path)
+    assert not mapping.is_legacy(path)
+    assert not mapping.convert(path)
+    loaded, size = mapping.load(path)
+    assert loaded == {0: HASH1, 2: HASH2}
+    assert size == 9
+
+
+def test_load_rejects_unknown_formats(tmp_path):
+    path = tmp_path / "rev"
+    path.write_bytes(b"foobar")
+    with pytest.raises(ValueError) as e:
+        mapping.load(path)
+    assert e.value.args[0] == "Revision does not look like it's chunked."
+
+    path.write_bytes(HEADER.pack(b"BACKYMAP", 2, 0, 4 * 1024**2))
+    with pytest.raises(ValueError) as e:
+        mapping.load(path)
+    assert e.value.args[0] == "Unsupported mapping version: 2"
+
+    path.write_bytes(HEADER.pack(b"BACKYMAP", 1, 0, 4 * 1024**2) + b"a")
+    with pytest.raises(ValueError) as e:
+        mapping.load(path)
+    assert e.value.args[0] == "Mapping is truncated."
@@ -0,0 +1,39 @@
+from backy.rbd.chunked.refcount import RefCount
+
+HASH1 = "c01b5d75bfe6a1fa5bca6e492c5ab09a"
+HASH2 = "c72b4ba82d1f51b71c8a18195ad33fc8"
+
+
+def test_count_and_uncount_revisions(tmp_path):
+    refs = RefCount(tmp_path / "refs.sqlite")
+    assert refs.last_audit is None
+    assert refs.add("a", [HASH1, HASH2])
+    assert refs.add("b", [HASH1])
+    # Revisions are only counted once.
+    assert not refs.add("b", [HASH1])
+    assert refs.revisions() == {"a", "b"}
+    assert refs[HASH1] == 2
+    assert refs[HASH2] == 1
+
+    assert refs.remove("a", [HASH1, HASH2])
+    assert not refs.remove("a", [HASH1, HASH2])
+    assert refs.unreferenced() == [HASH2]
+    refs.forget([HASH2])
+    assert refs.unreferenced() == []
+    assert refs[HASH1] == 1
+
+    # Another process sees the same counts.
+    refs2 = RefCount(tmp_path / "refs.sqlite")
+    assert refs2.revisions() == {"b"}
+    assert refs2[HASH1] == 1
+
+
+def test_replace_recounts(tmp_path):
+    refs = RefCount(tmp_path / "refs.sqlite")
+    refs.add("a", [HASH1])
+    refs.add("b", [HASH1])
+    refs.replace([("b", [HASH1, HASH2]), ("c", [HASH2])])
+    assert refs.revisions() == {"b", "c"}
+    assert refs[HASH1] == 1
+    assert refs[HASH2] == 2
+    assert refs.last_audit
@@ -0,0 +1,88 @@
+import lzo
+
+from backy.rbd.chunked.chunk import Chunk, hash
+from backy.rbd.chunked.file import File
+from backy.rbd.chunked.store import Store
+
+
+def write_chunk(store, data):
+    chunk_hash = hash(data)
+    with open(store.chunk_path(chunk_hash), "wb") as f:
+        f.write(lzo.compress(data))
+    return chunk_hash
+
+
+def test_index_is_built_from_existing_chunks(tmp_path, log):
+    store = Store(tmp_path / "store", log)
+    h = write_chunk(store, b"asdf")
+    (tmp_path / "store" / "index.sqlite").unlink()
+    for suffix in ["-wal", "-shm"]:
+        (tmp_path / "store" / ("index.sqlite" + suffix)).unlink(missing_ok=True)
+
+    store = Store(tmp_path / "store", log)
+    assert list(store.ls()) == [h]
+    assert store.index.complete
+
+
+def test_index_tracks_written_and_purged_chunks(tmp_path, log):
+    store = Store(tmp_path / "store", log)
+    with File(tmp_path / "asdf", store) as f:
+        f.write(b"a" * Chunk.CHUNK_SIZE + b"b")
+    hashes = set(f._mapping.values())
+    assert len(hashes) == 2
+
+    # A second process sees the committed index.
+    store2 = Store(tmp_path / "store", log)
+    assert set(store2.ls()) == hashes
+    assert all(h in store2.index for h in hashes)
+
+    used = hash(b"b")
+    store2.purge({used})
+    assert list(store2.ls()) == [used]
+    assert list(store2.scan()) == [used]
+
+
+def test_flush_skips_indexed_chunks(tmp_path, log):
+    store = Store(tmp_path / "store", log)
+    h = write_chunk(store, b"asdf")
+    store.rebuild_index()
+
+    store = Store(tmp_path / "store", log)
+    chunk_path = store.chunk_path(h)
+    chunk_path.chmod(0o640)
+    chunk_path.write_bytes(lzo.compress(b"asdf"))
+    state = chunk_path.stat()
+    chunk = Chunk(store, None)
+    chunk.write(0, b"asdf")
+    chunk.flush()
+    assert chunk.hash == h
+    assert chunk_path.stat().st_mtime_ns == state.st_mtime_ns
+
+
+def test_check_and_repair(tmp_path, log):
+    store = Store(tmp_path / "store", log)
+    assert store.check()
+
+    unindexed = write_chunk(store, b"asdf")
+    with File(tmp_path / "asdf", store) as f:
+        f.write(b"bsdf")
+    missing = f._mapping[0]
+    store.chunk_path(missing).unlink()
+
+    assert not store.check()
+    assert set(store.ls()) == {missing}
+
+    assert not store.check(repair=True)
+    assert set(store.ls()) == {unindexed}
+    assert store.check()
+
+
+def test_remove_chunk(tmp_path, log):
+    store = Store(tmp_path / "store", log)
+    with File(tmp_path / "asdf", store) as f:
+        f.write(b"asdf")
+    h = f._mapping[0]
+    store.remove(h)
+    assert h not in store.index
+    assert h not in store.seen
+    assert not store.chunk_path(h).exists()
@@ -0,0 +1,172 @@
+"""Parallel restore of chunked revisions.
+
+Worker processes read, decompress and verify chunks independently of each
+other. They either write them to the target directly (`pwrite`) or hand
+them back to be written in order (for pipes).
+
+The functions running in workers only get paths and hashes and do not need
+a store, repository or logger.
+"""
+
+import collections
+import itertools
+import multiprocessing
+import os
+import stat
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from backy.utils import CHUNK_SIZE, punch_hole
+
+from .chunked import ZERO_HASH, File, Hash
+from .chunked.chunk import hash, read_chunk
+
+# (offset, length, path, hash) of a chunk to restore. `path` is None for
+# the zero chunk.
+Extent = Tuple[int, int, Optional[str], Hash]
+
+
+def plan(source: File) -> Iterator[Extent]:
+    """List the chunks of `source` with the part of each that is used."""
+    for id in range(-(-source.size // CHUNK_SIZE)):
+        chunk_hash = source._mapping.get(id)
+        if chunk_hash is None:
+            raise ValueError(f"Under-run: chunk {id} seems to be missing data")
+        offset = id * CHUNK_SIZE
+        length = min(CHUNK_SIZE, source.size - offset)
+        path = None
+        if chunk_hash != ZERO_HASH:
+            path = str(source.store.chunk_path(chunk_hash))
+        yield offset, length, path, chunk_hash
+
+
+def load(extent: Extent) -> bytes:
+    _, length, path, expected = extent
+    if path is None:
+        return bytes(length)
+    return read_chunk(path, expected)[:length]
+
+
+def pwrite_extents(
+    target: str,
+    extents: list[Extent],
+    differential: bool = False,
+    sparse: bool = False,
+) -> Tuple[int, int]:
+    """Write the given extents to their offsets in `target`.
+
+    `differential`: skip chunks that the target already contains.
+    `sparse`: the target is known to be all holes, skip zero chunks.
+
+    Returns the number of bytes written and skipped.
+    """
+    written = skipped = 0
+    fd = os.open(target, os.O_RDWR if differential else os.O_WRONLY)
+    try:
+        for extent in extents:
+            offset, length, path, expected = extent
+            if path is None and sparse:
+                skipped += length
+                continue
+            # Partial chunks may have been stored with data beyond the end
+            # of the image, so we can't compare their hashes.
+            if differential and length == CHUNK_SIZE:
+                existing = os.pread(fd, length, offset)
+                if hash(existing) == expected:
+                    skipped += length
+                    continue
+            if path is None:
+                try:
+                    punch_hole(fd, offset, length)
+                    written += length
+                    continue
+                except OSError:
+                    pass  # write the zeroes instead
+            data = memoryview(load(extent))
+            while data:
+                n = os.pwrite(fd, data, offset)
+                data = data[n:]
+                offset += n
+                written += n
+    finally:
+        os.close(fd)
+    return written, skipped
+
+
+def executor(workers: int) -> ProcessPoolExecutor:
+    # Do not fork: the parent may have threads (e.g. sqlite, read-ahead).
+    return ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("forkserver")
+    )
+
+
+def restore_file(
+    source: File,
+    target: str,
+    workers: int,
+    batch: int,
+    differential: bool = False,
+) -> Tuple[int, int]:
+    """Restore `source` to an existing file or block device.
+
+    Workers restore `batch` consecutive chunks at a time, with at most two
+    batches per worker in flight. Returns the number of bytes written and
+    skipped.
+    """
+    st = os.stat(target)
+    # A new or empty file only consists of holes after extending it.
+    sparse = stat.S_ISREG(st.st_mode) and st.st_size == 0
+    try:
+        os.truncate(target, source.size)
+    except OSError:
+        pass  # truncate may not be supported, i.e. on block devices
+    extents = plan(source)
+    written = skipped = 0
+    # Batches in flight. Enough to keep all workers busy, without planning
+    # and queueing the whole (possibly huge) image up front.
+    window = workers * 2
+    pending: collections.deque[Future] = collections.deque()
+    with executor(workers) as pool:
+        while True:
+            extent_batch = list(itertools.islice(extents, batch))
+            if not extent_batch:
+                break
+            if len(pending) >= window:
+                w, s = pending.popleft().result()
+                written += w
+                skipped += s
+            pending.append(
+                pool.submit(
+                    pwrite_extents, target, extent_batch, differential, sparse
+                )
+            )
+        while pending:
+            w, s = pending.popleft().result()
+            written += w
+            skipped += s
+    fd = os.open(target, os.O_WRONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # fsync may not be supported, i.e. on special files
+    finally:
+        os.close(fd)
+    return written, skipped
+
+
+def restore_stream(
+    source: File, target: BinaryIO, workers: int, queue: int
+) -> int:
+    """Restore `source` to a stream, keeping at most `queue` chunks in
+    flight."""
+    written = 0
+    pending: collections.deque[Future] = collections.deque()
+    with executor(workers) as pool:
+        for extent in plan(source):
+            if len(pending) >= queue:
+                written += target.write(pending.popleft().result())
+            pending.append(pool.submit(load, extent))
+        while pending:
+            written += target.write(pending.popleft().result())
+    target.flush()
+    return written
@@ -302,14 +302,114 @@ class RBDDiffV1(object):
             elif isinstance(record, ToSnap):
                 assert record.snapshot == snapshot_to
 
+        writer = ChunkAlignedWriter(target)
         for record in self.read_data():
-            target.seek(record.start)
             if isinstance(record, Zero):
-                target.write(b"\x00" * record.length)
+                writer.write_zeroes(record.start, record.length)
             elif isinstance(record, Data):
+                offset = record.start
                 for chunk in record.stream():
-                    target.write(chunk)
+                    writer.write(offset, chunk)
+                    offset += len(chunk)
             bytes += record.length
+        writer.flush()
 
         self.f.close()
         return bytes
+
+
+class ChunkAlignedWriter(object):
+    """Coalesces adjacent writes into chunk-aligned writes to a target.
+
+    Diff records (and the reads we stream them with) do not need to start
+    on a chunk boundary. Writing them as they come would update chunks in
+    multiple pieces, each of which has to read the parent's data first.
+
+    We buffer the data of a chunk until it is complete or until the next
+    write is not adjacent anymore. Chunks that are covered entirely by
+    the union of adjacent records are thus written in one go and only
+    chunks that are truly partial need their parent's data.
+
+    """
+
+    chunk_size: int
+    target: IO
+    _start: int
+    _pending: bytearray
+
+    def __init__(self, target: IO, chunk_size: int = CHUNK_SIZE):
+        self.target = target
+        self.chunk_size = chunk_size
+        self._start = 0
+        self._pending = bytearray()
+
+    @property
+    def _end(self) -> int:
+        return self._start + len(self._pending)
+
+    def _append(self, offset: int, data) -> None:
+        if self._pending and offset != self._end:
+            self.flush()
+        if not self._pending:
+            self._start = offset
+        self._pending += data
+
+    def _drain(self) -> None:
+        # Write everything up to the last chunk boundary. The chunk before
+        # the first boundary (if any) can not be completed by later writes
+        # anymore.
+        boundary = self._end - self._end % self.chunk_size
+        if boundary <= self._start:
+            return
+        length = boundary - self._start
+        self.target.seek(self._start)
+        with memoryview(self._pending) as data:
+            self.target.write(data[:length])
+        del self._pending[:length]
+        self._start = boundary
+
+    def write(self, offset: int, data: bytes) -> None:
+        self._append(offset, data)
+        self._drain()
+
+    def write_zeroes(self, offset: int, length: int) -> None:
+        # Zeroes that complete a pending chunk are buffered like data.
+        if self._pending and offset == self._end:
+            fill = min(length, -offset % self.chunk_size)
+            self.write(offset, bytes(fill))
+            offset += fill
+            length -= fill
+        if not length:
+            return
+        self.flush()
+        # Zeroes that do not fill a chunk up to its end may still be
+        # completed by the following data.
+        head = min(length, -offset % self.chunk_size)
+        if head and head == length:
+            self.write(offset, bytes(head))
+            return
+        tail = (offset + length) % self.chunk_size
+        self.target.seek(offset)
+        write_zeroes(self.target, length - tail)
+        if tail:
+            self._append(offset + length - tail, bytes(tail))
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        self.target.seek(self._start)
+        self.target.write(self._pending)
+        self._pending = bytearray()
+
+
+def write_zeroes(target, length: int) -> None:
+    """Write `length` zero bytes to `target` without allocating them all."""
+    if hasattr(target, "write_zeroes"):
+        # Chunked files can map whole chunks without writing any data.
+        target.write_zeroes(length)
+        return
+    zeroes = memoryview(bytes(min(length, CHUNK_SIZE)))
+    while length:
+        written = min(length, len(zeroes))
+        target.write(zeroes[:written])
+        length -= written
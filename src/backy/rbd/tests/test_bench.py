@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from backy.rbd.bench import BENCHMARKS, ImageSpec, compare, main, parse_size
+from backy.utils import CHUNK_SIZE, MiB, kiB
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("512", 512),
+        ("64k", 64 * kiB),
+        ("256M", 256 * MiB),
+        ("2GiB", 2048 * MiB),
+    ],
+)
+def test_parse_size(value, expected):
+    assert parse_size(value) == expected
+
+
+def test_image_spec_is_deterministic():
+    spec = ImageSpec(size=10 * CHUNK_SIZE + 10, dedup=0.5, compressibility=0.5)
+    blocks = list(spec.blocks())
+    assert blocks == list(spec.blocks())
+    assert sum(len(b) for b in blocks) == spec.size
+    assert len(blocks[-1]) == 10
+    assert len(set(blocks[:-1])) < 10
+    assert blocks[0][CHUNK_SIZE // 2 :] == bytes(CHUNK_SIZE // 2)
+    assert blocks != list(ImageSpec(spec.size, seed=1).blocks())
+
+
+def test_image_spec_rejects_invalid_ratios():
+    with pytest.raises(ValueError):
+        ImageSpec(dedup=1.5)
+    with pytest.raises(ValueError):
+        ImageSpec(compressibility=-1)
+
+
+def test_run_and_compare(tmp_path, capsys):
+    old = tmp_path / "old.json"
+    assert (
+        main(
+            [
+                "run",
+                "--size",
+                "8M",
+                "--repeat",
+                "1",
+                "--workdir",
+                str(tmp_path),
+                "-o",
+                str(old),
+            ]
+        )
+        == 0
+    )
+    results = json.loads(old.read_text())
+    assert results["spec"] == dict(
+        size=8 * MiB, dedup=0.2, compressibility=0.5, seed=0
+    )
+    assert [r["name"] for r in results["results"]] == list(BENCHMARKS)
+    for result in results["results"]:
+        assert len(result["runs"]) == 1
+        assert result["seconds"] > 0
+
+    new = json.loads(old.read_text())
+    new["results"][0]["seconds"] *= 2
+    (tmp_path / "new.json").write_text(json.dumps(new))
+    assert main(["compare", str(old), str(tmp_path / "new.json")]) == 1
+    assert main(["compare", str(old), str(old)]) == 0
+
+
+def test_compare_ignores_missing_benchmarks():
+    old = {"results": [{"name": "a", "seconds": 1.0}]}
+    new = {
+        "results": [{"name": "a", "seconds": 1.05}, {"name": "b", "seconds": 1}]
+    }
+    assert compare(old, new, 0.1) == [
+        dict(
+            name="a",
+            old=1.0,
+            new=1.05,
+            change=pytest.approx(0.05),
+            regression=False,
+        )
+    ]
@@ -75,6 +75,7 @@ def test_context_manager(ceph_rbd, repository, log):
         assert ceph_rbd.rbd.snap_ls("test/foo")[0]["name"] == "backy-1"
 
     assert len(ceph_rbd.rbd.snap_ls("test/foo")) == 0
+    assert list(revision.stats["phases"]) == ["snapshot", "delete-snapshots"]
 
 
 def test_context_manager_cleans_out_snapshots(ceph_rbd, repository, log):
@@ -4,6 +4,7 @@ from pathlib import Path
 
 import pytest
 
+from backy.rbd.chunked import ZERO_HASH, File, Store
 from backy.rbd.rbd import (
     Data,
     FromSnap,
@@ -13,6 +14,7 @@ from backy.rbd.rbd import (
     Zero,
     unpack_from,
 )
+from backy.utils import CHUNK_SIZE
 
 
 def test_unpack_from_i():
@@ -166,6 +168,109 @@ def test_integrate_sample_data(sample_diff, tmp_path):
     assert integrated[209:500] == b"\1" * 291
 
 
+def test_integrate_maps_zero_extents_to_zero_chunk(tmp_path, log):
+    filename = str(tmp_path / "sample.rbddiff")
+    with open(filename, "wb") as f:
+        f.write(b"rbd diff v1\n")
+        f.write(b"s")
+        f.write(struct.pack(b"<Q", 4 * CHUNK_SIZE))
+        f.write(b"z")
+        f.write(struct.pack(b"<QQ", 10, 3 * CHUNK_SIZE))
+        f.write(b"e")
+
+    store = Store(tmp_path / "store", log)
+    with File(tmp_path / "target", store) as target:
+        target.write(b"\1" * 4 * CHUNK_SIZE)
+        diff = RBDDiffV1(open(filename, "rb"))
+        assert diff.integrate(target, None, None) == 3 * CHUNK_SIZE
+        assert target._mapping[1] == ZERO_HASH
+        assert target._mapping[2] == ZERO_HASH
+        target.seek(0)
+        data = target.read()
+    assert data == (
+        b"\1" * 10 + b"\0" * 3 * CHUNK_SIZE + b"\1" * (CHUNK_SIZE - 10)
+    )
+
+
+def write_data_record(f, offset, data):
+    f.write(b"w")
+    f.write(struct.pack(b"<QQ", offset, len(data)))
+    f.write(data)
+
+
+def test_integrate_coalesces_records_into_full_chunks(tmp_path, log):
+    filename = str(tmp_path / "sample.rbddiff")
+    with open(filename, "wb") as f:
+        f.write(b"rbd diff v1\n")
+        f.write(b"s")
+        f.write(struct.pack(b"<Q", 4 * CHUNK_SIZE))
+        # An unaligned record spanning chunks 0-2: chunk 0 is partial.
+        write_data_record(f, 10, b"\2" * (2 * CHUNK_SIZE))
+        # Adjacent records complete chunk 2 ...
+        write_data_record(f, 2 * CHUNK_SIZE + 10, b"\3" * 100)
+        f.write(b"z")
+        f.write(struct.pack(b"<QQ", 2 * CHUNK_SIZE + 110, 100))
+        write_data_record(f, 2 * CHUNK_SIZE + 210, b"\4" * (CHUNK_SIZE - 210))
+        # ... but not chunk 3.
+        write_data_record(f, 3 * CHUNK_SIZE + 10, b"\5" * 10)
+        f.write(b"e")
+
+    store = Store(tmp_path / "store", log)
+    with File(tmp_path / "target", store) as target:
+        target.write(b"\1" * 4 * CHUNK_SIZE)
+        target.flush()
+        target.stats.clear()
+        diff = RBDDiffV1(open(filename, "rb"))
+        diff.integrate(target, None, None)
+        assert target.stats["chunk_stats"] == {
+            "write_full": 2,
+            "write_partial": 2,
+        }
+        target.seek(0)
+        data = target.read()
+    assert data == (
+        b"\1" * 10
+        + b"\2" * 2 * CHUNK_SIZE
+        + b"\3" * 100
+        + b"\0" * 100
+        + b"\4" * (CHUNK_SIZE - 210)
+        + b"\1" * 10
+        + b"\5" * 10
+        + b"\1" * (CHUNK_SIZE - 20)
+    )
+
+
+def test_integrate_maps_aligned_zeroes_after_pending_data(tmp_path, log):
+    filename = str(tmp_path / "sample.rbddiff")
+    with open(filename, "wb") as f:
+        f.write(b"rbd diff v1\n")
+        f.write(b"s")
+        f.write(struct.pack(b"<Q", 3 * CHUNK_SIZE))
+        write_data_record(f, 0, b"\2" * 10)
+        f.write(b"z")
+        f.write(struct.pack(b"<QQ", 10, 2 * CHUNK_SIZE))
+        f.write(b"e")
+
+    store = Store(tmp_path / "store", log)
+    with File(tmp_path / "target", store) as target:
+        target.write(b"\1" * 3 * CHUNK_SIZE)
+        target.flush()
+        target.stats.clear()
+        diff = RBDDiffV1(open(filename, "rb"))
+        diff.integrate(target, None, None)
+        assert target._mapping[1] == ZERO_HASH
+        assert target.stats["chunk_stats"] == {
+            "write_full": 1,
+            "write_partial": 1,
+            "write_zero": 1,
+        }
+        target.seek(0)
+        data = target.read()
+    assert data == (
+        b"\2" * 10 + b"\0" * 2 * CHUNK_SIZE + b"\1" * (CHUNK_SIZE - 10)
+    )
+
+
 def test_integrate_stops_on_broken_metadata_record(tmp_path):
     filename = str(tmp_path / "sample.rbddiff")
     with open(filename, "wb") as f:
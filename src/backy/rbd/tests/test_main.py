@@ -1,6 +1,7 @@
 import os
 import pprint
 from functools import partialmethod
+from unittest import mock
 
 import pytest
 
@@ -41,7 +42,7 @@ def test_display_usage(capsys):
     assert (
         """\
 usage: backy-rbd [-h] [-v] [-C WORKDIR] [-t TASKID]
-                 {backup,restore,gc,verify} ...
+                 {backup,restore,gc,verify,check-store,convert-mappings} ...
 """
         == out
     )
@@ -57,7 +58,7 @@ def test_display_help(capsys):
         Ellipsis(
             """\
 usage: backy-rbd [-h] [-v] [-C WORKDIR] [-t TASKID]
-                 {backup,restore,gc,verify} ...
+                 {backup,restore,gc,verify,check-store,convert-mappings} ...
 
 The rbd plugin for backy. You should not call this directly. Use the backy
 command instead.
@@ -105,7 +106,7 @@ def print_args(*args, return_value=None, **kw):
             0,
             [
                 "<backy.revision.Revision object at 0x...>",
-                "RBDRestoreArgs(target='out.img', backend=<RestoreBackend.AUTO: 'auto'>)",
+                "RBDRestoreArgs(target='out.img', backend=<RestoreBackend.AUTO: 'auto'>, differential=False)",
             ],
         ),
         (
@@ -114,7 +115,16 @@ def print_args(*args, return_value=None, **kw):
             0,
             [
                 "<backy.revision.Revision object at 0x...>",
-                "RBDRestoreArgs(target='out.img', backend=<RestoreBackend.PYTHON: 'python'>)",
+                "RBDRestoreArgs(target='out.img', backend=<RestoreBackend.PYTHON: 'python'>, differential=False)",
+            ],
+        ),
+        (
+            ["restore", "asdf", "--differential", "/dev/vdb"],
+            None,
+            0,
+            [
+                "<backy.revision.Revision object at 0x...>",
+                "RBDRestoreArgs(target='/dev/vdb', backend=<RestoreBackend.AUTO: 'auto'>, differential=True)",
             ],
         ),
         (["gc"], None, 0, []),
@@ -173,6 +183,25 @@ def test_call_fun(
     )
 
 
+@pytest.mark.parametrize(
+    ["args", "consistent", "rc", "repair"],
+    [
+        (["check-store"], True, 0, False),
+        (["check-store", "--repair"], False, 1, True),
+    ],
+)
+def test_call_check_store(
+    args, consistent, rc, repair, source_on_disk, monkeypatch
+):
+    check_store = mock.Mock(return_value=consistent)
+    monkeypatch.setattr(backy.rbd.RBDSource, "check_store", check_store)
+    exit = RBDSource.main(
+        "backy-rbd", "-C", str(source_on_disk.repository.path), *args
+    )
+    assert exit == rc
+    check_store.assert_called_once_with(repair)
+
+
 def test_call_unexpected_exception(
     capsys, source_on_disk, monkeypatch, log, tmp_path
 ):
@@ -1,14 +1,18 @@
+import json
 import os
 import subprocess
 from pathlib import Path
 from typing import IO
 from unittest import mock
 
+import lzo
 import pytest
 
+from backy import utils
 from backy.conftest import create_rev
 from backy.ext_deps import BACKY_RBD_CMD, BASH
-from backy.rbd import CephRBD, RBDRestoreArgs, RBDSource
+from backy.rbd import CephRBD, RBDRestoreArgs, RBDSource, RestoreBackend
+from backy.rbd.chunked import Chunk, InconsistentHash
 from backy.source import CmdLineSource
 from backy.tests import Ellipsis
 from backy.utils import CHUNK_SIZE
@@ -102,6 +106,24 @@ def test_restore_target(rbdsource, repository, tmp_path, log):
     rbdsource.restore(r, RBDRestoreArgs(str(target)))
     with open(target, "rb") as t:
         assert data == t.read()
+    assert "rbdsource/restore-finished" in utils.log_data
+    assert "bytes=16 " in utils.log_data
+
+
+def test_backup_records_phases(rbdsource, repository, log):
+    data = b"volume contents\n"
+    rbdsource.ceph_rbd.data = data
+    r = create_rev(repository, {"daily"})
+    assert rbdsource.backup(r)
+    phases = r.stats["phases"]
+    assert set(phases) == {"export", "count", "verify", "sync"}
+    assert phases["export"]["bytes"] == len(data)
+    assert phases["verify"]["bytes"] == len(data)
+    assert all(p["duration"] >= 0 for p in phases.values())
+    assert r.stats["duration"] >= phases["export"]["duration"]
+    assert r.stats["store_chunks"] == 1
+    repository.scan()
+    assert repository.find("last").stats["phases"] == phases
 
 
 def test_restore_stdout(rbdsource, repository, capfd, log):
@@ -123,11 +145,177 @@ def test_restore_backy_extract(rbdsource, repository, monkeypatch, log):
     rbdsource.ceph_rbd.data = data
     r = create_rev(repository, {"daily"})
     rbdsource.backup(r)
+    # backy-extract only supports the legacy JSON mapping format.
+    with rbdsource.open(r) as f:
+        legacy = {"mapping": {str(k): v for k, v in f._mapping.items()}}
+        legacy["size"] = f.size
+    (repository.path / r.uuid).write_text(json.dumps(legacy))
     rbdsource.restore(r, RBDRestoreArgs("restore.img"))
     check_output.assert_called()
     rbdsource.restore_backy_extract.assert_called_once_with(r, "restore.img")
 
 
+def test_restore_binary_mapping_without_backy_extract(
+    rbdsource, repository, monkeypatch, tmp_path, log
+):
+    check_output = mock.Mock(return_value="backy-extract 1.1.0")
+    monkeypatch.setattr(subprocess, "check_output", check_output)
+    rbdsource.restore_backy_extract = mock.Mock()
+    data = b"a" * CHUNK_SIZE
+    rbdsource.ceph_rbd.data = data
+    r = create_rev(repository, {"daily"})
+    rbdsource.backup(r)
+    rbdsource.restore(r, RBDRestoreArgs(str(tmp_path / "restore.img")))
+    rbdsource.restore_backy_extract.assert_not_called()
+    assert (tmp_path / "restore.img").read_bytes() == data
+
+    with pytest.raises(ValueError, match="binary mapping format"):
+        rbdsource.restore(
+            r, RBDRestoreArgs(str(tmp_path / "rust.img"), RestoreBackend.RUST)
+        )
+    rbdsource.restore_backy_extract.assert_not_called()
+    assert not (tmp_path / "rust.img").exists()
+
+
+@pytest.mark.parametrize(
+    "backend", [RestoreBackend.PYTHON, RestoreBackend.PARALLEL]
+)
+def test_restore_backends(rbdsource, repository, tmp_path, backend, log):
+    data = b"".join(bytes([i]) * CHUNK_SIZE for i in range(5)) + b"tail"
+    rbdsource.ceph_rbd.data = data
+    rbdsource.restore_workers = 2
+    rbdsource.restore_batch = 2
+    r = create_rev(repository, {"daily"})
+    rbdsource.backup(r)
+    target = tmp_path / "restore.img"
+    # Existing data is overwritten and cut off.
+    target.write_bytes(b"x" * (len(data) + 10))
+    rbdsource.restore(r, RBDRestoreArgs(str(target), backend))
+    assert target.read_bytes() == data
+
+
+def test_restore_parallel_stdout(rbdsource, repository, capfdbinary, log):
+    data = b"".join(bytes([i]) * CHUNK_SIZE for i in range(1, 5)) + b"tail"
+    rbdsource.ceph_rbd.data = data
+    rbdsource.restore_workers = 2
+    rbdsource.restore_queue = 2
+    r = create_rev(repository, {"daily"})
+    rbdsource.backup(r)
+    rbdsource.restore(r, RBDRestoreArgs("-", RestoreBackend.PARALLEL))
+    out, err = capfdbinary.readouterr()
+    assert data == out
+
+
+def test_restore_parallel_more_batches_than_in_flight(
+    rbdsource, repository, tmp_path, log
+):
+    data = b"".join(bytes([i]) * CHUNK_SIZE for i in range(1, 7)) + b"tail"
+    rbdsource.ceph_rbd.data = data
+    rbdsource.restore_workers = 1
+    rbdsource.restore_batch = 1
+    r = create_rev(repository, {"daily"})
+    rbdsource.backup(r)
+    target = tmp_path / "restore.img"
+    with rbdsource.open(r) as f:
+        written, skipped = rbdsource.restore_file_parallel(f, str(target))
+    assert (written, skipped) == (len(data), 0)
+    assert target.read_bytes() == data
+
+
+def test_restore_differential(rbdsource, repository, tmp_path, log):
+    data = b"A" * CHUNK_SIZE + bytes(CHUNK_SIZE) + b"B" * CHUNK_SIZE + b"tail"
+    rbdsource.ceph_rbd.data = data
+    rbdsource.restore_workers = 2
+    r = create_rev(repository, {"daily"})
+    rbdsource.backup(r)
+    target = tmp_path / "restore.img"
+
+    # A new target is sparse: the zero chunk does not need to be written.
+    with rbdsource.open(r) as f:
+        written, skipped = rbdsource.restore_file_parallel(f, str(target))
+    assert (written, skipped) == (2 * CHUNK_SIZE + 4, CHUNK_SIZE)
+    assert target.read_bytes() == data
+
+    with open(target, "r+b") as t:
+        t.seek(10)
+        t.write(b"changed")
+        t.seek(CHUNK_SIZE + 10)
+        t.write(b"changed")
+    with rbdsource.open(r) as f:
+        written, skipped = rbdsource.restore_file_parallel(
+            f, str(target), differential=True
+        )
+    # The partial chunk at the end is always written.
+    assert (written, skipped) == (2 * CHUNK_SIZE + 4, CHUNK_SIZE)
+    assert target.read_bytes() == data
+
+    rbdsource.restore(r, RBDRestoreArgs(str(target), differential=True))
+    assert "bytes_skipped=12582912 bytes_written=4" in utils.log_data
+    assert target.read_bytes() == data
+
+
+def test_restore_differential_needs_parallel_backend(
+    rbdsource, repository, tmp_path, log
+):
+    rbdsource.ceph_rbd.data = b"asdf"
+    r = create_rev(repository, {"daily"})
+    rbdsource.backup(r)
+    with pytest.raises(ValueError):
+        rbdsource.restore(
+            r,
+            RBDRestoreArgs(
+                str(tmp_path / "restore.img"),
+                RestoreBackend.PYTHON,
+                differential=True,
+            ),
+        )
+    with pytest.raises(ValueError):
+        rbdsource.restore(r, RBDRestoreArgs("-", differential=True))
+
+
+def test_restore_parallel_detects_corruption(
+    rbdsource, repository, tmp_path, log
+):
+    rbdsource.ceph_rbd.data = b"volume contents\n"
+    r = create_rev(repository, {"daily"})
+    rbdsource.backup(r)
+    with rbdsource.open(r) as f:
+        chunk_path = rbdsource.store.chunk_path(f._mapping[0])
+    chunk_path.chmod(0o640)
+    chunk_path.write_bytes(lzo.compress(b"garbage"))
+    with pytest.raises(InconsistentHash):
+        rbdsource.restore(
+            r,
+            RBDRestoreArgs(
+                str(tmp_path / "restore.img"), RestoreBackend.PARALLEL
+            ),
+        )
+
+
+def test_convert_mappings(rbdsource, repository, log):
+    rbdsource.ceph_rbd.data = b"volume contents\n"
+    r = create_rev(repository, {"daily"})
+    rbdsource.backup(r)
+    path = repository.path / r.uuid
+    with rbdsource.open(r) as f:
+        expected = dict(f._mapping)
+    path.write_text(
+        json.dumps(
+            {
+                "mapping": {str(k): v for k, v in expected.items()},
+                "size": 16,
+            }
+        )
+    )
+
+    rbdsource.convert_mappings()
+
+    assert path.read_bytes().startswith(b"BACKYMAP")
+    with rbdsource.open(r) as f:
+        assert f._mapping == expected
+        assert f.read() == b"volume contents\n"
+
+
 def test_backup_corrupted(rbdsource, repository, log):
     data = b"volume contents\n"
     rbdsource.ceph_rbd.data = data
@@ -164,6 +352,64 @@ def test_gc(rbdsource, repository, log):
     assert len(list(rbdsource.store.ls())) == 0
 
 
+def test_gc_incremental(rbdsource, repository, monkeypatch, log):
+    rbdsource.ceph_rbd.data = b"shared" * CHUNK_SIZE
+    r1 = create_rev(repository, set())
+    rbdsource.backup(r1)
+    rbdsource.gc()
+    last_audit = rbdsource.store.refs.last_audit
+    assert last_audit
+    assert rbdsource.store.refs.revisions() == {r1.uuid}
+
+    # An unreferenced chunk is not found without an audit.
+    orphan = Chunk(rbdsource.store, None)
+    orphan.write(0, b"orphan")
+    orphan.flush()
+
+    rbdsource.ceph_rbd.data = b"shared" * CHUNK_SIZE + b"new"
+    r2 = create_rev(repository, set())
+    rbdsource.backup(r2)
+    assert rbdsource.store.refs.revisions() == {r1.uuid, r2.uuid}
+    with rbdsource.open(r2) as f:
+        new_chunk = f._mapping[6]
+    assert rbdsource.store.refs.unreferenced() == []
+
+    r2 = repository.find_by_uuid(r2.uuid)
+    r2.remove()
+    # Do not scan the unchanged revisions.
+    monkeypatch.setattr(
+        rbdsource, "_audit_refs", mock.Mock(side_effect=AssertionError)
+    )
+    rbdsource.gc()
+    assert rbdsource.store.refs.last_audit == last_audit
+    assert rbdsource.store.refs[new_chunk] == 0
+    assert new_chunk not in set(rbdsource.store.ls())
+    assert orphan.hash in set(rbdsource.store.ls())
+    monkeypatch.undo()
+
+    rbdsource.gc(audit=True)
+    assert rbdsource.store.refs.last_audit > last_audit
+    assert orphan.hash not in set(rbdsource.store.ls())
+    with rbdsource.open(r1) as f:
+        assert f.read() == b"shared" * CHUNK_SIZE
+
+
+def test_gc_audits_when_mapping_is_missing(rbdsource, repository, log):
+    rbdsource.ceph_rbd.data = b"asdf"
+    r = create_rev(repository, set())
+    rbdsource.backup(r)
+    rbdsource.gc()
+    last_audit = rbdsource.store.refs.last_audit
+
+    r = repository.find_by_uuid(r.uuid)
+    r.remove()
+    (repository.path / r.uuid).unlink()
+    rbdsource.gc()
+    assert rbdsource.store.refs.last_audit > last_audit
+    assert rbdsource.store.refs.revisions() == set()
+    assert list(rbdsource.store.ls()) == []
+
+
 def test_open_distrusted(rbdsource, repository):
     r1 = create_rev(repository, set())
     rbdsource.open(r1, "wb")
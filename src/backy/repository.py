@@ -1,24 +1,29 @@
+import bisect
 import contextlib
 import datetime
 import fcntl
+import os
 import re
-from math import ceil, floor
+import time
+import uuid
 from pathlib import Path
-from typing import IO, Any, Iterable, List, Literal, Optional, TypedDict
+from typing import (
+    IO,
+    Any,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    TypedDict,
+)
 
 import tzlocal
 from structlog.stdlib import BoundLogger
 
 import backy
-from backy.utils import (
-    duplicates,
-    list_get,
-    list_rindex,
-    list_split,
-    min_date,
-    unique,
-)
 
+from . import query
 from .report import ProblemReport
 from .revision import Revision, Trust, filter_schedule_tags
 from .schedule import Schedule
@@ -27,7 +32,7 @@ from .schedule import Schedule
 class StatusDict(TypedDict):
     job: str
     sla: str
-    sla_overdue: int
+    sla_overdue: float
     status: str
     last_time: Optional[datetime.datetime]
     last_tags: Optional[str]
@@ -40,6 +45,10 @@ class StatusDict(TypedDict):
     local_revs: int
 
 
+def _metadata(r: Revision) -> tuple:
+    return (r.timestamp, r.stats, r.tags, r.orig_tags, r.server, r.trust)
+
+
 class Repository(object):
     """A repository stores and manages backups for a single source.
 
@@ -58,12 +67,34 @@ class Repository(object):
     path: Path
     report_path: Path
     schedule: Schedule
-    history: List[Revision]
     report_ids: List[str]
     log: BoundLogger
 
     _by_uuid: dict[str, Revision]
     _lock_fds: dict[str, IO]
+    # Info file name -> (stat key, revision) of the last scan.
+    _info_files: dict[str, tuple[Optional[tuple], Revision]]
+    _scan_mtime: Optional[int]
+    # The mtime of the report directory as of the last `scan_reports`.
+    _reports_mtime: Optional[int]
+    _history: List[Revision]
+    # Incremented whenever a revision in the history changes.
+    _version: int
+    # Metadata versions for peers, see `metadata_version`.
+    _epoch: str
+    _changes: int
+    # Revision uuid -> `_changes` when the revision last changed.
+    _changed: dict[str, int]
+    _index: Optional[query.RevisionIndex]
+    _index_key: tuple[int, int]
+    # Parent links, see `get_parent`.
+    _links: "ParentLinks"
+    # Clean revisions by tag, see `last_by_tag`.
+    _aggregates: "TagAggregates"
+
+    # Modifications within this time (in ns) of a scan may not be visible
+    # in file system timestamps.
+    scan_racy_margin = 2 * 10**9
 
     def __init__(
         self,
@@ -76,6 +107,18 @@ class Repository(object):
         self.schedule = schedule
         self.log = log.bind(subsystem="repo", job_name=self.name)
         self._lock_fds = {}
+        self._links = ParentLinks()
+        self._aggregates = TagAggregates()
+        self._version = 0
+        self._epoch = uuid.uuid4().hex[:8]
+        self._changes = 0
+        self._changed = {}
+        self._index = None
+        self.history = []
+        self._by_uuid = {}
+        self._info_files = {}
+        self._scan_mtime = None
+        self._reports_mtime = None
 
     def connect(self):
         self.path.mkdir(exist_ok=True)
@@ -95,12 +138,30 @@ class Repository(object):
         self.scan_reports()
 
     def scan_reports(self) -> None:
+        mtime = self._report_dir_mtime()
         self.report_ids = [
             g.name.removesuffix(".report")
             for g in self.report_path.glob("*.report")
         ]
+        # Like `scan`, we do not trust timestamps that are too recent.
+        if mtime is not None and time.time_ns() - mtime < self.scan_racy_margin:
+            mtime = None
+        self._reports_mtime = mtime
         self.log.debug("scan-reports", entries=len(self.report_ids))
 
+    def refresh_reports(self) -> None:
+        """Scan the problem reports if they may have changed since."""
+        mtime = self._report_dir_mtime()
+        if mtime is not None and mtime == self._reports_mtime:
+            return
+        self.scan_reports()
+
+    def _report_dir_mtime(self) -> Optional[int]:
+        try:
+            return self.report_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
     @property
     def sla(self) -> bool:
         """Is the SLA currently held?
@@ -116,14 +177,24 @@ class Repository(object):
     @property
     def sla_overdue(self) -> int:
         """Amount of time the SLA is currently overdue."""
-        if not self.clean_history:
+        last = self.last_clean
+        deadline = self.sla_deadline
+        if last is None or deadline is None:
             return 0
-        age = backy.utils.now() - self.clean_history[-1].timestamp
-        max_age = min(x["interval"] for x in self.schedule.schedule.values())
-        if age > max_age * 1.5:
-            return age.total_seconds()
+        now = backy.utils.now()
+        if now > deadline:
+            return (now - last.timestamp).total_seconds()
         return 0
 
+    @property
+    def sla_deadline(self) -> Optional[datetime.datetime]:
+        """The time until which the SLA is held without a new backup."""
+        last = self.last_clean
+        if last is None:
+            return None
+        max_age = min(x["interval"] for x in self.schedule.schedule.values())
+        return last.timestamp + max_age * 1.5
+
     # Locking strategy:
     #
     # - You can only run one backup of a machine at a time, as the backup will
@@ -208,18 +279,156 @@ class Repository(object):
         return self.path.name
 
     def scan(self) -> None:
-        self.history = []
-        self._by_uuid = {}
-        for f in self.path.glob("*.rev"):
-            if f.is_symlink():
-                # Ignore links that are used to create readable pointers
-                continue
-            r = Revision.load(f, self, self.log)
-            if r.uuid not in self._by_uuid:
-                self._by_uuid[r.uuid] = r
-                self.history.append(r)
+        """Update the history from the revision info files.
+
+        Scanning is cheap if nothing changed: we skip unchanged directories
+        entirely and only parse info files that are new or have changed.
+        Revisions keep their identity across scans as long as their info
+        file matches them. Changed info files result in new revision objects:
+        updating the existing ones in place would lose unsaved changes and
+        swap out the metadata under whoever is working on them.
+
+        Info files are written atomically (i.e. replaced) which updates the
+        directory's mtime and the file's inode. Like git's index we do not
+        trust timestamps that are too recent to tell apart from concurrent
+        modifications.
+
+        """
+        try:
+            dir_mtime: Optional[int] = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime = None
+        if dir_mtime is not None and dir_mtime == self._scan_mtime:
+            return
+        now = time.time_ns()
+        racy = dir_mtime is None or now - dir_mtime < self.scan_racy_margin
+        history = []
+        by_uuid: dict[str, Revision] = {}
+        info_files: dict[str, tuple[Optional[tuple], Revision]] = {}
+        for entry in self._rev_entries():
+            stat = entry.stat(follow_symlinks=False)
+            key: Optional[tuple] = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if now - stat.st_mtime_ns < self.scan_racy_margin:
+                key = None
+                racy = True
+            cached = self._info_files.get(entry.name)
+            if key is not None and cached is not None and cached[0] == key:
+                r = cached[1]
+            else:
+                r = Revision.from_dict(
+                    Revision.read_info(Path(entry.path)), self, self.log
+                )
+                known: Optional[Revision] = self._by_uuid.get(r.uuid)
+                if known is not None and _metadata(known) == _metadata(r):
+                    r = known
+                else:
+                    self._note_change(r.uuid)
+            info_files[entry.name] = (key, r)
+            if r.uuid not in by_uuid:
+                by_uuid[r.uuid] = r
+                history.append(r)
+        for rev_uuid in self._by_uuid.keys() - by_uuid.keys():
+            self._note_change(rev_uuid, removed=True)
         # The history is stored: oldest first. newest last.
-        self.history.sort(key=lambda r: r.timestamp)
+        history.sort(key=lambda r: r.timestamp)
+        self.history = history
+        self._by_uuid = by_uuid
+        self._info_files = info_files
+        self._scan_mtime = None if racy else dir_mtime
+
+    def _rev_entries(self) -> Iterator[os.DirEntry]:
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    # Ignore links that are used to create readable pointers
+                    if entry.name.endswith(".rev") and not entry.is_symlink():
+                        yield entry
+        except FileNotFoundError:
+            return
+
+    @property
+    def history(self) -> List[Revision]:
+        """All revisions, oldest first."""
+        return self._history
+
+    @history.setter
+    def history(self, history: List[Revision]) -> None:
+        self._history = history
+        self._version += 1
+        self._links.clear()
+        self._aggregates.clear()
+
+    def get_parent(
+        self, revision: Revision, ignore_trust: bool = False
+    ) -> Optional[Revision]:
+        """Return the previous revision of the same server.
+
+        Distrusted revisions are skipped unless `ignore_trust` is set. For
+        revisions that are not part of the history (or are distrusted
+        themselves and trust is not ignored) this is the last revision of
+        the server.
+        """
+        links = self._links
+        if len(links) != len(self._history):
+            # The history was modified without telling us.
+            links.rebuild(self._history)
+        return links.parent(revision, ignore_trust)
+
+    def _forget(self, revision: Revision) -> None:
+        """Remove a revision from the history."""
+        if revision not in self._history:
+            return
+        self._history.remove(revision)
+        self._by_uuid.pop(revision.uuid, None)
+        self._version += 1
+        self._note_change(revision.uuid, removed=True)
+        self._links.remove(revision)
+        self._aggregates.remove(revision)
+
+    def _revision_changed(self, revision: Revision) -> None:
+        """Invalidate what we derived from a revision's metadata."""
+        self._version += 1
+        self._note_change(revision.uuid)
+        self._aggregates.update(revision)
+
+    def _note_change(self, rev_uuid: str, removed: bool = False) -> None:
+        self._changes += 1
+        if removed:
+            self._changed.pop(rev_uuid, None)
+        else:
+            self._changed[rev_uuid] = self._changes
+
+    @property
+    def metadata_version(self) -> str:
+        """Identifies the state of the revision metadata.
+
+        The version changes whenever a revision is added, changed or removed.
+        Peers use it to only fetch the revisions that changed since they
+        last looked, see `changed_since`. Versions are only meaningful
+        within this process.
+
+        """
+        return f"{self._epoch}-{self._changes}"
+
+    def changed_since(self, version: Optional[str]) -> Optional[set[str]]:
+        """The uuids of the revisions that were added or changed after
+        `version`.
+
+        Returns None if we can not tell, e.g. because the version is from
+        another process.
+
+        """
+        epoch, _, changes = (version or "").partition("-")
+        if epoch != self._epoch or not changes.isdigit():
+            return None
+        since = int(changes)
+        if since > self._changes:
+            return None
+        return {u for u, c in self._changed.items() if c > since}
+
+    def _trust_changed(self, revision: Revision) -> None:
+        self._revision_changed(revision)
+        self._links.update_trust(revision)
 
     def touch(self):
         self.path.touch()
@@ -245,6 +454,30 @@ class Repository(object):
         """History without incomplete revisions."""
         return self.get_history(clean=True)
 
+    @property
+    def last_clean(self) -> Optional[Revision]:
+        """The newest revision that is not incomplete."""
+        return self._tag_aggregates().last_clean()
+
+    def last_clean_revisions(
+        self, count: int, local: bool = False
+    ) -> List[Revision]:
+        """The `count` newest clean revisions, oldest first."""
+        result: List[Revision] = []
+        for revision in reversed(self._tag_aggregates().clean):
+            if len(result) == count:
+                break
+            if not local or not revision.server:
+                result.append(revision)
+        return result[::-1]
+
+    def _tag_aggregates(self) -> "TagAggregates":
+        aggregates = self._aggregates
+        if len(aggregates) != len(self._history):
+            # The history was modified without telling us.
+            aggregates.rebuild(self._history)
+        return aggregates
+
     @property
     def local_history(self):
         """History without remote revisions."""
@@ -340,6 +573,38 @@ class Repository(object):
                 r.write_info()
         return True
 
+    @locked(target=".backup", mode="exclusive")
+    def set_tags(
+        self,
+        changes: dict[str, tuple[set[str], set[str]]],
+        autoremove: bool = False,
+    ) -> dict[str, Optional[bool]]:
+        """Set the tags of many revisions at once.
+
+        `changes` maps revision uuids to the tags we expect them to have and
+        their new tags. Returns whether the tags of each revision were set,
+        None for unknown revisions.
+
+        """
+        self.scan()
+        result: dict[str, Optional[bool]] = {}
+        for rev_uuid, (expect, tags) in changes.items():
+            r = self._by_uuid.get(rev_uuid)
+            if r is None:
+                result[rev_uuid] = None
+                continue
+            if expect != r.tags:
+                self.log.error("tags-expectation-failed", rev_uuid=rev_uuid)
+                result[rev_uuid] = False
+                continue
+            r.tags = tags
+            if not r.tags and autoremove:
+                r.remove()
+            else:
+                r.write_info()
+            result[rev_uuid] = True
+        return result
+
     @locked(target=".backup", mode="exclusive")
     def distrust(self, revs: Iterable[Revision]) -> None:
         for r in revs:
@@ -357,103 +622,20 @@ class Repository(object):
         Tags that have never been backed up won't show up here.
 
         """
-        last_times: dict[str, datetime.datetime] = {}
-        for revision in self.clean_history:
-            for tag in revision.tags:
-                last_times.setdefault(tag, min_date())
-                last_times[tag] = max([last_times[tag], revision.timestamp])
-        return last_times
-
-    def find_revisions(
-        self, spec: str | List[str | Revision | List[Revision]]
-    ) -> List[Revision]:
+        return self._tag_aggregates().last_by_tag()
+
+    def find_revisions(self, spec: str) -> List[Revision]:
         """Get a sorted list of revisions, oldest first, that match the given
         specification.
         """
+        return query.parse(spec).evaluate(self, self._query_index())
 
-        tokens: List[str | Revision | List[Revision]]
-        if isinstance(spec, str):
-            tokens = [
-                t.strip()
-                for t in re.split(r"(\(|\)|,|&|\.\.)", spec)
-                if t.strip()
-            ]
-        else:
-            tokens = spec
-        if "(" in tokens and ")" in tokens:
-            i = list_rindex(tokens, "(")
-            j = tokens.index(")", i)
-            prev, middle, next = tokens[:i], tokens[i + 1 : j], tokens[j + 1 :]
-
-            functions = {
-                "first": lambda x: x[0],
-                "last": lambda x: x[-1],
-                "not": lambda x: [r for r in self.history if r not in x],
-                "reverse": lambda x: list(reversed(x)),
-            }
-            if prev and isinstance(prev[-1], str) and prev[-1] in functions:
-                return self.find_revisions(
-                    prev[:-1]
-                    + [functions[prev[-1]](self.find_revisions(middle))]
-                    + next
-                )
-            return self.find_revisions(
-                prev + [self.find_revisions(middle)] + next
-            )
-        elif "," in tokens:
-            i = tokens.index(",")
-            return unique(
-                self.find_revisions(tokens[:i])
-                + self.find_revisions(tokens[i + 1 :])
-            )
-        elif "&" in tokens:
-            i = tokens.index("&")
-            return duplicates(
-                self.find_revisions(tokens[:i]),
-                self.find_revisions(tokens[i + 1 :]),
-            )
-        elif ".." in tokens:
-            _a, _b = list_split(tokens, "..")
-            assert len(_a) <= 1 and len(_b) <= 1
-            a = self.index_by_token(list_get(_a, 0, "first"))
-            b = self.index_by_token(list_get(_b, 0, "last"))
-            return self.history[ceil(min(a, b)) : floor(max(a, b)) + 1]
-        assert len(tokens) == 1
-        token = tokens[0]
-        if isinstance(token, Revision):
-            return [token]
-        elif isinstance(token, list):
-            return token
-        if token.startswith("server:"):
-            server = token.removeprefix("server:")
-            return [r for r in self.history if server == r.server]
-        elif token.startswith("tag:"):
-            tag = token.removeprefix("tag:")
-            return [r for r in self.history if tag in r.tags]
-        elif token.startswith("trust:"):
-            trust = Trust(token.removeprefix("trust:").lower())
-            return [r for r in self.history if trust == r.trust]
-        elif token == "all":
-            return self.history[:]
-        elif token == "clean":
-            return self.clean_history
-        elif token == "local":
-            return self.find_revisions("server:")
-        elif token == "remote":
-            return self.find_revisions("not(server:)")
-        else:
-            return [self.find(token)]
-
-    def index_by_token(self, spec: str | Revision | List[Revision]) -> float:
-        assert not isinstance(
-            spec, list
-        ), "can only index a single revision specifier"
-        if isinstance(spec, str):
-            return self.index_by_date(spec) or self.history.index(
-                self.find(spec)
-            )
-        else:
-            return self.history.index(spec)
+    def _query_index(self) -> query.RevisionIndex:
+        key = (self._version, len(self._history))
+        if self._index is None or self._index_key != key:
+            self._index = query.RevisionIndex(self._history)
+            self._index_key = key
+        return self._index
 
     def index_by_date(self, spec: str) -> Optional[float]:
         """Return index of revision matched by datetime.
@@ -463,22 +645,7 @@ class Repository(object):
         try:
             date = datetime.datetime.fromisoformat(spec)
             date = date.replace(tzinfo=date.tzinfo or tzlocal.get_localzone())
-            L = list_get(
-                [i for i, r in enumerate(self.history) if r.timestamp <= date],
-                -1,
-                -1,
-            )
-            r = list_get(
-                [i for i, r in enumerate(self.history) if r.timestamp >= date],
-                0,
-                len(self.history),
-            )
-            print(spec, L, r)
-            assert 0 <= r - L <= 1, (
-                "can not index with date if multiple revision have the same "
-                "timestamp"
-            )
-            return (L + r) / 2.0
+            return self._query_index().index_by_date(date)
         except ValueError:
             return None
 
@@ -546,3 +713,207 @@ class Repository(object):
                 pass
         self.log.warning("find-rev-not-found", spec=spec)
         raise KeyError(spec)
+
+
+class ParentLinks(object):
+    """Links each revision of a history to its parents.
+
+    Revisions are linked to their predecessors from the same server, once
+    including and once excluding distrusted revisions. Removing revisions
+    and changing their trust only updates the links around them.
+
+    """
+
+    # uuid -> revision in the history
+    entries: dict[str, Revision]
+    # uuid -> the previous/next revision of the same server
+    prev: dict[str, Optional[Revision]]
+    next: dict[str, Optional[Revision]]
+    # uuid -> the previous revision of the same server that is not distrusted
+    trusted_prev: dict[str, Optional[Revision]]
+    # server -> the last (not distrusted) revision
+    last: dict[str, Revision]
+    last_trusted: dict[str, Revision]
+    # The number of history entries these links represent.
+    size: int
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self) -> None:
+        self.entries = {}
+        self.prev = {}
+        self.next = {}
+        self.trusted_prev = {}
+        self.last = {}
+        self.last_trusted = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def rebuild(self, history: List[Revision]) -> None:
+        self.clear()
+        for r in history:
+            self.size += 1
+            if r.uuid in self.entries:
+                continue
+            prev = self.last.get(r.server)
+            self.entries[r.uuid] = r
+            self.prev[r.uuid] = prev
+            self.next[r.uuid] = None
+            if prev is not None:
+                self.next[prev.uuid] = r
+            self.trusted_prev[r.uuid] = self.last_trusted.get(r.server)
+            self.last[r.server] = r
+            if r.trust != Trust.DISTRUSTED:
+                self.last_trusted[r.server] = r
+
+    def _entry(self, revision: Revision) -> Optional[Revision]:
+        entry = self.entries.get(revision.uuid)
+        if entry is None or entry.server != revision.server:
+            return None
+        return entry
+
+    def parent(
+        self, revision: Revision, ignore_trust: bool
+    ) -> Optional[Revision]:
+        entry = self._entry(revision)
+        if ignore_trust:
+            if entry is None:
+                return self.last.get(revision.server)
+            return self.prev[entry.uuid]
+        if entry is None or entry.trust == Trust.DISTRUSTED:
+            return self.last_trusted.get(revision.server)
+        return self.trusted_prev[entry.uuid]
+
+    def _set_last(
+        self, last: dict[str, Revision], server: str, r: Optional[Revision]
+    ) -> None:
+        if r is None:
+            last.pop(server, None)
+        else:
+            last[server] = r
+
+    def _propagate_trusted(
+        self, revision: Revision, trusted: Optional[Revision]
+    ) -> None:
+        # Update the revisions that (may) link to `revision`: the following
+        # distrusted ones and the first trusted one.
+        r = self.next[revision.uuid]
+        while r is not None:
+            self.trusted_prev[r.uuid] = trusted
+            if r.trust != Trust.DISTRUSTED:
+                return
+            r = self.next[r.uuid]
+        self._set_last(self.last_trusted, revision.server, trusted)
+
+    def remove(self, revision: Revision) -> None:
+        if self.entries.get(revision.uuid) is not revision:
+            # Not linked (yet): the next lookup rebuilds the links.
+            return
+        self.size -= 1
+        del self.entries[revision.uuid]
+        self._propagate_trusted(revision, self.trusted_prev[revision.uuid])
+        prev = self.prev.pop(revision.uuid)
+        next = self.next.pop(revision.uuid)
+        del self.trusted_prev[revision.uuid]
+        if prev is not None:
+            self.next[prev.uuid] = next
+        if next is not None:
+            self.prev[next.uuid] = prev
+        else:
+            self._set_last(self.last, revision.server, prev)
+
+    def update_trust(self, revision: Revision) -> None:
+        if self.entries.get(revision.uuid) is not revision:
+            return
+        if revision.trust == Trust.DISTRUSTED:
+            self._propagate_trusted(revision, self.trusted_prev[revision.uuid])
+        else:
+            self._propagate_trusted(revision, revision)
+
+
+class TagAggregates(object):
+    """The clean revisions of a history by tag, oldest first.
+
+    Writing and removing a revision only updates the tags it has (or had),
+    so the last clean backup of every tag is known without walking the
+    history.
+
+    """
+
+    # All clean revisions and the clean revisions of each tag.
+    clean: List[Revision]
+    by_tag: dict[str, List[Revision]]
+    # revision -> (tags, clean) as it was last seen
+    known: dict[Revision, tuple[frozenset[str], bool]]
+    # The number of history entries these aggregates represent.
+    size: int
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self) -> None:
+        self.clean = []
+        self.by_tag = {}
+        self.known = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def rebuild(self, history: List[Revision]) -> None:
+        self.clear()
+        for r in history:
+            self.size += 1
+            if r not in self.known:
+                self._add(r)
+
+    def _add(self, revision: Revision) -> None:
+        tags = frozenset(revision.tags)
+        clean = "duration" in revision.stats
+        self.known[revision] = (tags, clean)
+        if not clean:
+            return
+        bisect.insort(self.clean, revision, key=_timestamp)
+        for tag in tags:
+            bisect.insort(
+                self.by_tag.setdefault(tag, []), revision, key=_timestamp
+            )
+
+    def _discard(self, revision: Revision) -> None:
+        tags, clean = self.known.pop(revision)
+        if not clean:
+            return
+        self.clean.remove(revision)
+        for tag in tags:
+            revisions = self.by_tag[tag]
+            revisions.remove(revision)
+            if not revisions:
+                del self.by_tag[tag]
+
+    def update(self, revision: Revision) -> None:
+        state = self.known.get(revision)
+        if state is None:
+            # Not (yet) part of the history: picked up by the next rebuild.
+            return
+        if state == (frozenset(revision.tags), "duration" in revision.stats):
+            return
+        self._discard(revision)
+        self._add(revision)
+
+    def remove(self, revision: Revision) -> None:
+        self.size -= 1
+        if revision in self.known:
+            self._discard(revision)
+
+    def last_clean(self) -> Optional[Revision]:
+        return self.clean[-1] if self.clean else None
+
+    def last_by_tag(self) -> dict[str, datetime.datetime]:
+        return {tag: revs[-1].timestamp for tag, revs in self.by_tag.items()}
+
+
+def _timestamp(revision: Revision) -> datetime.datetime:
+    return revision.timestamp
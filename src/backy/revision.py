@@ -74,11 +74,14 @@ class Revision(object):
     def load(
         cls, file: Path, backup: "Repository", log: BoundLogger
     ) -> "Revision":
-        with file.open(encoding="utf-8") as f:
-            metadata = yaml.safe_load(f)
-        r = cls.from_dict(metadata, backup, log)
+        r = cls.from_dict(cls.read_info(file), backup, log)
         return r
 
+    @staticmethod
+    def read_info(file: Path) -> dict:
+        with file.open(encoding="utf-8") as f:
+            return yaml.safe_load(f)
+
     @classmethod
     def from_dict(cls, metadata, backup, log):
         ts = metadata["timestamp"]
@@ -110,6 +113,7 @@ class Revision(object):
             f.open_new("wb")
             f.write("# Please use the `backy tags` subcommand to edit tags\n")
             yaml.safe_dump(self.to_dict(), f)
+        self.repository._revision_changed(self)
 
     def to_dict(self) -> dict:
         return {
@@ -134,11 +138,13 @@ class Revision(object):
         assert not self.server
         self.log.info("distrusted")
         self.trust = Trust.DISTRUSTED
+        self.repository._trust_changed(self)
 
     def verify(self) -> None:
         assert not self.server
         self.log.info("verified")
         self.trust = Trust.VERIFIED
+        self.repository._trust_changed(self)
 
     def remove(self, force=False) -> None:
         self.log.info("remove")
@@ -152,9 +158,7 @@ class Revision(object):
                 self.info_filename.unlink()
                 self.log.debug("remove-end", filename=str(self.info_filename))
 
-            if self in self.repository.history:
-                self.repository.history.remove(self)
-                del self.repository._by_uuid[self.uuid]
+            self.repository._forget(self)
 
     def writable(self) -> None:
         self.info_filename.chmod(0o640)
@@ -164,13 +168,4 @@ class Revision(object):
 
     def get_parent(self, ignore_trust=False) -> Optional["Revision"]:
         """defaults to last rev if not in history"""
-        prev = None
-        for r in self.repository.history:
-            if not ignore_trust and r.trust == Trust.DISTRUSTED:
-                continue
-            if r.server != self.server:
-                continue
-            if r.uuid == self.uuid:
-                break
-            prev = r
-        return prev
+        return self.repository.get_parent(self, ignore_trust)
@@ -180,8 +180,21 @@ class Source(ABC, Generic[RestoreArgsType]):
         p.add_argument("revision", help="Revision to work on.")
         p.set_defaults(func="verify")
 
+        cls.setup_subcommands(subparsers)
+
         return parser
 
+    @classmethod
+    def setup_subcommands(cls, subparsers: Any) -> None:
+        """Add source specific subcommands to the argument parser.
+
+        Subcommands are dispatched to `run_subcommand`.
+        """
+        pass
+
+    def run_subcommand(self, func: str, args: argparse.Namespace) -> int:
+        raise ValueError("invalid function: " + func)
+
     @classmethod
     def main(cls, *str_args: str) -> int:
         parser = cls.create_argparse()
@@ -222,7 +235,7 @@ class Source(ABC, Generic[RestoreArgsType]):
                     rev = source.repository.find_by_uuid(args.revision)
                     source.verify(rev)
                 case _:
-                    raise ValueError("invalid function: " + args.fun)
+                    ret = source.run_subcommand(args.func, args)
             log.debug("return-code", code=ret)
             return ret
         except Exception as e:
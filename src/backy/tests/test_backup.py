@@ -1,4 +1,7 @@
+import os
 import shutil
+import time
+from unittest import mock
 
 import pytest
 
@@ -211,3 +214,160 @@ def test_find_should_raise_if_not_found(repository, log):
     repository.scan()
     with pytest.raises(KeyError):
         repository.find("no such revision")
+
+
+def test_scan_only_parses_changed_revisions(
+    repository_with_revisions, tmp_path, monkeypatch
+):
+    a = repository_with_revisions
+    # Pretend that everything has been written a while ago.
+    past = time.time_ns() - 3600 * 10**9
+    for path in [*tmp_path.glob("*.rev"), tmp_path]:
+        os.utime(path, ns=(past, past))
+    a.scan()
+    revs = a.history[:]
+
+    parsed = []
+    read_info = Revision.read_info
+    monkeypatch.setattr(
+        Revision,
+        "read_info",
+        lambda file: parsed.append(file.name) or read_info(file),
+    )
+    a.scan()
+    assert parsed == []
+    assert a.history == revs
+    assert all(x is y for x, y in zip(a.history, revs))
+
+    # Writing a revision replaces its info file.
+    revs[0].tags = {"daily"}
+    revs[0].write_info()
+    revs[0].tags = {"stale"}
+    a.scan()
+    assert parsed == ["123-0.rev"]
+    assert a.history[0] is not revs[0]
+    assert a.history[0].tags == {"daily"}
+    assert revs[0].tags == {"stale"}
+    assert all(x is y for x, y in zip(a.history[1:], revs[1:]))
+    revs[0] = a.history[0]
+
+    (tmp_path / "123-1.rev").unlink()
+    a.scan()
+    assert [x.uuid for x in a.history] == ["123-0", "123-2"]
+    assert a.history[1] is revs[2]
+    with pytest.raises(IndexError):
+        a.find_by_uuid("123-1")
+
+
+def test_scan_rereads_recently_modified_revisions(repository_with_revisions):
+    a = repository_with_revisions
+    rev = a.find_by_uuid("123-2")
+    path = a.path / "123-2.rev"
+    # Modify in place, with the same size, right after the scan.
+    path.write_text(path.read_text().replace("[daily]", "[dayly]"))
+    a.scan()
+    assert a.find_by_uuid("123-2") is not rev
+    assert a.find_by_uuid("123-2").tags == {"dayly"}
+    assert rev.tags == {"daily"}
+
+
+def test_scan_keeps_revisions_that_match_their_info_file(
+    repository_with_revisions,
+):
+    a = repository_with_revisions
+    revs = a.history[:]
+    # Racy files are parsed again, but still match.
+    a._scan_mtime = None
+    a._info_files.clear()
+    a.scan()
+    assert all(x is y for x, y in zip(a.history, revs))
+
+
+def test_last_by_tag_follows_revision_changes(
+    repository_with_revisions, monkeypatch
+):
+    a = repository_with_revisions
+    rev0, rev1, rev2 = a.history
+    assert a.last_by_tag() == {
+        "daily": rev1.timestamp,
+        "weekly": rev1.timestamp,
+        "monthly": rev0.timestamp,
+    }
+    assert a.last_clean is rev1
+
+    # Revisions are only aggregated once per history.
+    monkeypatch.setattr(
+        a._aggregates, "rebuild", mock.Mock(side_effect=AssertionError)
+    )
+    # A backup finished.
+    rev2.stats["duration"] = 1.0
+    rev2.write_info()
+    assert a.last_clean is rev2
+    assert a.last_by_tag()["daily"] == rev2.timestamp
+
+    # Retagged.
+    rev1.tags = {"manual:foo"}
+    rev1.write_info()
+    assert a.last_by_tag() == {
+        "daily": rev2.timestamp,
+        "weekly": rev0.timestamp,
+        "monthly": rev0.timestamp,
+        "manual:foo": rev1.timestamp,
+    }
+
+    # Remote revisions lose their tags, local ones are gone.
+    rev2.remove()
+    assert a.last_by_tag()["daily"] == rev0.timestamp
+    rev0.remove()
+    assert a.last_by_tag() == {"manual:foo": rev1.timestamp}
+    assert a.last_clean is rev2
+    assert a.sla_overdue > 0
+
+
+def test_changed_since(repository_with_revisions, tmp_path):
+    a = repository_with_revisions
+    past = time.time_ns() - 3600 * 10**9
+    for path in [*tmp_path.glob("*.rev"), tmp_path]:
+        os.utime(path, ns=(past, past))
+    a.scan()
+    version = a.metadata_version
+    a.scan()
+    assert a.metadata_version == version
+    assert a.changed_since(version) == set()
+
+    rev0, rev1, rev2 = a.history
+    rev1.tags = {"manual:foo"}
+    rev1.write_info()
+    assert a.changed_since(version) == {"123-1"}
+    rev0.remove()
+    assert a.changed_since(version) == {"123-1"}
+    assert a.metadata_version != version
+
+    (tmp_path / "123-2.rev").unlink()
+    a.scan()
+    assert a.changed_since(version) == {"123-1"}
+    assert [r.uuid for r in a.history] == ["123-1"]
+
+    assert a.changed_since(None) is None
+    assert a.changed_since("other-0") is None
+    assert a.changed_since(a.metadata_version + "0") is None
+
+
+def test_set_tags(repository_with_revisions):
+    a = repository_with_revisions
+    assert a.set_tags(
+        {
+            "123-0": ({"daily", "weekly", "monthly"}, {"manual:a"}),
+            "123-1": ({"daily"}, {"manual:b"}),
+            "123-2": ({"daily"}, set()),
+            "123-3": (set(), {"manual:c"}),
+        },
+        autoremove=True,
+    ) == {"123-0": True, "123-1": False, "123-2": True, "123-3": None}
+    a.scan()
+    assert [(r.uuid, r.tags) for r in a.history] == [
+        ("123-0", {"manual:a"}),
+        ("123-1", {"daily", "weekly"}),
+        # Copies of remote revisions are only marked for removal.
+        ("123-2", set()),
+    ]
@@ -0,0 +1,234 @@
+import datetime
+import random
+import re
+from math import ceil, floor
+
+import pytest
+import tzlocal
+
+from backy import query
+from backy.revision import Revision, Trust
+from backy.utils import duplicates, list_get, list_rindex, list_split, unique
+
+UTC = datetime.timezone.utc
+BASE = datetime.datetime(2015, 8, 29, tzinfo=UTC)
+
+
+def legacy_find_revisions(repo, spec):
+    # The recursive implementation that the query engine replaces.
+    if isinstance(spec, str):
+        tokens = [
+            t.strip() for t in re.split(r"(\(|\)|,|&|\.\.)", spec) if t.strip()
+        ]
+    else:
+        tokens = spec
+    if "(" in tokens and ")" in tokens:
+        i = list_rindex(tokens, "(")
+        j = tokens.index(")", i)
+        prev, middle, next = tokens[:i], tokens[i + 1 : j], tokens[j + 1 :]
+        functions = {
+            "first": lambda x: x[0],
+            "last": lambda x: x[-1],
+            "not": lambda x: [r for r in repo.history if r not in x],
+            "reverse": lambda x: list(reversed(x)),
+        }
+        if prev and isinstance(prev[-1], str) and prev[-1] in functions:
+            return legacy_find_revisions(
+                repo,
+                prev[:-1]
+                + [functions[prev[-1]](legacy_find_revisions(repo, middle))]
+                + next,
+            )
+        return legacy_find_revisions(
+            repo, prev + [legacy_find_revisions(repo, middle)] + next
+        )
+    elif "," in tokens:
+        i = tokens.index(",")
+        return unique(
+            legacy_find_revisions(repo, tokens[:i])
+            + legacy_find_revisions(repo, tokens[i + 1 :])
+        )
+    elif "&" in tokens:
+        i = tokens.index("&")
+        return duplicates(
+            legacy_find_revisions(repo, tokens[:i]),
+            legacy_find_revisions(repo, tokens[i + 1 :]),
+        )
+    elif ".." in tokens:
+        _a, _b = list_split(tokens, "..")
+        assert len(_a) <= 1 and len(_b) <= 1
+        a = legacy_index_by_token(repo, list_get(_a, 0, "first"))
+        b = legacy_index_by_token(repo, list_get(_b, 0, "last"))
+        return repo.history[ceil(min(a, b)) : floor(max(a, b)) + 1]
+    assert len(tokens) == 1
+    token = tokens[0]
+    if isinstance(token, Revision):
+        return [token]
+    elif isinstance(token, list):
+        return token
+    if token.startswith("server:"):
+        server = token.removeprefix("server:")
+        return [r for r in repo.history if server == r.server]
+    elif token.startswith("tag:"):
+        tag = token.removeprefix("tag:")
+        return [r for r in repo.history if tag in r.tags]
+    elif token.startswith("trust:"):
+        trust = Trust(token.removeprefix("trust:").lower())
+        return [r for r in repo.history if trust == r.trust]
+    elif token == "all":
+        return repo.history[:]
+    elif token == "clean":
+        return repo.clean_history
+    elif token == "local":
+        return legacy_find_revisions(repo, "server:")
+    elif token == "remote":
+        return legacy_find_revisions(repo, "not(server:)")
+    else:
+        return [repo.find(token)]
+
+
+def legacy_index_by_token(repo, spec):
+    assert not isinstance(
+        spec, list
+    ), "can only index a single revision specifier"
+    if isinstance(spec, str):
+        return legacy_index_by_date(repo, spec) or repo.history.index(
+            repo.find(spec)
+        )
+    else:
+        return repo.history.index(spec)
+
+
+def legacy_index_by_date(repo, spec):
+    try:
+        date = datetime.datetime.fromisoformat(spec)
+        date = date.replace(tzinfo=date.tzinfo or tzlocal.get_localzone())
+        L = list_get(
+            [i for i, r in enumerate(repo.history) if r.timestamp <= date],
+            -1,
+            -1,
+        )
+        r = list_get(
+            [i for i, r in enumerate(repo.history) if r.timestamp >= date],
+            0,
+            len(repo.history),
+        )
+        assert 0 <= r - L <= 1
+        return (L + r) / 2.0
+    except ValueError:
+        return None
+
+
+@pytest.fixture
+def repository_with_history(repository, log):
+    rng = random.Random(0)
+    hours = sorted(rng.sample(range(200), 11)) + [150]
+    for i, hour in enumerate(sorted(hours)):
+        r = Revision.create(
+            repository,
+            set(rng.sample(["daily", "weekly", "monthly"], rng.randint(0, 2))),
+            log,
+            uuid=f"rev-{i}",
+        )
+        r.timestamp = BASE + datetime.timedelta(hours=hour)
+        r.server = rng.choice(["", "", "remote1"])
+        if not r.server:
+            r.trust = rng.choice(list(Trust))
+        if rng.random() < 0.8:
+            r.stats["duration"] = 1.0
+        r.write_info()
+    repository.scan()
+    return repository
+
+
+def random_spec(rng, depth=0):
+    atoms = [
+        "all",
+        "clean",
+        "local",
+        "remote",
+        "first",
+        "last",
+        "latest",
+        "-1",
+        "rev-3",
+        "rev-99",
+        "tag:daily",
+        "tag:weekly",
+        "tag:nope",
+        "trust:verified",
+        "trust:distrusted",
+        "trust:bogus",
+        "server:",
+        "server:remote1",
+        "2015-08-29",
+        "2015-09-04T06:00:00+00:00",
+        "2015-08-30T12:00:00+00:00",
+        "2015-09-10",
+    ] + [str(i) for i in range(14)]
+    if depth > 3:
+        return rng.choice(atoms)
+    match rng.randrange(8):
+        case 0 | 1:
+            return rng.choice(atoms)
+        case 2:
+            function = rng.choice(query.FUNCTIONS)
+            return f"{function}({random_spec(rng, depth + 1)})"
+        case 3:
+            return f"({random_spec(rng, depth + 1)})"
+        case 4:
+            return (
+                f"{random_spec(rng, depth + 1)}, {random_spec(rng, depth + 1)}"
+            )
+        case 5:
+            return (
+                f"{random_spec(rng, depth + 1)}&{random_spec(rng, depth + 1)}"
+            )
+        case 6:
+            bounds = atoms + ["", "first(tag:daily)", "last(clean)", "(all)"]
+            return f"{rng.choice(bounds)}..{rng.choice(bounds)}"
+        case _:
+            # Mangle a valid spec to also cover syntax errors.
+            spec = random_spec(rng, depth + 1)
+            i = rng.randrange(len(spec) + 1)
+            return (
+                spec[:i] + rng.choice(["(", ")", ",", "..", "&", ""]) + spec[i:]
+            )
+
+
+def evaluate(f, *args):
+    try:
+        return f(*args)
+    except Exception as e:
+        return type(e)
+
+
+def test_query_engine_matches_legacy_implementation(repository_with_history):
+    repo = repository_with_history
+    rng = random.Random(42)
+    errors = 0
+    for _ in range(3000):
+        spec = random_spec(rng)
+        expected = evaluate(legacy_find_revisions, repo, spec)
+        assert evaluate(repo.find_revisions, spec) == expected, spec
+        errors += not isinstance(expected, list)
+    # Make sure that we actually cover both.
+    assert 300 < errors < 2700
+
+
+def test_query_is_parsed_once():
+    query.parse.cache_clear()
+    query.parse("last(tag:daily)")
+    query.parse("last(tag:daily)")
+    assert query.parse.cache_info().hits == 1
+
+
+def test_index_follows_changes(repository_with_history):
+    repo = repository_with_history
+    r = repo.find("rev-3")
+    assert r not in repo.find_revisions("tag:yearly")
+    r.tags.add("yearly")
+    r.write_info()
+    assert repo.find_revisions("tag:yearly") == [r]
+    r.remove()
+    assert repo.find_revisions("tag:yearly") == []
@@ -1,11 +1,13 @@
 import datetime
+import random
 from pathlib import Path
 from unittest import mock
 
 import yaml
 
 import backy.utils
-from backy.revision import Revision
+from backy.repository import ParentLinks
+from backy.revision import Revision, Trust
 
 UTC = datetime.timezone.utc
 SAMPLE_DIR = Path(__file__).parent.joinpath("samples")
@@ -98,3 +100,67 @@ def test_delete_revision(repository, log):
     assert repository.path.joinpath("123-456.rev").exists()
     r.remove()
     assert not repository.path.joinpath("123-456.rev").exists()
+
+
+def linear_parent(revision, ignore_trust=False):
+    # The original implementation of `get_parent`.
+    prev = None
+    for r in revision.repository.history:
+        if not ignore_trust and r.trust == Trust.DISTRUSTED:
+            continue
+        if r.server != revision.server:
+            continue
+        if r.uuid == revision.uuid:
+            break
+        prev = r
+    return prev
+
+
+def test_get_parent_follows_history_changes(repository, log, monkeypatch):
+    rebuilds = []
+    rebuild = ParentLinks.rebuild
+    monkeypatch.setattr(
+        ParentLinks,
+        "rebuild",
+        lambda self, history: rebuilds.append(1) or rebuild(self, history),
+    )
+    rng = random.Random(0)
+    base = datetime.datetime(2015, 9, 1, tzinfo=UTC)
+    repository.history = []
+    for i in range(60):
+        r = Revision(
+            repository,
+            log,
+            uuid=f"r{i}",
+            timestamp=base + datetime.timedelta(hours=i),
+        )
+        r.server = rng.choice(["", "", "remote1", "remote2"])
+        if rng.random() < 0.2:
+            r.trust = Trust.DISTRUSTED
+        repository.history.append(r)
+    outsiders = [
+        Revision.create(repository, set(), log, uuid=f"new-{server}")
+        for server in ["", "remote1", "remote3"]
+    ]
+    outsiders[0].server = "remote1"
+
+    def check():
+        for r in repository.history + outsiders:
+            for ignore_trust in [False, True]:
+                assert r.get_parent(ignore_trust) is linear_parent(
+                    r, ignore_trust
+                ), (r.uuid, ignore_trust)
+
+    check()
+    for _ in range(40):
+        r = rng.choice(repository.history)
+        match rng.choice(["remove", "distrust", "verify"]):
+            case "remove":
+                r.remove(force=True)
+            case "distrust" if not r.server:
+                r.distrust()
+            case "verify" if not r.server:
+                r.verify()
+        check()
+    # Links are only built once and then updated incrementally.
+    assert len(rebuilds) == 1
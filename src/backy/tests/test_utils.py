@@ -14,6 +14,8 @@ from backy.utils import (
     TimeOutError,
     files_are_equal,
     files_are_roughly_equal,
+    punch_hole,
+    timed,
 )
 
 
@@ -320,6 +322,17 @@ def test_roughly_compare_files_timeout(tmp_path):
     assert not files_are_roughly_equal(open("a", "rb"), open("b", "rb"))
 
 
+def test_punch_hole(tmp_path):
+    path = tmp_path / "a"
+    path.write_bytes(b"a" * 3 * 4096)
+    with open(path, "r+b") as f:
+        try:
+            punch_hole(f.fileno(), 4096, 4096)
+        except OSError:
+            pytest.skip("file system does not support punching holes")
+    assert path.read_bytes() == b"a" * 4096 + bytes(4096) + b"a" * 4096
+
+
 def test_unmocked_now_returns_time_time_float():
     before = datetime.datetime.now(ZoneInfo("UTC"))
     now = backy.utils.now()
@@ -346,6 +359,25 @@ def test_raise_on_timeout(capsys):
     assert "tick\ntick\ntick" in out
 
 
+def test_timed(monkeypatch):
+    clock = iter([10.0, 12.5, 20.0, 21.0, 30.0, 30.5])
+    monkeypatch.setattr("time.perf_counter", lambda: next(clock))
+    stats: dict = {}
+    with timed(stats, "export") as phase:
+        phase["bytes"] = 42
+    with timed(stats, "sync"):
+        pass
+    with pytest.raises(RuntimeError):
+        with timed(stats, "export"):
+            raise RuntimeError()
+    assert stats == {
+        "phases": {
+            "export": {"duration": 3.0, "bytes": 42},
+            "sync": {"duration": 1.0},
+        }
+    }
+
+
 async def test_adjustable_bound_semaphore_simple():
     async def acquire(sem, num, assert_full=True):
         for _ in range(num):
@@ -1,7 +1,9 @@
 import asyncio
 import base64
 import contextlib
+import ctypes
 import datetime
+import errno
 import hashlib
 import mmap
 import os
@@ -223,6 +225,33 @@ else:  # pragma: no cover
         return
 
 
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+if sys.platform == "linux":
+    _libc = ctypes.CDLL(None, use_errno=True)
+
+    def punch_hole(fd: int, offset: int, length: int) -> None:
+        """Deallocate a range of a file. It will read as zeroes.
+
+        Raises OSError if the file (system) does not support this.
+        """
+        result = _libc.fallocate(
+            fd,
+            FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE,
+            ctypes.c_int64(offset),
+            ctypes.c_int64(length),
+        )
+        if result:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+else:  # pragma: no cover
+
+    def punch_hole(fd: int, offset: int, length: int) -> None:
+        raise OSError(errno.EOPNOTSUPP, "Punching holes is not supported")
+
+
 if sys.platform == "darwin":  # pragma: no cover
 
     @contextlib.contextmanager
@@ -430,9 +459,13 @@ async def has_recent_changes(path: str, reference_time: float) -> bool:
 
 
 async def delay_or_event(delay: float, event: Event) -> Optional[Literal[True]]:
-    return await next(
-        asyncio.as_completed([asyncio.sleep(delay), event.wait()])
-    )
+    if event.is_set():
+        return True
+    try:
+        # Does not leave a sleeping or waiting task behind.
+        return await asyncio.wait_for(event.wait(), delay)
+    except TimeoutError:
+        return None
 
 
 async def time_or_event(
@@ -538,6 +571,22 @@ class TimeOut(object):
         return True
 
 
+@contextlib.contextmanager
+def timed(stats: dict, phase: str) -> typing.Iterator[dict]:
+    """Account the time spent in the block to `phase` in `stats`.
+
+    Phases are kept in `stats["phases"]` with their `duration` in seconds.
+    Entering a phase again adds to its duration. The block may put further
+    counters, like `bytes`, into the dict it gets.
+    """
+    entry = stats.setdefault("phases", {}).setdefault(phase, {"duration": 0})
+    started = time.perf_counter()
+    try:
+        yield entry
+    finally:
+        entry["duration"] += time.perf_counter() - started
+
+
 class BackyJSONEncoder(JSONEncoder):
     def default(self, o: Any) -> Any:
         if hasattr(o, "to_dict"):